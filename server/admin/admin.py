@@ -1,26 +1,106 @@
-from fastapi import APIRouter, Depends, Path, Body, HTTPException, status
+from fastapi import APIRouter, Depends, Path, Query, Body, HTTPException, status
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
+from sqlalchemy import update, literal, any_, exists, select
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.types import Integer
 from math import ceil
+from datetime import datetime, timezone
+from typing import Optional
 from database import get_db
 from authentication.jwt import get_current_user
-from models import Users, UserRoles, Bookings
-from admin.types.admin_types import UsersResponse
+from models import Users, Bookings
+from admin.types.admin_types import (
+    UsersResponse,
+    UsersCursorResponse,
+    AutocompleteResponse,
+    MembershipBulkUpdate,
+    RoleBulkUpdate,
+    BulkUpdateResponse,
+)
+from admin.user_search import user_search_filter, user_search_order
+from admin.member_index import member_index
+from reference_cache import role_names, role_name
+import events
+from bookings.availability import refresh_box_days
+from bookings.partitions import booking_day_range
+from pagination import encode_cursor, decode_cursor, cached_count, invalidate_counts
 
 from .admin_boxes import boxes_router
 from .admin_stats import stats_router
+from .admin_export import export_router
+from .admin_diagnostics import diagnostics_router
 
 admin_router = APIRouter(
     dependencies=[Depends(get_current_user)]
 )
 admin_router.include_router(boxes_router)
 admin_router.include_router(stats_router)
+admin_router.include_router(export_router)
+admin_router.include_router(diagnostics_router)
 
 
 #######################
 #### GET ALL USERS ####
 
 
+def user_list_query(db: Session):
+    # Get specific user fields, role names come from the reference cache
+    return db.query(
+        Users.user_id,
+        Users.user_first_name,
+        Users.user_last_name,
+        Users.user_email,
+        Users.user_phone,
+        Users.is_member,
+        Users.user_role_fk,
+    )
+
+
+def to_user_dicts(db: Session, users) -> list:
+    roles = role_names(db)
+    return [
+        {
+            "user_id": user.user_id,
+            "first_name": user.user_first_name,
+            "last_name": user.user_last_name,
+            "email": user.user_email,
+            "phone": user.user_phone,
+            "is_member": user.is_member,
+            "role": roles.get(user.user_role_fk) or role_name(db, user.user_role_fk),
+        }
+        for user in users
+    ]
+
+
+def count_center_users(db: Session, fitness_center_id: int, search_query: str = None):
+    def count():
+        query = db.query(Users).filter(Users.fitness_center_fk == fitness_center_id)
+        if search_query:
+            query = query.filter(user_search_filter(search_query))
+        return query.count()
+
+    key = ("users", fitness_center_id, (search_query or "").strip().lower())
+    return cached_count(key, count)
+
+
+def keyset_page(query, cursor: Optional[str], page_size: int):
+    # Rows are ordered by user_id so the next page starts right after the
+    # last id that was returned instead of skipping over OFFSET rows
+    if cursor:
+        last_user_id = decode_cursor(cursor).get("user_id")
+        if not isinstance(last_user_id, int):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.filter(Users.user_id > last_user_id)
+
+    rows = query.order_by(Users.user_id).limit(page_size + 1).all()
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor({"user_id": rows[-1].user_id})
+    return rows, next_cursor
+
+
 @admin_router.get(
     "/users/{fitness_center_id}/{page}/{page_size}",
     response_model=UsersResponse,
@@ -34,44 +114,19 @@ def get_all_users(
     skip = (page - 1) * page_size
 
     # Get total count of filtered users
-    total_users = (
-        db.query(Users).filter(Users.fitness_center_fk == fitness_center_id).count()
-    )
+    total_users = count_center_users(db, fitness_center_id)
 
-    # Get specific user fields with join to get role name
     users = (
-        db.query(
-            Users.user_id,
-            Users.user_first_name,
-            Users.user_last_name,
-            Users.user_email,
-            Users.user_phone,
-            Users.is_member,
-            UserRoles.role_name.label("user_role"),
-        )
-        .join(UserRoles)
+        user_list_query(db)
         .filter(Users.fitness_center_fk == fitness_center_id)
+        .order_by(Users.user_id)
         .offset(skip)
         .limit(page_size)
         .all()
     )
 
-    # Convert SQLAlchemy result to dict
-    users_list = [
-        {
-            "user_id": user.user_id,
-            "first_name": user.user_first_name,
-            "last_name": user.user_last_name,
-            "email": user.user_email,
-            "phone": user.user_phone,
-            "is_member": user.is_member,
-            "role": user.user_role,
-        }
-        for user in users
-    ]
-
     return {
-        "users": users_list,
+        "users": to_user_dicts(db, users),
         "total": total_users,
         "page": page,
         "page_size": page_size,
@@ -79,6 +134,30 @@ def get_all_users(
     }
 
 
+@admin_router.get(
+    "/users/{fitness_center_id}",
+    response_model=UsersCursorResponse,
+)
+def get_users_page(
+    db: Session = Depends(get_db),
+    fitness_center_id: int = Path(..., description="ID of the fitness center"),
+    cursor: Optional[str] = Query(None, description="Cursor from the previous page"),
+    page_size: int = Query(50, gt=0, le=500, description="Number of items per page"),
+    include_total: bool = Query(False, description="Include the (cached) total"),
+):
+    query = user_list_query(db).filter(Users.fitness_center_fk == fitness_center_id)
+    users, next_cursor = keyset_page(query, cursor, page_size)
+
+    return {
+        "users": to_user_dicts(db, users),
+        "next_cursor": next_cursor,
+        "page_size": page_size,
+        "total": (
+            count_center_users(db, fitness_center_id) if include_total else None
+        ),
+    }
+
+
 ######################
 #### SEARCH USERS ####
 
@@ -95,53 +174,24 @@ def search_users(
     page_size: int = Path(..., description="Number of items per page", gt=0),
 ):
     skip = (page - 1) * page_size
-    search_term = f"%{search_query.strip()}%"
 
-    # Build base query with specific fields
-    base_query = db.query(
-        Users.user_id,
-        Users.user_first_name,
-        Users.user_last_name,
-        Users.user_email,
-        Users.user_phone,
-        Users.is_member,
-        UserRoles.role_name.label("user_role"),
-    ).join(UserRoles)
-
-    # Simplified search filter
-    search_filter = (
-        Users.user_first_name.ilike(search_term)
-        | Users.user_last_name.ilike(search_term)
-        | Users.user_email.ilike(search_term)
-        | Users.user_phone.ilike(search_term)
-    )
-
-    filtered_query = base_query.filter(
-        Users.fitness_center_fk == fitness_center_id, search_filter
+    filtered_query = user_list_query(db).filter(
+        Users.fitness_center_fk == fitness_center_id, user_search_filter(search_query)
     )
 
     # Get total count for pagination
-    total_users = filtered_query.count()
+    total_users = count_center_users(db, fitness_center_id, search_query)
 
-    # Get paginated results
-    users = filtered_query.offset(skip).limit(page_size).all()
+    # Get paginated results, best matches first
+    users = (
+        filtered_query.order_by(*user_search_order(db, search_query))
+        .offset(skip)
+        .limit(page_size)
+        .all()
+    )
 
-    # Convert to list of dicts
-    users_list = [
-        {
-            "user_id": user.user_id,
-            "first_name": user.user_first_name,
-            "last_name": user.user_last_name,
-            "email": user.user_email,
-            "phone": user.user_phone,
-            "is_member": user.is_member,
-            "role": user.user_role,
-        }
-        for user in users
-    ]
-    print(filtered_query.statement)
     return {
-        "users": users_list,
+        "users": to_user_dicts(db, users),
         "total": total_users,
         "page": page,
         "page_size": page_size,
@@ -149,6 +199,75 @@ def search_users(
     }
 
 
+@admin_router.get(
+    "/search-users/{fitness_center_id}/{search_query}",
+    response_model=UsersCursorResponse,
+)
+def search_users_page(
+    db: Session = Depends(get_db),
+    fitness_center_id: int = Path(..., description="ID of the fitness center"),
+    search_query: str = Path(..., min_length=1, description="Search query for users"),
+    cursor: Optional[str] = Query(None, description="Cursor from the previous page"),
+    page_size: int = Query(50, gt=0, le=500, description="Number of items per page"),
+    include_total: bool = Query(False, description="Include the (cached) total"),
+):
+    query = user_list_query(db).filter(
+        Users.fitness_center_fk == fitness_center_id, user_search_filter(search_query)
+    )
+    users, next_cursor = keyset_page(query, cursor, page_size)
+
+    return {
+        "users": to_user_dicts(db, users),
+        "next_cursor": next_cursor,
+        "page_size": page_size,
+        "total": (
+            count_center_users(db, fitness_center_id, search_query)
+            if include_total
+            else None
+        ),
+    }
+
+
+######################
+#### AUTOCOMPLETE ####
+
+
+@admin_router.get(
+    "/autocomplete/{fitness_center_id}/{search_query}",
+    response_model=AutocompleteResponse,
+)
+def autocomplete_users(
+    db: Session = Depends(get_db),
+    fitness_center_id: int = Path(..., description="ID of the fitness center"),
+    search_query: str = Path(..., min_length=1, description="Start of name, email or phone"),
+    limit: int = Query(10, gt=0, le=50, description="Max number of suggestions"),
+):
+    # Answered from the in-memory index, the database is only used while
+    # the index is disabled or still being built
+    if member_index.ready:
+        return {"users": member_index.search(fitness_center_id, search_query, limit)}
+
+    users = (
+        db.query(
+            Users.user_id,
+            Users.fitness_center_fk,
+            Users.user_first_name,
+            Users.user_last_name,
+            Users.user_email,
+            Users.user_phone,
+            Users.is_member,
+        )
+        .filter(
+            Users.fitness_center_fk == fitness_center_id,
+            user_search_filter(search_query),
+        )
+        .order_by(*user_search_order(db, search_query))
+        .limit(limit)
+        .all()
+    )
+    return {"users": [events.user_payload(user) for user in users]}
+
+
 @admin_router.get("/booking/{booking_id}")
 def get_booking_by_id(
     booking_id: int,
@@ -197,10 +316,162 @@ def update_membership(
         return {"error": "User not found"}
 
     user.is_member = data.is_member
+    events.emit(db, events.USER_CHANGED, events.user_payload(user))
     db.commit()
     return {"message": "Membership status updated successfully"}
 
 
+def current_center_id(current_user: dict) -> Optional[int]:
+    # get_current_user returns the login's user info under user_info.sub
+    return current_user.get("user_info", {}).get("sub", {}).get("fitness_center_id")
+
+
+def check_own_center(fitness_center_id: int, current_user: dict):
+    """Admins can only change users of their own fitness center"""
+    if fitness_center_id != current_center_id(current_user):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Cannot update users of a different fitness center",
+        )
+
+
+USER_PAYLOAD_COLUMNS = (
+    Users.user_id,
+    Users.fitness_center_fk,
+    Users.user_first_name,
+    Users.user_last_name,
+    Users.user_email,
+    Users.user_phone,
+    Users.is_member,
+)
+
+
+@admin_router.put("/membership/bulk", response_model=BulkUpdateResponse)
+def bulk_update_membership(
+    data: MembershipBulkUpdate = Body(...),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user),
+):
+    check_own_center(data.fitness_center_id, current_user)
+    if not data.user_ids and not data.no_bookings_since:
+        raise HTTPException(
+            status_code=400, detail="Either user_ids or no_bookings_since is required"
+        )
+
+    # One UPDATE for the whole batch, inside a single transaction
+    statement = update(Users).where(Users.fitness_center_fk == data.fitness_center_id)
+    if data.user_ids:
+        statement = statement.where(
+            Users.user_id == any_(literal(data.user_ids, ARRAY(Integer)))
+        )
+    if data.no_bookings_since:
+        # Lapsed members: nothing booked since the given date
+        statement = statement.where(
+            Users.is_member != data.is_member,
+            ~exists().where(
+                Bookings.user_id == Users.user_id,
+                Bookings.booking_date >= data.no_bookings_since,
+            ),
+        )
+
+    try:
+        updated = db.execute(
+            statement.values(
+                is_member=data.is_member, updated_at=datetime.now(timezone.utc)
+            )
+            .returning(*USER_PAYLOAD_COLUMNS)
+            .execution_options(synchronize_session=False)
+        ).all()
+        for user in updated:
+            events.emit(db, events.USER_CHANGED, events.user_payload(user))
+
+        # Requested users the no_bookings_since filter left out are skipped,
+        # not missing
+        existing_ids = None
+        if data.user_ids and data.no_bookings_since:
+            existing_ids = center_user_ids(db, data.fitness_center_id, data.user_ids)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Bulk update failed: {str(e)}")
+
+    return bulk_results(
+        data.user_ids, [user.user_id for user in updated], existing_ids
+    )
+
+
+@admin_router.put("/role/bulk", response_model=BulkUpdateResponse)
+def bulk_change_user_role(
+    data: RoleBulkUpdate = Body(...),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user),
+):
+    check_own_center(data.fitness_center_id, current_user)
+    # Same roles as profile.change_user_role: admin (1) and user (2)
+    if data.role_id not in (1, 2):
+        raise HTTPException(status_code=400, detail="Unknown role")
+
+    try:
+        updated = db.execute(
+            update(Users)
+            .where(
+                Users.fitness_center_fk == data.fitness_center_id,
+                Users.user_id == any_(literal(data.user_ids, ARRAY(Integer))),
+            )
+            .values(user_role_fk=data.role_id, updated_at=datetime.now(timezone.utc))
+            .returning(*USER_PAYLOAD_COLUMNS)
+            .execution_options(synchronize_session=False)
+        ).all()
+        for user in updated:
+            events.emit(db, events.USER_CHANGED, events.user_payload(user))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Bulk update failed: {str(e)}")
+
+    return bulk_results(data.user_ids, [user.user_id for user in updated])
+
+
+def center_user_ids(db: Session, fitness_center_id: int, user_ids) -> set:
+    return set(
+        db.execute(
+            select(Users.user_id).where(
+                Users.fitness_center_fk == fitness_center_id,
+                Users.user_id == any_(literal(user_ids, ARRAY(Integer))),
+            )
+        ).scalars()
+    )
+
+
+def bulk_result_status(user_id: int, updated_ids: set, existing_ids) -> str:
+    if user_id in updated_ids:
+        return "updated"
+    if existing_ids is not None and user_id in existing_ids:
+        return "skipped"
+    return "not_found"
+
+
+def bulk_results(requested_ids, updated_ids, existing_ids=None):
+    """
+    Per user outcome of a bulk update, existing_ids are the requested users
+    that exist but were filtered out ("skipped")
+    """
+    updated_ids = set(updated_ids)
+    if not requested_ids:
+        requested_ids = sorted(updated_ids)
+    return {
+        "status": "success",
+        "updated": len(updated_ids),
+        "results": [
+            {
+                "user_id": user_id,
+                "status": bulk_result_status(user_id, updated_ids, existing_ids),
+            }
+            for user_id in dict.fromkeys(requested_ids)
+        ],
+    }
+
+
 ######################
 #### DELETE USER ####
 @admin_router.delete("/user/{user_id}")
@@ -217,13 +488,27 @@ def delete_user(
         )
 
     # Verify user belongs to same fitness center as admin
-    if user.fitness_center_fk != current_user.get("fitness_center_id"):
+    if user.fitness_center_fk != current_center_id(current_user):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Cannot delete user from different fitness center",
         )
 
+    # The user's coming bookings go with it, so their hours are freed up
+    booked_box_days = (
+        db.query(Bookings.booking_box_id_fk, Bookings.booking_date)
+        .filter(
+            Bookings.user_id == user_id,
+            Bookings.booking_date >= booking_day_range(datetime.now())[0],
+        )
+        .all()
+    )
     db.delete(user)
+    refresh_box_days(db, booked_box_days)
+    events.emit(db, events.USER_DELETED, {"user_id": user_id})
+    if booked_box_days:
+        events.emit(db, events.BOOKINGS_CHANGED, {"box_id": None, "day": None})
     db.commit()
+    invalidate_counts("users")
 
     return {"status": "success", "message": "User deleted successfully"}
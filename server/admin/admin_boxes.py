@@ -1,8 +1,24 @@
-from fastapi import APIRouter, Depends, Path, HTTPException
+from fastapi import APIRouter, Depends, Path, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, case, or_
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from typing import List, Literal, Optional
 from database import get_db
 from models import Boxes, Bookings
+from bookings.booking_stats import record_booking
+from bookings.booking_codes import allocate_booking_code
+from bookings.partitions import booking_day_range
+from bookings.availability import (
+    box_free_slots,
+    get_day_masks,
+    mark_booked,
+    refresh_box_days,
+)
+from reference_cache import center_boxes
+from bookings.box_cache import BOX_CLOSED, BOX_OPEN, box_dict
+from bookings.box_status import parse_status_label
+from admin.box_board import board_rows, board_stream, mark_is_booked
+import events
 from datetime import datetime, timedelta
 from admin.types.admin_types import (
     BoksUpdate,
@@ -10,8 +26,6 @@ from admin.types.admin_types import (
     BoxResponse,
     BoxAvailabilityByIdResponse,
 )
-import random
-import string
 
 
 boxes_router = APIRouter()
@@ -21,11 +35,6 @@ boxes_router = APIRouter()
 #### GET BOX AVALIABLILTY ####
 
 
-def does_time_overlap(start1: int, end1: int, start2: int, end2: int) -> bool:
-    """Check if two time periods overlap"""
-    return not (end1 <= start2 or start1 >= end2)
-
-
 @boxes_router.get(
     "/box-availability/{fitness_center_id}/{date}/{current_time}/{duration}",
     response_model=BoxAvailabilityResponse,
@@ -51,61 +60,17 @@ def get_box_availability(
         if next_available_hour is None:
             return {"message": "No more bookings available today"}
 
-        # Get all boxes for the fitness center
-        boxes = (
-            db.query(Boxes).filter(Boxes.fitness_center_fk == fitness_center_id).all()
-        )
-
-        # Get existing bookings for the date
-        bookings = (
-            db.query(Bookings)
-            .filter(
-                Bookings.booking_box_id_fk.in_([box.box_id for box in boxes]),
-                func.date(Bookings.booking_date) == date_obj.date(),
-            )
-            .all()
-        )
+        # Boxes of the center come from the reference cache
+        boxes = center_boxes(db, fitness_center_id)
 
-        availability = {}
-        for box in boxes:
-            availability[box.box_id] = []
-
-            # Check each possible starting hour
-            for start_hour in range(next_available_hour, 24 - duration + 1):
-                end_hour = start_hour + duration
-                is_available = True
-
-                # Check against all existing bookings
-                for booking in bookings:
-                    if booking.booking_box_id_fk == box.box_id:
-                        if does_time_overlap(
-                            start_hour,
-                            end_hour,
-                            booking.booking_start_hour,
-                            booking.booking_start_hour + booking.booking_duration_hours,
-                        ):
-                            is_available = False
-                            break
-
-                if is_available:
-                    availability[box.box_id].append(
-                        {"start_hour": start_hour, "end_hour": end_hour}
-                    )
-
-        # Remove boxes with no available slots
-        available_boxes = {
-            str(box_id): [
-                {"start_hour": slot["start_hour"], "end_hour": slot["end_hour"]}
-                for slot in slots
-            ]
-            for box_id, slots in availability.items()
-            if slots
-        }
+        # Booked hours of every box that day, one row per box
+        masks = get_day_masks(db, boxes.box_ids, date_obj)
 
         return {
             "next_available_hour": next_available_hour,
             "duration_hours": duration,
-            "box_availability": available_boxes,
+            # Boxes with no available slots are left out
+            "box_availability": box_free_slots(masks, next_available_hour, duration),
         }
 
     except Exception as e:
@@ -118,58 +83,127 @@ def get_box_availability(
 #### GET ALL BOKS ####
 
 
+def box_listing(
+    db: Session,
+    fitness_center_id: int,
+    state: Optional[str],
+    sort: Optional[str],
+    now: datetime,
+) -> List[dict]:
+    """The boxes of a center filtered and sorted in SQL (ix_boxes_closed)"""
+    closed = and_(Boxes.box_state == BOX_CLOSED, Boxes.closed_until > now)
+    query = db.query(
+        Boxes.box_id,
+        Boxes.box_number,
+        Boxes.box_state,
+        Boxes.closed_until,
+        Boxes.created_at,
+    ).filter(Boxes.fitness_center_fk == fitness_center_id)
+
+    if state == BOX_CLOSED:
+        query = query.filter(closed)
+    elif state == BOX_OPEN:
+        query = query.filter(
+            or_(
+                Boxes.box_state == BOX_OPEN,
+                Boxes.closed_until.is_(None),
+                Boxes.closed_until <= now,
+            )
+        )
+
+    if sort == "closed_until":
+        # Boxes closing first on top, open boxes last
+        query = query.order_by(
+            case((closed, Boxes.closed_until)).asc().nulls_last(), Boxes.box_number
+        )
+    else:
+        query = query.order_by(Boxes.box_number)
+
+    return [
+        box_dict(
+            box_id, box_number, box_state, closed_until, created_at, fitness_center_id, now
+        )
+        for box_id, box_number, box_state, closed_until, created_at in query
+    ]
+
+
 @boxes_router.get("/box/{fitness_center_id}", response_model=BoxResponse)
 def get_all_boks(
     fitness_center_id: int = Path(..., description="ID of the fitness center"),
+    state: Optional[Literal["open", "closed"]] = Query(
+        None, description="Only the boxes that are open or closed now"
+    ),
+    sort: Optional[Literal["box_number", "closed_until"]] = Query(
+        None, description="Sort order, by box_number when left out"
+    ),
     db: Session = Depends(get_db),
 ):
-    # Get current time and calculate next hour
-    current_time = datetime.now()
-    next_hour = (
-        (current_time + timedelta(hours=1))
-        .replace(minute=0, second=0, microsecond=0)
-        .hour
-    )
-    today = current_time.date()
-
-    # Get all boxes
-    boxes = db.query(Boxes).filter(Boxes.fitness_center_fk == fitness_center_id).all()
-
-    # Get bookings that overlap with next hour
-    booked_box_ids = (
-        db.query(Bookings.booking_box_id_fk)
-        .filter(
-            func.date(Bookings.booking_date) == today,
-            Bookings.booking_start_hour
-            <= next_hour,  # Booking starts before or at next hour
-            (Bookings.booking_start_hour + Bookings.booking_duration_hours)
-            > next_hour,  # Booking ends after next hour
+    # is_booked: a booking of the box covers the next hour
+    if state is None and sort is None:
+        # The whole board, from the reference cache
+        return {"boks": board_rows(db, fitness_center_id)}
+    now = datetime.now()
+    return {
+        "boks": mark_is_booked(
+            db, box_listing(db, fitness_center_id, state, sort, now), now
         )
-        .all()
-    )
+    }
 
-    # Convert to set for O(1) lookup
-    booked_box_ids = {box_id for (box_id,) in booked_box_ids}
-
-    # Update box availability based on bookings
-    response_boxes = [
-        {
-            "box_id": box.box_id,
-            "created_at": box.created_at.strftime("%Y-%m-%d %H:%M:%S"),
-            "box_number": box.box_number,
-            "box_availability": box.box_availability,
-            "fitness_center_fk": box.fitness_center_fk,
-        }
-        for box in boxes
-    ]
 
-    return {"boks": response_boxes}
+#########################
+#### LIVE BOX BOARD ####
+
+
+@boxes_router.get("/box-board/{fitness_center_id}")
+async def get_box_board(
+    request: Request,
+    fitness_center_id: int = Path(..., description="ID of the fitness center"),
+):
+    # Server-Sent Events: a "snapshot" event with the same boxes as
+    # /box/{fitness_center_id}, then "diff" events, see admin/box_board.py
+    return StreamingResponse(
+        board_stream(request, fitness_center_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 #######################
 #### GET ALL BOKS ####
 
 
+def availability_map(date_range, bookings) -> dict:
+    """Every hour of every day in date_range, with the booking holding it"""
+    # Create availability map
+    dates_dict = {}
+    for date in date_range:
+        date_str = date.strftime("%Y-%m-%d")
+        dates_dict[date_str] = {
+            str(hour): {"available": True, "booking": None} for hour in range(24)
+        }
+
+    # Mark booked slots
+    for booking in bookings:
+        booking_date = booking.booking_date.strftime("%Y-%m-%d")
+        if booking_date in dates_dict:
+            for hour in range(
+                booking.booking_start_hour,
+                booking.booking_start_hour + booking.booking_duration_hours,
+            ):
+                if hour < 24:
+                    dates_dict[booking_date][str(hour)] = {
+                        "available": False,
+                        "booking": {
+                            "booking_id": booking.booking_id,
+                            "start_hour": booking.booking_start_hour,
+                            "duration": booking.booking_duration_hours,
+                            "end_hour": booking.booking_start_hour
+                            + booking.booking_duration_hours,
+                        },
+                    }
+    return dates_dict
+
+
 @boxes_router.get(
     "/available-box/{fitness_center_id}/{boks_id}",
     response_model=BoxAvailabilityByIdResponse,
@@ -184,13 +218,7 @@ def get_boks_avaliability_by_id(
         date_range = [today + timedelta(days=x) for x in range(7)]
 
         # Get box and bookings
-        box = (
-            db.query(Boxes)
-            .filter(
-                Boxes.fitness_center_fk == fitness_center_id, Boxes.box_id == boks_id
-            )
-            .first()
-        )
+        box = center_boxes(db, fitness_center_id).get(boks_id)
 
         if not box:
             raise HTTPException(status_code=404, detail="Box not found")
@@ -199,41 +227,14 @@ def get_boks_avaliability_by_id(
             db.query(Bookings)
             .filter(
                 Bookings.booking_box_id_fk == boks_id,
-                func.date(Bookings.booking_date) >= today,
-                func.date(Bookings.booking_date) <= date_range[-1],
+                Bookings.booking_date >= booking_day_range(today)[0],
+                Bookings.booking_date < booking_day_range(date_range[-1])[1],
             )
             .all()
         )
 
-        # Create availability map
-        dates_dict = {}
-        for date in date_range:
-            date_str = date.strftime("%Y-%m-%d")
-            dates_dict[date_str] = {
-                str(hour): {"available": True, "booking": None} for hour in range(24)
-            }
-
-        # Mark booked slots
-        for booking in bookings:
-            booking_date = booking.booking_date.strftime("%Y-%m-%d")
-            if booking_date in dates_dict:
-                for hour in range(
-                    booking.booking_start_hour,
-                    booking.booking_start_hour + booking.booking_duration_hours,
-                ):
-                    if hour < 24:
-                        dates_dict[booking_date][str(hour)] = {
-                            "available": False,
-                            "booking": {
-                                "booking_id": booking.booking_id,
-                                "start_hour": booking.booking_start_hour,
-                                "duration": booking.booking_duration_hours,
-                                "end_hour": booking.booking_start_hour
-                                + booking.booking_duration_hours,
-                            },
-                        }
-
-        return {"box_id": box.box_id, "dates": dates_dict}
+        dates = availability_map(date_range, bookings)
+        return {"box_id": box["box_id"], "dates": dates}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -245,7 +246,11 @@ def get_boks_avaliability_by_id(
 
 @boxes_router.put("/box-status")
 def update_boks_status(boks_update: BoksUpdate, db: Session = Depends(get_db)):
-    print(boks_update, flush=True)
+    try:
+        closed_hours = parse_status_label(boks_update.boks_availability)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     try:
         # Get current time info
         current_time = datetime.now()
@@ -257,7 +262,7 @@ def update_boks_status(boks_update: BoksUpdate, db: Session = Depends(get_db)):
             nearest_hour = nearest_hour + timedelta(hours=1)
 
         current_hour = nearest_hour.hour
-        today = current_time.date()
+        today_start, today_end = booking_day_range(current_time)
 
         # Rest of the code remains the same
         box = (
@@ -277,7 +282,8 @@ def update_boks_status(boks_update: BoksUpdate, db: Session = Depends(get_db)):
             db.query(Bookings)
             .filter(
                 Bookings.booking_box_id_fk == box.box_id,
-                func.date(Bookings.booking_date) == today,
+                Bookings.booking_date >= today_start,
+                Bookings.booking_date < today_end,
                 Bookings.booking_start_hour <= current_hour,
                 (Bookings.booking_start_hour + Bookings.booking_duration_hours)
                 > current_hour,
@@ -287,17 +293,17 @@ def update_boks_status(boks_update: BoksUpdate, db: Session = Depends(get_db)):
 
         for booking in existing_bookings:
             db.delete(booking)
+            record_booking(db, booking.user_id, booking.booking_date, -1)
+        if existing_bookings:
+            refresh_box_days(db, [(box.box_id, today_start)])
 
-        if boks_update.boks_availability == "Ledigt":
-            box.box_availability = "Ledigt"
+        if closed_hours is None:
+            box.box_state = BOX_OPEN
+            box.closed_until = None
 
-        elif boks_update.boks_availability.startswith("Lukket:"):
-            duration = int(
-                boks_update.boks_availability.split(":")[1].strip().replace("t", "")
-            )
-            booking_code = "".join(
-                random.choices(string.ascii_uppercase + string.digits, k=4)
-            )
+        else:
+            duration = closed_hours
+            booking_code = allocate_booking_code(db, box.box_id, nearest_hour)
 
             new_booking = Bookings(
                 user_id=boks_update.user_id,
@@ -311,9 +317,22 @@ def update_boks_status(boks_update: BoksUpdate, db: Session = Depends(get_db)):
             )
 
             db.add(new_booking)
-            # Update to use original status text
-            box.box_availability = boks_update.boks_availability
+            record_booking(db, new_booking.user_id, nearest_hour, 1)
+            mark_booked(db, box.box_id, nearest_hour, current_hour, duration)
+            # Closed to the end of the booking, which ends at midnight at
+            # the latest like the availability masks
+            box.box_state = BOX_CLOSED
+            box.closed_until = min(
+                nearest_hour + timedelta(hours=duration), today_end
+            )
 
+        # The box change invalidates the box caches on commit, see
+        # WRITE-THROUGH INVALIDATION in reference_cache.py
+        events.emit(
+            db,
+            events.BOOKINGS_CHANGED,
+            {"box_id": box.box_id, "day": today_start.date().isoformat()},
+        )
         db.commit()
         return {"message": "Box status updated successfully"}
 
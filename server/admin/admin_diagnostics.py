@@ -0,0 +1,53 @@
+from fastapi import APIRouter, Query
+
+from database import slow_queries, SLOW_QUERY_THRESHOLD_MS, SLOW_QUERY_EXPLAIN
+from instrumentation import route_metrics
+from reference_cache import reference_cache
+
+diagnostics_router = APIRouter()
+
+
+##########################
+#### GET SLOW QUERIES ####
+
+
+@diagnostics_router.get("/diagnostics/slow-queries")
+def get_slow_queries(
+    limit: int = Query(50, gt=0, le=500, description="Number of queries, newest first"),
+):
+    # The ring buffer of this worker, see SLOW QUERY LOG in database.py
+    return {
+        "threshold_ms": SLOW_QUERY_THRESHOLD_MS,
+        "explain": SLOW_QUERY_EXPLAIN,
+        "queries": list(reversed(slow_queries))[:limit],
+    }
+
+
+@diagnostics_router.delete("/diagnostics/slow-queries")
+def clear_slow_queries():
+    slow_queries.clear()
+    return {"message": "Slow query log cleared"}
+
+
+####################
+#### GET ROUTES ####
+
+
+@diagnostics_router.get("/diagnostics/routes")
+def get_route_metrics():
+    # Per route latency and SQL numbers from instrumentation.py, slowest first
+    routes = sorted(route_metrics(), key=lambda route: route["avg_seconds"], reverse=True)
+    return {"routes": routes}
+
+
+#############################
+#### GET REFERENCE CACHE ####
+
+
+@diagnostics_router.get("/diagnostics/reference-cache")
+def get_reference_cache_stats():
+    # Lookups of this worker per namespace, see reference_cache.py
+    return {
+        "store": type(reference_cache.store).__name__,
+        "namespaces": reference_cache.stats(),
+    }
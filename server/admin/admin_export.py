@@ -0,0 +1,201 @@
+import csv
+import io
+import json
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from fastapi import APIRouter, Path, Query
+from fastapi.responses import StreamingResponse
+
+from database import SessionLocal
+from models import Users, UserRoles, Bookings, Boxes, StripePayment
+
+export_router = APIRouter()
+
+## Rows are read through a server-side cursor (yield_per) and written to the
+## response as they arrive, so memory use stays flat however big the table is
+EXPORT_BATCH_SIZE = 1000
+
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def format_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def stream_rows(build_query, columns, export_format: str):
+    # The export gets its own session, the request scoped one from get_db
+    # is closed before the response body has been streamed
+    db = SessionLocal()
+    try:
+        rows = build_query(db).yield_per(EXPORT_BATCH_SIZE)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if export_format == "csv":
+            writer.writerow(columns)
+
+        for count, row in enumerate(rows, start=1):
+            values = [format_value(value) for value in row]
+            if export_format == "csv":
+                writer.writerow(values)
+            else:
+                buffer.write(json.dumps(dict(zip(columns, values))) + "\n")
+
+            if count % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+
+        yield buffer.getvalue()
+    finally:
+        db.close()
+
+
+def export_response(name: str, build_query, columns, export_format: str):
+    return StreamingResponse(
+        stream_rows(build_query, columns, export_format),
+        media_type=MEDIA_TYPES[export_format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{name}.{export_format}"'
+        },
+    )
+
+
+######################
+#### EXPORT USERS ####
+
+
+@export_router.get("/export/{fitness_center_id}/users")
+def export_users(
+    fitness_center_id: int = Path(..., description="ID of the fitness center"),
+    export_format: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+):
+    columns = [
+        "user_id",
+        "first_name",
+        "last_name",
+        "email",
+        "phone",
+        "is_member",
+        "role",
+        "created_at",
+    ]
+
+    def build_query(db):
+        return (
+            db.query(
+                Users.user_id,
+                Users.user_first_name,
+                Users.user_last_name,
+                Users.user_email,
+                Users.user_phone,
+                Users.is_member,
+                UserRoles.role_name,
+                Users.created_at,
+            )
+            .join(UserRoles)
+            .filter(Users.fitness_center_fk == fitness_center_id)
+            .order_by(Users.user_id)
+        )
+
+    return export_response(
+        f"users-{fitness_center_id}", build_query, columns, export_format
+    )
+
+
+#########################
+#### EXPORT BOOKINGS ####
+
+
+@export_router.get("/export/{fitness_center_id}/bookings")
+def export_bookings(
+    fitness_center_id: int = Path(..., description="ID of the fitness center"),
+    export_format: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    from_date: Optional[date] = Query(None, description="First booking date"),
+    to_date: Optional[date] = Query(None, description="Last booking date"),
+):
+    columns = [
+        "booking_id",
+        "user_id",
+        "box_id",
+        "box_number",
+        "booking_date",
+        "booking_code",
+        "booking_start_hour",
+        "booking_duration_hours",
+        "booking_end_hour",
+        "booking_timestamp",
+    ]
+
+    def build_query(db):
+        query = (
+            db.query(
+                Bookings.booking_id,
+                Bookings.user_id,
+                Bookings.booking_box_id_fk,
+                Boxes.box_number,
+                Bookings.booking_date,
+                Bookings.booking_code,
+                Bookings.booking_start_hour,
+                Bookings.booking_duration_hours,
+                Bookings.booking_end_hour,
+                Bookings.booking_timestamp,
+            )
+            .join(Boxes, Boxes.box_id == Bookings.booking_box_id_fk)
+            .filter(Boxes.fitness_center_fk == fitness_center_id)
+        )
+        if from_date:
+            query = query.filter(Bookings.booking_date >= from_date)
+        if to_date:
+            query = query.filter(Bookings.booking_date < to_date + timedelta(days=1))
+        return query.order_by(Bookings.booking_date, Bookings.booking_id)
+
+    return export_response(
+        f"bookings-{fitness_center_id}", build_query, columns, export_format
+    )
+
+
+#########################
+#### EXPORT PAYMENTS ####
+
+
+@export_router.get("/export/{fitness_center_id}/payments")
+def export_payments(
+    fitness_center_id: int = Path(..., description="ID of the fitness center"),
+    export_format: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+):
+    columns = [
+        "payment_id",
+        "user_id",
+        "payment_intent_id",
+        "amount",
+        "currency",
+        "status",
+        "payment_method",
+        "created_at",
+        "updated_at",
+    ]
+
+    def build_query(db):
+        return (
+            db.query(
+                StripePayment.payment_id,
+                StripePayment.user_id,
+                StripePayment.payment_intent_id,
+                StripePayment.amount,
+                StripePayment.currency,
+                StripePayment.status,
+                StripePayment.payment_method,
+                StripePayment.created_at,
+                StripePayment.updated_at,
+            )
+            .join(Users, Users.user_id == StripePayment.user_id)
+            .filter(Users.fitness_center_fk == fitness_center_id)
+            .order_by(StripePayment.payment_id)
+        )
+
+    return export_response(
+        f"payments-{fitness_center_id}", build_query, columns, export_format
+    )
@@ -1,11 +1,15 @@
-from fastapi import APIRouter, Depends, Path, HTTPException
+from fastapi import APIRouter, Depends, Path, Query, HTTPException
 from sqlalchemy.orm import Session
 from database import get_db
 from admin.types.admin_types import StatsResponse
 from collections import defaultdict
-from models import Boxes, Bookings, Users
+from typing import Optional
+from models import Boxes, Bookings, CheckIns, Users
 from datetime import datetime, timedelta
 from sqlalchemy import func
+from bookings.partitions import booking_day_range
+from bookings.booking_stats import reconcile_user_booking_stats
+from stripe_payments.reconciliation import reconcile_pending_payments
 
 stats_router = APIRouter()
 
@@ -21,6 +25,9 @@ def get_stats(
     # Get current date info
     today = datetime.now().date()
     first_day_of_month = today.replace(day=1)
+    # Ranges instead of func.date(...) so indexes and partition pruning apply
+    today_start, today_end = booking_day_range(today)
+    month_start, _ = booking_day_range(first_day_of_month)
 
     try:
         # New members this month (users created this month)
@@ -29,7 +36,7 @@ def get_stats(
             .filter(
                 Users.fitness_center_fk == fitness_center_id,
                 Users.is_member == True,
-                func.date(Users.created_at) >= first_day_of_month,
+                Users.created_at >= month_start,
             )
             .count()
         )
@@ -40,7 +47,8 @@ def get_stats(
             .filter(
                 Users.fitness_center_fk == fitness_center_id,
                 Users.is_member == True,
-                func.date(Users.created_at) == today,
+                Users.created_at >= today_start,
+                Users.created_at < today_end,
             )
             .count()
         )
@@ -59,13 +67,13 @@ def get_stats(
             db.query(Boxes).filter(Boxes.fitness_center_fk == fitness_center_id).count()
         )
 
-        # Bookings checked in today
+        # Bookings checked in today at the door terminals (checkin/checkin.py)
         boks_checked_in_today = (
-            db.query(Bookings)
-            .join(Users)
+            db.query(CheckIns)
             .filter(
-                Users.fitness_center_fk == fitness_center_id,
-                func.date(Bookings.booking_date) == today,
+                CheckIns.fitness_center_fk == fitness_center_id,
+                CheckIns.checked_in_at >= today_start,
+                CheckIns.checked_in_at < today_end,
             )
             .count()
         )
@@ -83,8 +91,8 @@ def get_stats(
             .join(Users)
             .filter(
                 Users.fitness_center_fk == fitness_center_id,
-                func.date(Bookings.booking_date) >= thirty_days_ago,
-                func.date(Bookings.booking_date) <= today,
+                Bookings.booking_date >= booking_day_range(thirty_days_ago)[0],
+                Bookings.booking_date < today_end,
             )
             .group_by(func.date(Bookings.booking_date))
             .all()
@@ -117,3 +125,39 @@ def get_stats(
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching stats: {str(e)}")
+
+
+############################################
+#### RECONCILE USER BOOKING STATS (JOB) ####
+
+
+@stats_router.post("/stats/reconcile-user-bookings")
+def reconcile_user_bookings(
+    db: Session = Depends(get_db),
+    user_id: Optional[int] = Query(None, description="Only reconcile this user"),
+):
+    # Recounts user_booking_stats from the bookings table and repairs drift
+    try:
+        return reconcile_user_booking_stats(db, user_id)
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=500, detail=f"Error reconciling booking stats: {str(e)}"
+        )
+
+
+##########################################
+#### RECONCILE PENDING PAYMENTS (JOB) ####
+
+
+@stats_router.post("/stats/reconcile-payments")
+async def reconcile_payments(
+    concurrency: int = Query(10, gt=0, le=50, description="Parallel Stripe requests"),
+):
+    # Asks Stripe for the status of payments stuck in pending
+    try:
+        return await reconcile_pending_payments(concurrency=concurrency)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Error reconciling payments: {str(e)}"
+        )
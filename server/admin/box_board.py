@@ -0,0 +1,196 @@
+import asyncio
+import json
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy.orm import Session
+
+import events
+from database import SessionLocal
+from bookings.availability import get_day_masks
+from reference_cache import center_boxes
+from scheduler import seconds_to_next_hour
+
+## Live box board per fitness center (Server-Sent Events)
+##
+## Front desk screens used to poll GET /box/{fitness_center_id}. They can
+## open GET /box-board/{fitness_center_id} instead and get the board once
+## ("snapshot") and after that only the boxes that changed ("diff").
+##
+## One CenterBoard per center with subscribers keeps the last state. The
+## booking and box write paths publish BOOKINGS_CHANGED / BOXES_CHANGED (see
+## events.py) with their commit, usually from a threadpool thread, or they
+## arrive from another worker, so the board is woken with
+## loop.call_soon_threadsafe. Changes are coalesced:
+## the board reloads its state once (the cached boxes and one query for
+## today's masks), diffs it with the last one and queues the diff for every
+## subscriber. At every full hour the state is reloaded too, since "booked"
+## means booked in the coming hour.
+## A failed load is retried after LOAD_RETRY_SECONDS. A client whose board
+## could not be loaded within LOAD_TIMEOUT_SECONDS gets an "error" event and
+## the stream ends.
+
+SUBSCRIBER_QUEUE_SIZE = 100
+KEEPALIVE_SECONDS = 15
+LOAD_RETRY_SECONDS = 5
+LOAD_TIMEOUT_SECONDS = 10
+
+
+def mark_is_booked(db: Session, rows: List[dict], now: datetime) -> List[dict]:
+    """is_booked on every box row: a booking covers the next hour"""
+    next_hour = (now + timedelta(hours=1)).hour
+    # Only bookings of these boxes, one row per box
+    masks = get_day_masks(db, [row["box_id"] for row in rows], now.date())
+    for row in rows:
+        row["is_booked"] = bool(masks[row["box_id"]] >> next_hour & 1)
+    return rows
+
+
+def board_rows(
+    db: Session, fitness_center_id: int, now: datetime = None
+) -> List[dict]:
+    """The boxes of a center, from the reference cache"""
+    now = now or datetime.now()
+    return mark_is_booked(db, center_boxes(db, fitness_center_id).as_dicts(now), now)
+
+
+def load_board(fitness_center_id: int) -> Dict[int, dict]:
+    db = SessionLocal()
+    try:
+        return {row["box_id"]: row for row in board_rows(db, fitness_center_id)}
+    finally:
+        db.close()
+
+
+def board_diff(old: Dict[int, dict], new: Dict[int, dict]) -> Optional[dict]:
+    changed = [row for box_id, row in new.items() if old.get(box_id) != row]
+    removed = [box_id for box_id in old if box_id not in new]
+    if not changed and not removed:
+        return None
+    return {"changed": changed, "removed": removed}
+
+
+class CenterBoard:
+    def __init__(self, fitness_center_id: int):
+        self.fitness_center_id = fitness_center_id
+        self.loop = asyncio.get_running_loop()
+        self.state: Dict[int, dict] = {}
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.changed = asyncio.Event()
+        self.loaded = asyncio.Event()
+        self.task = self.loop.create_task(self.run())
+
+    def notify(self):
+        """Thread safe, the reload happens on the board's event loop"""
+        self.loop.call_soon_threadsafe(self.changed.set)
+
+    def send(self, queue: asyncio.Queue, message: tuple):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # A client that does not keep up gets a new snapshot instead of
+            # an ever growing backlog of diffs
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(("snapshot", self.snapshot()))
+
+    def snapshot(self) -> dict:
+        return {"boks": list(self.state.values())}
+
+    async def run(self):
+        while True:
+            try:
+                new_state = await asyncio.to_thread(load_board, self.fitness_center_id)
+            except Exception as e:
+                print(f"Box board {self.fitness_center_id} failed: {e}", flush=True)
+                new_state = None
+            timeout = seconds_to_next_hour() + 1
+            if new_state is not None:
+                diff = None
+                if self.loaded.is_set():
+                    diff = board_diff(self.state, new_state)
+                self.state = new_state
+                self.loaded.set()
+                if diff:
+                    for queue in self.subscribers:
+                        self.send(queue, ("diff", diff))
+            else:
+                timeout = LOAD_RETRY_SECONDS
+
+            try:
+                await asyncio.wait_for(self.changed.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.changed.clear()
+
+
+_boards: Dict[int, CenterBoard] = {}
+
+
+def notify_boards(payload: dict):
+    # Bookings of other days don't change the board
+    day = payload.get("day")
+    if day and day != date.today().isoformat():
+        return
+    box_id = payload.get("box_id")
+    for board in list(_boards.values()):
+        if box_id is None or box_id in board.state:
+            board.notify()
+
+
+events.subscribe(events.BOOKINGS_CHANGED, notify_boards)
+events.subscribe(events.BOXES_CHANGED, notify_boards)
+events.subscribe(events.RESYNC, notify_boards)
+
+
+async def subscribe(fitness_center_id: int) -> asyncio.Queue:
+    board = _boards.get(fitness_center_id)
+    if board is None:
+        board = _boards[fitness_center_id] = CenterBoard(fitness_center_id)
+    try:
+        await asyncio.wait_for(board.loaded.wait(), timeout=LOAD_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        # Nobody else waits for this board, so it stops retrying
+        if not board.subscribers and _boards.get(fitness_center_id) is board:
+            board.task.cancel()
+            del _boards[fitness_center_id]
+        raise
+    queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+    queue.put_nowait(("snapshot", board.snapshot()))
+    board.subscribers.add(queue)
+    return queue
+
+
+def unsubscribe(fitness_center_id: int, queue: asyncio.Queue):
+    board = _boards.get(fitness_center_id)
+    if board is None:
+        return
+    board.subscribers.discard(queue)
+    if not board.subscribers:
+        board.task.cancel()
+        del _boards[fitness_center_id]
+
+
+def sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def board_stream(request, fitness_center_id: int):
+    try:
+        queue = await subscribe(fitness_center_id)
+    except asyncio.TimeoutError:
+        yield sse("error", {"detail": "Box board could not be loaded"})
+        return
+    try:
+        while not await request.is_disconnected():
+            try:
+                event, data = await asyncio.wait_for(
+                    queue.get(), timeout=KEEPALIVE_SECONDS
+                )
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle connection
+                yield ": keepalive\n\n"
+                continue
+            yield sse(event, data)
+    finally:
+        unsubscribe(fitness_center_id, queue)
@@ -0,0 +1,164 @@
+import re
+from bisect import bisect_left, insort
+from threading import Lock, Thread
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+import events
+from database import SessionLocal
+from models import Users
+
+## In-memory prefix index used by the admin autocomplete endpoint
+##
+## Every worker keeps, per fitness center, one sorted list of
+## (normalized key, user_id) tuples. The keys of a user are the first name,
+## last name, full name, email and phone digits, so a prefix lookup is a
+## binary search followed by a short scan. The index is built at startup and
+## kept fresh through the user events published by the write paths, and
+## rebuilt when events may have been missed (events.RESYNC).
+
+
+def normalize(value: str) -> str:
+    value = (value or "").strip().lower()
+    digits = re.sub(r"[\s+\-]", "", value)
+    return digits if digits.isdigit() else " ".join(value.split())
+
+
+def member_keys(record: dict) -> List[str]:
+    keys = {
+        normalize(record["first_name"]),
+        normalize(record["last_name"]),
+        normalize(f"{record['first_name']} {record['last_name']}"),
+        normalize(record["email"]),
+        normalize(record["phone"]),
+    }
+    keys.discard("")
+    return sorted(keys)
+
+
+class MemberIndex:
+    def __init__(self):
+        self._lock = Lock()
+        self._entries: Dict[int, List[Tuple[str, int]]] = {}
+        self._users: Dict[int, Tuple[int, List[str], dict]] = {}
+        self.ready = False
+
+    def build(self, db: Session):
+        entries: Dict[int, List[Tuple[str, int]]] = {}
+        users = {}
+        rows = db.query(
+            Users.user_id,
+            Users.fitness_center_fk,
+            Users.user_first_name,
+            Users.user_last_name,
+            Users.user_email,
+            Users.user_phone,
+            Users.is_member,
+        ).yield_per(10000)
+        for row in rows:
+            record = events.user_payload(row)
+            keys = member_keys(record)
+            center_entries = entries.setdefault(record["fitness_center_id"], [])
+            center_entries.extend((key, record["user_id"]) for key in keys)
+            users[record["user_id"]] = (record["fitness_center_id"], keys, record)
+
+        for center_entries in entries.values():
+            center_entries.sort()
+
+        with self._lock:
+            self._entries = entries
+            self._users = users
+            self.ready = True
+
+    def upsert(self, record: dict):
+        with self._lock:
+            self._remove(record["user_id"])
+            keys = member_keys(record)
+            center_entries = self._entries.setdefault(record["fitness_center_id"], [])
+            for key in keys:
+                insort(center_entries, (key, record["user_id"]))
+            self._users[record["user_id"]] = (record["fitness_center_id"], keys, record)
+
+    def remove(self, user_id: int):
+        with self._lock:
+            self._remove(user_id)
+
+    def _remove(self, user_id: int):
+        existing = self._users.pop(user_id, None)
+        if not existing:
+            return
+        center_id, keys, _ = existing
+        center_entries = self._entries.get(center_id, [])
+        for key in keys:
+            position = bisect_left(center_entries, (key, user_id))
+            if position < len(center_entries) and center_entries[position] == (key, user_id):
+                del center_entries[position]
+
+    def search(self, fitness_center_id: int, query: str, limit: int = 10) -> List[dict]:
+        prefix = normalize(query)
+        if not prefix:
+            return []
+
+        results = []
+        seen = set()
+        with self._lock:
+            center_entries = self._entries.get(fitness_center_id, [])
+            position = bisect_left(center_entries, (prefix, -1))
+            while position < len(center_entries) and len(results) < limit:
+                key, user_id = center_entries[position]
+                if not key.startswith(prefix):
+                    break
+                if user_id not in seen:
+                    seen.add(user_id)
+                    results.append(self._users[user_id][2])
+                position += 1
+        return results
+
+    def get(self, user_id: int) -> Optional[dict]:
+        existing = self._users.get(user_id)
+        return existing[2] if existing else None
+
+
+member_index = MemberIndex()
+_rebuilding = Lock()
+
+
+def build_member_index():
+    db = SessionLocal()
+    try:
+        member_index.build(db)
+    finally:
+        db.close()
+
+
+def rebuild_member_index():
+    # Several resyncs in a row need one rebuild
+    if not _rebuilding.acquire(blocking=False):
+        return
+    try:
+        build_member_index()
+    except Exception as e:
+        print(f"Could not rebuild member index: {e}", flush=True)
+    finally:
+        _rebuilding.release()
+
+
+def on_user_changed(payload: dict):
+    if member_index.ready:
+        member_index.upsert(payload)
+
+
+def on_user_deleted(payload: dict):
+    if member_index.ready:
+        member_index.remove(payload["user_id"])
+
+
+def on_resync(payload: dict):
+    if member_index.ready:
+        Thread(target=rebuild_member_index, daemon=True).start()
+
+
+events.subscribe(events.USER_CHANGED, on_user_changed)
+events.subscribe(events.USER_DELETED, on_user_deleted)
+events.subscribe(events.RESYNC, on_resync)
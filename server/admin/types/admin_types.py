@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from typing import Dict, List, Optional
+from datetime import date
 
 
 class BoksUpdate(BaseModel):
@@ -27,6 +28,52 @@ class UsersResponse(BaseModel):
     total_pages: int
 
 
+class UsersCursorResponse(BaseModel):
+    users: List[User]
+    next_cursor: Optional[str] = None
+    page_size: int
+    total: Optional[int] = None
+
+
+class Member(BaseModel):
+    user_id: int
+    fitness_center_id: int
+    first_name: str
+    last_name: str
+    email: str
+    phone: str
+    is_member: bool
+
+
+class AutocompleteResponse(BaseModel):
+    users: List[Member]
+
+
+class MembershipBulkUpdate(BaseModel):
+    fitness_center_id: int
+    is_member: bool
+    user_ids: Optional[List[int]] = None
+    # Filter instead of ids: members without any booking since this date
+    no_bookings_since: Optional[date] = None
+
+
+class RoleBulkUpdate(BaseModel):
+    fitness_center_id: int
+    user_ids: List[int]
+    role_id: int
+
+
+class BulkUpdateResult(BaseModel):
+    user_id: int
+    status: str
+
+
+class BulkUpdateResponse(BaseModel):
+    status: str
+    updated: int
+    results: List[BulkUpdateResult]
+
+
 class DailyBooking(BaseModel):
     name: str
     pv: int
@@ -57,7 +104,10 @@ class Box(BaseModel):
     created_at: str
     box_number: int
     box_availability: str
+    box_state: str
+    closed_until: Optional[str] = None
     fitness_center_fk: int
+    is_booked: bool
 
 
 class BoxResponse(BaseModel):
@@ -0,0 +1,75 @@
+import re
+from sqlalchemy import case, func, or_, text
+from sqlalchemy.orm import Session
+from models import Users
+
+## Search used by the admin search-users endpoints
+##
+## Free text queries run against Users.search_text, a generated column with
+## the lower-cased name, email and phone digits. It is indexed with a pg_trgm
+## GIN index (see migrations.py), so LIKE '%term%' is served by the index and
+## results can be ranked by similarity().
+## Queries that look like a phone number or an email also match on a prefix
+## of user_phone / lower(user_email), served by btree (text_pattern_ops)
+## indexes. Those hits are listed first, substring hits such as "@gmail.com"
+## or the middle digits of a phone number are still found through search_text.
+
+_trigram_available = None
+
+
+def trigram_available(db: Session) -> bool:
+    """pg_trgm is optional, without it results are simply not ranked"""
+    global _trigram_available
+    if _trigram_available is None:
+        _trigram_available = (
+            db.execute(
+                text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            ).first()
+            is not None
+        )
+    return _trigram_available
+
+
+def escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def normalize_query(search_query: str):
+    """Returns the kind of search ("phone", "email" or "text") and the term"""
+    term = search_query.strip().lower()
+    digits = re.sub(r"[\s+\-]", "", term)
+
+    # Phone number, e.g. "2233" or "+45 22 33"
+    if digits.isdigit():
+        return "phone", digits
+    # Email, e.g. "jonas@fit" or "@gmail.com"
+    if "@" in term:
+        return "email", term
+    # Free text over name, email and phone
+    return "text", term
+
+
+def prefix_filter(kind: str, term: str):
+    if kind == "phone":
+        return Users.user_phone.like(f"{escape_like(term)}%", escape="\\")
+    return func.lower(Users.user_email).like(f"{escape_like(term)}%", escape="\\")
+
+
+def user_search_filter(search_query: str):
+    kind, term = normalize_query(search_query)
+    text_filter = Users.search_text.like(f"%{escape_like(term)}%", escape="\\")
+    if kind == "text":
+        return text_filter
+    return or_(prefix_filter(kind, term), text_filter)
+
+
+def user_search_order(db: Session, search_query: str):
+    """Best matches first, ties broken by user_id so paging stays stable"""
+    kind, term = normalize_query(search_query)
+    if kind != "text":
+        prefix_first = case((prefix_filter(kind, term), 0), else_=1)
+        column = Users.user_phone if kind == "phone" else func.lower(Users.user_email)
+        return [prefix_first, column, Users.user_id]
+    if trigram_available(db):
+        return [func.similarity(Users.search_text, term).desc(), Users.user_id]
+    return [Users.user_id]
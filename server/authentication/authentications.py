@@ -20,6 +20,9 @@ from authentication.mail import (
 )
 from database import get_db
 from models import Users
+from pagination import invalidate_counts
+import events
+from reference_cache import fitness_center, role_name
 
 authentication_router = APIRouter()
 ACCESS_TOKEN_EXPIRE_MINUTES = 180
@@ -48,12 +51,14 @@ async def login(
         "first_name": get_user_in_db.user_first_name,
         "last_name": get_user_in_db.user_last_name,
         "user_phone": get_user_in_db.user_phone,
-        "fitness_center": get_user_in_db.fitness_center.fitness_center_name,
-        "fitness_center_id": get_user_in_db.fitness_center.fitness_center_id,
+        "fitness_center": fitness_center(db, get_user_in_db.fitness_center_fk)[
+            "fitness_center_name"
+        ],
+        "fitness_center_id": get_user_in_db.fitness_center_fk,
         "is_member": get_user_in_db.is_member,
         "is_verified": get_user_in_db.is_verified,
         "user_role": get_user_in_db.user_role_fk,
-        "user_role_name": get_user_in_db.user_role.role_name,
+        "user_role_name": role_name(db, get_user_in_db.user_role_fk),
         "user_id": get_user_in_db.user_id,
     }
 
@@ -137,8 +142,12 @@ async def signup(
         # Add and commit to database
         db.add(new_user)
         try:
+            # The user_id is assigned by the flush
+            db.flush()
+            events.emit(db, events.USER_CHANGED, events.user_payload(new_user))
             db.commit()
             db.refresh(new_user)
+            invalidate_counts("users")
         except Exception as e:
             print(f"Error creating user: {e}")
             db.rollback()
@@ -149,12 +158,14 @@ async def signup(
             "first_name": new_user.user_first_name,
             "last_name": new_user.user_last_name,
             "user_phone": new_user.user_phone,
-            "fitness_center": new_user.fitness_center.fitness_center_name,
-            "fitness_center_id": new_user.fitness_center.fitness_center_id,
+            "fitness_center": fitness_center(db, new_user.fitness_center_fk)[
+                "fitness_center_name"
+            ],
+            "fitness_center_id": new_user.fitness_center_fk,
             "is_member": new_user.is_member,
             "is_verified": new_user.is_verified,
             "user_role": new_user.user_role_fk,
-            "user_role_name": new_user.user_role.role_name,
+            "user_role_name": role_name(db, new_user.user_role_fk),
             "user_id": new_user.user_id,
         }
 
@@ -0,0 +1,157 @@
+"""
+Benchmark of the monthly bookings partitions
+
+Seeds the bookings table with N rows spread over the last three years and
+the coming three months, then times the queries the API actually runs:
+today's bookings of a box, the next 7 days and the last 30 days. The plan of
+the "today" query is printed so partition pruning can be checked.
+
+With --compare-flat the same rows are copied into an unpartitioned table
+(bookings_flat) with the same indexes and the queries are timed there too.
+
+Run from the server folder against a scratch database:
+
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_booking_partitions --rows 50000000
+"""
+
+import argparse
+import statistics
+import time
+
+from sqlalchemy import text
+
+from database import engine, Base
+from migrations import run_migrations
+from bookings.partitions import ensure_booking_partitions
+
+QUERIES = {
+    "today": (
+        "SELECT * FROM {table} WHERE booking_box_id_fk = :box_id "
+        "AND booking_date >= current_date AND booking_date < current_date + 1"
+    ),
+    "next 7 days": (
+        "SELECT count(*) FROM {table} "
+        "WHERE booking_date >= current_date AND booking_date < current_date + 7"
+    ),
+    "last 30 days": (
+        "SELECT count(*) FROM {table} "
+        "WHERE booking_date >= current_date - 30 AND booking_date < current_date"
+    ),
+}
+
+
+def seed_bookings(conn, rows: int):
+    center_id = conn.execute(
+        text(
+            "INSERT INTO fitness_centers (fitness_center_name, fitness_center_address) "
+            "VALUES ('Benchmark center', 'Benchmarkvej 1') RETURNING fitness_center_id"
+        )
+    ).scalar()
+    role_id = conn.execute(
+        text("INSERT INTO user_roles (role_name) VALUES ('user') RETURNING user_role_id")
+    ).scalar()
+    user_id = conn.execute(
+        text(
+            """
+            INSERT INTO users (
+                user_email, user_first_name, user_last_name, is_member, password_hash,
+                user_phone, is_verified, created_at, updated_at, user_role_fk, fitness_center_fk
+            )
+            VALUES (
+                'partition-bench-' || extract(epoch from clock_timestamp()) || '@fitboks.dk',
+                'Bench', 'User', true, 'x', '00000000', true, now(), now(), :role_id, :center_id
+            )
+            RETURNING user_id
+            """
+        ),
+        {"role_id": role_id, "center_id": center_id},
+    ).scalar()
+    box_id = conn.execute(
+        text(
+            "INSERT INTO boxes (box_number, created_at, fitness_center_fk) "
+            "VALUES ((SELECT coalesce(max(box_number), 0) + 1 FROM boxes), now(), :c) "
+            "RETURNING box_id"
+        ),
+        {"c": center_id},
+    ).scalar()
+
+    # One partition per month of the seeded range
+    ensure_booking_partitions(
+        conn,
+        first_month=conn.execute(text("SELECT (current_date - 3 * 365)::date")).scalar(),
+    )
+    conn.execute(
+        text(
+            """
+            INSERT INTO bookings (
+                user_id, booking_box_id_fk, booking_date, booking_code, booking_start_hour,
+                booking_duration_hours, booking_end_hour, booking_timestamp
+            )
+            SELECT :user_id, :box_id,
+                   date_trunc('hour', now()) - (random() * (3 * 365 + 90) - 90) * interval '1 day',
+                   'B' || lpad((i % 1000)::text, 3, '0'), 10, 2, 12, now()
+            FROM generate_series(1, :n) AS i
+            """
+        ),
+        {"user_id": user_id, "box_id": box_id, "n": rows},
+    )
+    conn.execute(text("ANALYZE bookings"))
+    return box_id
+
+
+def create_flat_copy(conn):
+    conn.execute(text("DROP TABLE IF EXISTS bookings_flat"))
+    conn.execute(text("CREATE TABLE bookings_flat AS SELECT * FROM bookings"))
+    conn.execute(text("CREATE INDEX ON bookings_flat (booking_id)"))
+    conn.execute(text("CREATE INDEX ON bookings_flat (user_id, booking_date)"))
+    conn.execute(text("CREATE INDEX ON bookings_flat (booking_box_id_fk, booking_date)"))
+    conn.execute(text("CREATE INDEX ON bookings_flat (booking_date)"))
+    conn.execute(text("ANALYZE bookings_flat"))
+
+
+def time_query(conn, statement: str, params: dict, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(text(statement), params).all()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=50_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--compare-flat", action="store_true")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+
+    with engine.begin() as conn:
+        started = time.perf_counter()
+        box_id = seed_bookings(conn, args.rows)
+        print(f"Seeded {args.rows} bookings in {time.perf_counter() - started:.1f}s")
+        if args.compare_flat:
+            create_flat_copy(conn)
+
+    tables = ["bookings"] + (["bookings_flat"] if args.compare_flat else [])
+    params = {"box_id": box_id}
+    with engine.connect() as conn:
+        plan = conn.execute(
+            text("EXPLAIN " + QUERIES["today"].format(table="bookings")), params
+        ).scalars()
+        print("\n".join(plan))
+        print()
+
+        print(f"{'query':<16}" + "".join(f"{table + ' p50':>22}" for table in tables))
+        for name, statement in QUERIES.items():
+            timings = [
+                time_query(conn, statement.format(table=table), params, args.repeat)
+                for table in tables
+            ]
+            print(f"{name:<16}" + "".join(f"{timing:>20.2f}ms" for timing in timings))
+
+
+if __name__ == "__main__":
+    main()
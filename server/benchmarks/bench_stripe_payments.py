@@ -0,0 +1,94 @@
+"""
+Benchmark of concurrent Stripe calls from the event loop
+
+Starts the fake Stripe server (stripe_payments/fake_stripe.py) with an
+artificial latency and fires N concurrent PaymentIntent creations from one
+event loop, first the old way (the blocking stripe call inside an async
+function) and then through the shared async client from
+stripe_payments/stripe_client.py. While they run, a ticker measures how late
+the event loop is, which is what every other request on the worker feels.
+
+Run from the server folder, no database needed:
+
+    python -m benchmarks.bench_stripe_payments --requests 50 --latency-ms 200
+"""
+
+import argparse
+import asyncio
+import threading
+import time
+
+import stripe
+import uvicorn
+
+from stripe_payments import fake_stripe
+from stripe_payments.stripe_client import build_stripe_client
+
+PARAMS = {"amount": 1000, "currency": "dkk", "metadata": {"user_id": "1"}}
+
+
+def start_fake_stripe(port: int):
+    server = uvicorn.Server(
+        uvicorn.Config(fake_stripe.app, port=port, log_level="warning")
+    )
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def measure_loop_lag(stop: asyncio.Event, interval: float = 0.01):
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst * 1000
+
+
+async def run(create, num_requests: int):
+    stop = asyncio.Event()
+    lag = asyncio.create_task(measure_loop_lag(stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(create(i) for i in range(num_requests)))
+    elapsed = (time.perf_counter() - start) * 1000
+    stop.set()
+    return elapsed, await lag
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--latency-ms", type=int, default=200)
+    parser.add_argument("--port", type=int, default=12111)
+    args = parser.parse_args()
+
+    server = start_fake_stripe(args.port)
+    fake_stripe.config["latency_ms"] = args.latency_ms
+    api_base = f"http://127.0.0.1:{args.port}"
+
+    # The old code path: module level stripe called synchronously
+    stripe.api_key = "sk_test_fake"
+    stripe.api_base = api_base
+
+    async def create_blocking(i):
+        stripe.PaymentIntent.create(**PARAMS, idempotency_key=f"blocking-{i}")
+
+    client = build_stripe_client(api_key="sk_test_fake", api_base=api_base)
+
+    async def create_async(i):
+        await client.v1.payment_intents.create_async(
+            params=PARAMS, options={"idempotency_key": f"async-{i}"}
+        )
+
+    print(f"{args.requests} requests, {args.latency_ms}ms Stripe latency")
+    print(f"{'client':<10}{'wall time':>12}{'max loop lag':>15}")
+    for name, create in [("blocking", create_blocking), ("async", create_async)]:
+        elapsed, lag = asyncio.run(run(create, args.requests))
+        print(f"{name:<10}{elapsed:>10.0f}ms{lag:>13.0f}ms")
+
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Benchmark of the admin user search on a large seeded dataset
+
+Seeds a separate fitness center with N fake users (1M by default) straight
+in SQL and compares the old four-column ILIKE search with the indexed one
+from admin/user_search.py.
+
+Run from the server folder against a scratch database:
+
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_user_search --users 1000000
+"""
+
+import argparse
+import statistics
+import time
+
+from sqlalchemy import text
+
+from database import SessionLocal, engine, Base
+from migrations import run_migrations
+from models import Users
+from admin.user_search import user_search_filter, user_search_order
+
+BENCHMARK_CENTER = "Benchmark center"
+
+
+def seed_users(db, num_users: int) -> int:
+    center_id = db.execute(
+        text(
+            "SELECT fitness_center_id FROM fitness_centers "
+            "WHERE fitness_center_name = :name"
+        ),
+        {"name": BENCHMARK_CENTER},
+    ).scalar()
+    if center_id:
+        existing = db.query(Users).filter(Users.fitness_center_fk == center_id).count()
+        if existing >= num_users:
+            return center_id
+    else:
+        center_id = db.execute(
+            text(
+                "INSERT INTO fitness_centers (fitness_center_name, fitness_center_address) "
+                "VALUES (:name, 'Benchmarkvej 1') RETURNING fitness_center_id"
+            ),
+            {"name": BENCHMARK_CENTER},
+        ).scalar()
+
+    role_id = db.execute(text("SELECT min(user_role_id) FROM user_roles")).scalar()
+    if role_id is None:
+        role_id = db.execute(
+            text("INSERT INTO user_roles (role_name) VALUES ('user') RETURNING user_role_id")
+        ).scalar()
+
+    # Names are drawn from small lists so searches get realistic hit counts
+    db.execute(
+        text(
+            """
+            INSERT INTO users (
+                user_email, user_first_name, user_last_name, is_member,
+                password_hash, user_phone, is_verified, created_at, updated_at,
+                user_role_fk, fitness_center_fk
+            )
+            SELECT
+                'bench' || i || '@' || (ARRAY['gmail.com','hotmail.com','fitboks.dk'])[1 + i % 3],
+                (ARRAY['Anders','Mette','Jonas','Sofie','Mikkel','Camilla','Asger','Mille'])[1 + i % 8],
+                (ARRAY['Jensen','Nielsen','Hansen','Pedersen','Andersen','Larsen'])[1 + (i / 8) % 6]
+                    || (i % 997),
+                true, 'x', lpad((10000000 + i)::text, 8, '0'), true, now(), now(),
+                :role_id, :center_id
+            FROM generate_series(1, :num_users) AS i
+            ON CONFLICT (user_email) DO NOTHING
+            """
+        ),
+        {"role_id": role_id, "center_id": center_id, "num_users": num_users},
+    )
+    db.commit()
+    db.execute(text("ANALYZE users"))
+    return center_id
+
+
+def legacy_search(db, center_id: int, search_query: str):
+    search_term = f"%{search_query.strip()}%"
+    return (
+        db.query(Users.user_id)
+        .filter(
+            Users.fitness_center_fk == center_id,
+            Users.user_first_name.ilike(search_term)
+            | Users.user_last_name.ilike(search_term)
+            | Users.user_email.ilike(search_term)
+            | Users.user_phone.ilike(search_term),
+        )
+        .order_by(Users.user_id)
+        .limit(20)
+        .all()
+    )
+
+
+def indexed_search(db, center_id: int, search_query: str):
+    return (
+        db.query(Users.user_id)
+        .filter(Users.fitness_center_fk == center_id, user_search_filter(search_query))
+        .order_by(*user_search_order(db, search_query))
+        .limit(20)
+        .all()
+    )
+
+
+def time_query(fn, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), max(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+
+    db = SessionLocal()
+    try:
+        start = time.perf_counter()
+        center_id = seed_users(db, args.users)
+        print(f"Seeded {args.users} users in {time.perf_counter() - start:.1f}s")
+
+        queries = ["mette", "jensen42", "10004", "bench4242@", "xyz-no-match"]
+        print(f"{'query':<16}{'legacy p50':>12}{'legacy max':>12}{'indexed p50':>13}{'indexed max':>13}")
+        for search_query in queries:
+            legacy = time_query(
+                lambda: legacy_search(db, center_id, search_query), args.repeat
+            )
+            indexed = time_query(
+                lambda: indexed_search(db, center_id, search_query), args.repeat
+            )
+            print(
+                f"{search_query:<16}{legacy[0]:>10.2f}ms{legacy[1]:>10.2f}ms"
+                f"{indexed[0]:>11.2f}ms{indexed[1]:>11.2f}ms"
+            )
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
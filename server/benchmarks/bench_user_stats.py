@@ -0,0 +1,150 @@
+"""
+Benchmark of the profile user-stats endpoint
+
+Seeds three users with 10, 1k and 10k bookings and compares the old way of
+computing the stats (load every booking, bucket them in Python) with
+profiles.profile.get_user_stats, which reads the user_booking_stats counters.
+
+Run from the server folder against a scratch database:
+
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_user_stats
+"""
+
+import argparse
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, text
+
+from database import SessionLocal, engine, Base
+from migrations import run_migrations
+from models import Bookings
+from profiles.profile import get_user_stats
+from bookings.booking_stats import reconcile_user_booking_stats
+
+BOOKING_COUNTS = [10, 1_000, 10_000]
+
+
+def seed_user_with_bookings(db, num_bookings: int) -> int:
+    center_id = db.execute(
+        text(
+            "INSERT INTO fitness_centers (fitness_center_name, fitness_center_address) "
+            "VALUES ('Benchmark center', 'Benchmarkvej 1') RETURNING fitness_center_id"
+        )
+    ).scalar()
+    role_id = db.execute(
+        text("INSERT INTO user_roles (role_name) VALUES ('user') RETURNING user_role_id")
+    ).scalar()
+    box_id = db.execute(
+        text(
+            "INSERT INTO boxes (box_number, created_at, fitness_center_fk) "
+            "VALUES ((SELECT coalesce(max(box_number), 0) + 1 FROM boxes), now(), :c) "
+            "RETURNING box_id"
+        ),
+        {"c": center_id},
+    ).scalar()
+    user_id = db.execute(
+        text(
+            """
+            INSERT INTO users (
+                user_email, user_first_name, user_last_name, is_member, password_hash,
+                user_phone, is_verified, created_at, updated_at, user_role_fk, fitness_center_fk
+            )
+            VALUES (
+                'stats-bench-' || :n || '-' || extract(epoch from clock_timestamp()) || '@fitboks.dk',
+                'Bench', 'User', true, 'x', '00000000', true, now(), now(), :role_id, :center_id
+            )
+            RETURNING user_id
+            """
+        ),
+        {"n": num_bookings, "role_id": role_id, "center_id": center_id},
+    ).scalar()
+
+    # Bookings spread over the last year and the coming month
+    db.execute(
+        text(
+            """
+            INSERT INTO bookings (
+                user_id, booking_box_id_fk, booking_date, booking_code, booking_start_hour,
+                booking_duration_hours, booking_end_hour, booking_timestamp
+            )
+            SELECT :user_id, :box_id,
+                   date_trunc('hour', now()) - (random() * 365 - 30) * interval '1 day',
+                   'B' || lpad((i % 1000)::text, 3, '0'), 10, 2, 12, now()
+            FROM generate_series(1, :n) AS i
+            """
+        ),
+        {"user_id": user_id, "box_id": box_id, "n": num_bookings},
+    )
+    db.commit()
+    # Bookings inserted straight in SQL skip the write paths, so count them
+    reconcile_user_booking_stats(db, user_id)
+    db.execute(text("ANALYZE bookings"))
+    return user_id
+
+
+def legacy_user_stats(db, user: int):
+    """The stats as they were computed before: every row loaded and bucketed"""
+    today = datetime.now()
+    start_month = (today.replace(day=1) - timedelta(days=330)).replace(day=1)
+    monthly_bookings = {}
+    weekly_bookings = {}
+    current = start_month
+    while current <= today:
+        monthly_bookings[current.strftime("%Y-%m")] = 0
+        current = (current.replace(day=1) + timedelta(days=32)).replace(day=1)
+    for week_num in range(4):
+        weekly_bookings[(today - timedelta(weeks=week_num)).strftime("%Y-%U")] = 0
+
+    bookings = (
+        db.query(Bookings)
+        .filter(
+            Bookings.user_id == user, func.date(Bookings.booking_date) >= start_month
+        )
+        .order_by(Bookings.booking_date.desc())
+        .all()
+    )
+    for booking in bookings:
+        month_key = booking.booking_date.strftime("%Y-%m")
+        week_key = booking.booking_date.strftime("%Y-%U")
+        if month_key in monthly_bookings:
+            monthly_bookings[month_key] += 1
+        if week_key in weekly_bookings:
+            weekly_bookings[week_key] += 1
+    return len(bookings), monthly_bookings, weekly_bookings
+
+
+def time_call(fn, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+
+    db = SessionLocal()
+    try:
+        print(f"{'bookings':>10}{'legacy p50':>14}{'stats p50':>12}")
+        for num_bookings in BOOKING_COUNTS:
+            user_id = seed_user_with_bookings(db, num_bookings)
+            legacy = time_call(lambda: legacy_user_stats(db, user_id), args.repeat)
+            # expunge_all keeps the identity map from making the ORM path cheaper
+            db.expunge_all()
+            current = time_call(lambda: get_user_stats(str(user_id), db), args.repeat)
+            print(f"{num_bookings:>10}{legacy:>12.2f}ms{current:>10.2f}ms")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
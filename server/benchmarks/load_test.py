@@ -0,0 +1,389 @@
+"""
+Load test of the API
+
+Seeds a scratch database (fitness centers, boxes, members, bookings and the
+workouts from workouts/workouts.json), starts the app with uvicorn in a
+subprocess and lets a number of concurrent clients run a weighted mix of
+requests against it for a fixed time: login, available time slots, booking
+creation, workout listing and the admin stats. Reports the p50/p95/p99
+latency and the throughput per endpoint and writes them as JSON, so two
+commits can be compared with --compare.
+
+Any Postgres works, a throwaway local cluster (initdb/pg_ctl) is enough.
+Run from the server folder:
+
+    DATABASE_URL=postgresql://... python -m benchmarks.load_test --clients 20 --duration 30
+    DATABASE_URL=postgresql://... python -m benchmarks.load_test --compare benchmarks/results/load-abc1234.json
+
+The dataset is only seeded when the database has no fitness centers yet,
+the load test user (LOAD_TEST_EMAIL) is created when missing. Mail is never
+sent but the app needs the MAIL_* settings to start, so dummy ones are set.
+"""
+
+import os
+
+for name, value in {
+    "MAIL_USERNAME": "loadtest",
+    "MAIL_PASSWORD": "loadtest",
+    "MAIL_FROM": "loadtest@fitboks.dk",
+    "MAIL_SERVER": "localhost",
+    "API_KEY": "loadtest",
+}.items():
+    os.environ.setdefault(name, value)
+
+import argparse  # noqa: E402
+import asyncio  # noqa: E402
+import json  # noqa: E402
+import random  # noqa: E402
+import subprocess  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+from datetime import date, datetime, timedelta  # noqa: E402
+
+import httpx  # noqa: E402
+
+from database import SessionLocal, engine, Base  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+from models import Boxes, FitnessCenters, UserRoles, Users, Workout  # noqa: E402
+from authentication.authentications import pwd_context  # noqa: E402
+from bookings.availability import rebuild_box_day_availability  # noqa: E402
+from bookings.booking_stats import reconcile_user_booking_stats  # noqa: E402
+from workouts.workout import load_workouts  # noqa: E402
+import seed_data  # noqa: E402
+
+LOAD_TEST_EMAIL = "loadtest@fitboks.dk"
+LOAD_TEST_PASSWORD = "LoadTest123!"
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(SERVER_DIR, "benchmarks", "results")
+
+DEFAULT_MIX = "login=5,availability=40,create_booking=15,workouts=25,admin_stats=15"
+
+
+##### SEEDING #####
+
+
+def seed(num_boxes: int, num_users: int, num_bookings: int) -> dict:
+    """Seed when empty, returns the ids the clients pick from"""
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+
+    db = SessionLocal()
+    try:
+        if not db.query(FitnessCenters).first():
+            print(
+                f"Seeding {num_boxes} boxes, {num_users} users, "
+                f"{num_bookings} bookings",
+                flush=True,
+            )
+            seed_data.create_user_roles(db)
+            centers = seed_data.create_fitness_centers(db)
+            boxes = seed_data.create_boxes(db, centers, num_boxes)
+            roles = db.query(UserRoles).all()
+            users = seed_data.create_users(db, centers, roles, num_users)
+            seed_data.create_bookings(db, users, boxes, num_bookings)
+            rebuild_box_day_availability(db, since=seed_data.start_date)
+            db.commit()
+            reconcile_user_booking_stats(db)
+
+        if not db.query(Workout).first():
+            path = os.path.join(SERVER_DIR, "workouts", "workouts.json")
+            with open(path) as file:
+                load_workouts(db, json.load(file))
+
+        user = db.query(Users).filter(Users.user_email == LOAD_TEST_EMAIL).first()
+        if not user:
+            admin_role = db.query(UserRoles).filter(UserRoles.role_name == "admin").first()
+            user = Users(
+                user_first_name="Load",
+                user_last_name="Test",
+                user_email=LOAD_TEST_EMAIL,
+                is_member=True,
+                password_hash=pwd_context.hash(LOAD_TEST_PASSWORD),
+                is_verified=True,
+                user_phone="00000000",
+                created_at=datetime.now(),
+                updated_at=datetime.now(),
+                user_role_fk=admin_role.user_role_id,
+                fitness_center_fk=db.query(FitnessCenters).first().fitness_center_id,
+            )
+            db.add(user)
+            db.commit()
+
+        boxes_by_center = {}
+        for box_id, center_id in db.query(Boxes.box_id, Boxes.fitness_center_fk):
+            boxes_by_center.setdefault(center_id, []).append(box_id)
+        return {"user_id": user.user_id, "boxes_by_center": boxes_by_center}
+    finally:
+        db.close()
+
+
+##### SERVER #####
+
+
+def start_server(port: int, workers: int, log_path: str) -> subprocess.Popen:
+    # The app prints on every request, that goes to a log file instead of
+    # the terminal (and costs the same as in production)
+    log = open(log_path, "w")
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--port", str(port),
+            "--workers", str(workers),
+            "--log-level", "warning",
+        ],
+        cwd=SERVER_DIR,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited, see {log_path}")
+        try:
+            if httpx.get(f"{url}/openapi.json").status_code == 200:
+                return server
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"Server did not start, see {log_path}")
+
+
+##### CLIENTS #####
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def add(self, endpoint: str, seconds: float, ok: bool):
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+
+async def login(client: httpx.AsyncClient, recorder: Recorder) -> str:
+    started = time.perf_counter()
+    response = await client.post(
+        "/api/auth/login",
+        json={"email": LOAD_TEST_EMAIL, "password": LOAD_TEST_PASSWORD},
+    )
+    recorder.add("login", time.perf_counter() - started, response.status_code == 200)
+    # The cookie is Secure, httpx keeps it to itself on plain http
+    return response.cookies.get("fitboks-auth-Token")
+
+
+def build_requests(data: dict):
+    """Request builders per endpoint, each returns (method, path, json)"""
+    centers = list(data["boxes_by_center"])
+
+    def some_day():
+        return date.today() + timedelta(days=random.randint(0, 7))
+
+    def availability():
+        return (
+            "GET",
+            f"/api/booking/{random.choice(centers)}/{some_day().isoformat()}"
+            f"/{random.randint(6, 18):02d}00/{random.randint(1, 3)}",
+            None,
+        )
+
+    def create_booking():
+        start = random.randint(6, 20)
+        duration = random.randint(1, 3)
+        center = random.choice(centers)
+        return (
+            "POST",
+            "/api/booking",
+            {
+                "user_id": data["user_id"],
+                "booking_box_id_fk": random.choice(data["boxes_by_center"][center]),
+                "booking_duration_hours": duration,
+                "booking_date": some_day().isoformat(),
+                "booking_start_hour": start,
+                "booking_end_hour": start + duration,
+            },
+        )
+
+    def workouts():
+        return "GET", "/api/workout", None
+
+    def admin_stats():
+        return "GET", f"/api/admin/stats/{random.choice(centers)}", None
+
+    return {
+        "availability": availability,
+        "create_booking": create_booking,
+        "workouts": workouts,
+        "admin_stats": admin_stats,
+    }
+
+
+async def run_client(url, api_key, mix, builders, deadline, recorder):
+    async with httpx.AsyncClient(
+        base_url=url, headers={"X-API-Key": api_key}, timeout=30
+    ) as client:
+        token = await login(client, recorder)
+        endpoints, weights = zip(*mix.items())
+        while time.monotonic() < deadline:
+            endpoint = random.choices(endpoints, weights)[0]
+            if endpoint == "login":
+                token = await login(client, recorder) or token
+                continue
+            method, path, body = builders[endpoint]()
+            started = time.perf_counter()
+            try:
+                response = await client.request(
+                    method,
+                    path,
+                    json=body,
+                    headers={"Cookie": f"fitboks-auth-Token={token}"},
+                )
+                ok = response.status_code < 400
+            except httpx.TransportError:
+                ok = False
+            recorder.add(endpoint, time.perf_counter() - started, ok)
+
+
+##### REPORT #####
+
+
+def percentile(values, p: float) -> float:
+    """Nearest rank percentile of sorted values"""
+    index = max(0, min(len(values) - 1, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize(latencies, errors: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": latencies[-1] * 1000,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SERVER_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(result: dict, previous: dict = None):
+    header = f"{'endpoint':<16}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+    if previous:
+        header += f"{'p95 before':>12}{'req/s before':>14}"
+    print(header)
+    rows = {**result["endpoints"], "total": result["total"]}
+    for endpoint, stats in rows.items():
+        line = (
+            f"{endpoint:<16}{stats['requests']:>9}{stats['errors']:>8}"
+            f"{stats['throughput_rps']:>9.1f}{stats['p50_ms']:>7.1f}ms"
+            f"{stats['p95_ms']:>7.1f}ms{stats['p99_ms']:>7.1f}ms"
+        )
+        if previous:
+            before = {**previous["endpoints"], "total": previous["total"]}.get(endpoint)
+            if before:
+                line += f"{before['p95_ms']:>10.1f}ms{before['throughput_rps']:>14.1f}"
+        print(line)
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        endpoint, weight = part.split("=")
+        weights[endpoint.strip()] = float(weight)
+    return weights
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--boxes", type=int, default=200)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--bookings", type=int, default=10_000)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--url", help="test a server that is already running instead of starting one"
+    )
+    parser.add_argument("--output", help="JSON file, default benchmarks/results/")
+    parser.add_argument("--compare", help="JSON result of an earlier run")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    data = seed(args.boxes, args.users, args.bookings)
+    builders = build_requests(data)
+    unknown = set(mix) - set(builders) - {"login"}
+    if unknown:
+        parser.error(f"Unknown endpoints in --mix: {', '.join(sorted(unknown))}")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    server = None
+    url = args.url
+    if not url:
+        server = start_server(
+            args.port, args.workers, os.path.join(RESULTS_DIR, "server.log")
+        )
+        url = f"http://127.0.0.1:{args.port}"
+
+    async def run(duration):
+        recorder = Recorder()
+        deadline = time.monotonic() + duration
+        started = time.monotonic()
+        await asyncio.gather(
+            *(
+                run_client(url, os.environ["API_KEY"], mix, builders, deadline, recorder)
+                for _ in range(args.clients)
+            )
+        )
+        return recorder, time.monotonic() - started
+
+    try:
+        if args.warmup:
+            asyncio.run(run(args.warmup))
+        recorder, elapsed = asyncio.run(run(args.duration))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    all_latencies = [s for latencies in recorder.latencies.values() for s in latencies]
+    result = {
+        "commit": git_commit(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "config": vars(args),
+        "elapsed_seconds": elapsed,
+        "endpoints": {
+            endpoint: summarize(latencies, recorder.errors.get(endpoint, 0), elapsed)
+            for endpoint, latencies in sorted(recorder.latencies.items())
+        },
+        "total": summarize(all_latencies, sum(recorder.errors.values()), elapsed),
+    }
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as file:
+            previous = json.load(file)
+    print_report(result, previous)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{result['commit']}.json")
+    with open(output, "w") as file:
+        json.dump(result, file, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
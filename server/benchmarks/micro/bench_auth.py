@@ -0,0 +1,71 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from starlette.requests import Request
+
+from authentication.jwt import create_access_token, get_current_user
+from authentication.validate import (
+    validate_password,
+    valide_email,
+    validate_first_name,
+    validate_last_name,
+    validate_phone_number,
+)
+
+## The same user info login puts in the token
+USER_INFO = {
+    "email": "bench@fitboks.dk",
+    "first_name": "Bench",
+    "last_name": "User",
+    "user_phone": "12345678",
+    "fitness_center": "Fitness X",
+    "fitness_center_id": 1,
+    "is_member": True,
+    "is_verified": True,
+    "user_role": 1,
+    "user_role_name": "admin",
+    "user_id": 1,
+}
+
+
+def test_create_access_token(benchmark):
+    benchmark(create_access_token, {"sub": USER_INFO}, timedelta(minutes=180))
+
+
+def test_get_current_user(benchmark):
+    token = create_access_token({"sub": USER_INFO}, timedelta(minutes=180))
+    request = Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "path": "/",
+            "headers": [(b"cookie", f"fitboks-auth-Token={token}".encode())],
+        }
+    )
+    loop = asyncio.new_event_loop()
+    try:
+        result = benchmark(lambda: loop.run_until_complete(get_current_user(request)))
+    finally:
+        loop.close()
+    assert result["user_info"]["sub"]["user_id"] == 1
+
+
+## Signup runs all of them, the password check is the only loop
+@pytest.mark.parametrize("length", [8, 64, 1024])
+def test_validate_password(benchmark, length):
+    # Worst case: the special character is the last one checked
+    password = ("aB3" * length)[: length - 1] + "!"
+    assert benchmark(validate_password, password)
+
+
+def test_validate_signup_fields(benchmark):
+    def validate():
+        return (
+            valide_email("bench@fitboks.dk")
+            and validate_first_name("Bench")
+            and validate_last_name("User")
+            and validate_phone_number("12345678")
+        )
+
+    assert benchmark(validate)
@@ -0,0 +1,46 @@
+import random
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from bookings.availability import box_free_slots, free_slots, hours_mask
+from admin.admin_boxes import availability_map
+
+
+def random_day_mask(bookings: int) -> int:
+    mask = 0
+    for _ in range(bookings):
+        mask |= hours_mask(random.randint(6, 21), random.randint(1, 4))
+    return mask
+
+
+## Free slots of a single box at several booking densities
+@pytest.mark.parametrize("bookings", [0, 4, 12])
+def test_free_slots(benchmark, bookings):
+    mask = random_day_mask(bookings)
+    benchmark(free_slots, mask, 8, 2)
+
+
+## The loop of the time slot endpoints over every box of a center
+@pytest.mark.parametrize("boxes", [10, 200, 2000])
+def test_box_free_slots(benchmark, boxes):
+    masks = {box_id: random_day_mask(4) for box_id in range(1, boxes + 1)}
+    result = benchmark(box_free_slots, masks, 8, 2)
+    assert len(result) <= boxes
+
+
+## The 7x24 map of get_boks_avaliability_by_id with a week of bookings
+@pytest.mark.parametrize("bookings", [0, 50, 168])
+def test_availability_map(benchmark, week, bookings):
+    rows = [
+        SimpleNamespace(
+            booking_id=booking_id,
+            booking_date=datetime.combine(random.choice(week), datetime.min.time()),
+            booking_start_hour=random.randint(0, 23),
+            booking_duration_hours=random.randint(1, 4),
+        )
+        for booking_id in range(bookings)
+    ]
+    result = benchmark(availability_map, week, rows)
+    assert len(result) == 7
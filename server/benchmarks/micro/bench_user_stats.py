@@ -0,0 +1,37 @@
+import random
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from profiles.profile import format_user_stats
+
+TODAY = date(2025, 3, 12)
+
+
+def stats_rows(count: int):
+    """Stand-ins for UserBookingStats rows, months, weeks and a total"""
+    rows = [SimpleNamespace(bucket_type="total", bucket_start=None, booking_count=count)]
+    for i in range(count):
+        if i % 2:
+            bucket_start = (TODAY - timedelta(days=30 * (i % 24))).replace(day=1)
+            bucket_type = "month"
+        else:
+            bucket_start = TODAY - timedelta(days=TODAY.weekday(), weeks=i % 60)
+            bucket_type = "week"
+        rows.append(
+            SimpleNamespace(
+                bucket_type=bucket_type,
+                bucket_start=bucket_start,
+                booking_count=random.randint(0, 30),
+            )
+        )
+    return rows
+
+
+## The bucket loop of get_user_stats over the counter rows of one user
+@pytest.mark.parametrize("rows", [10, 100, 1000])
+def test_format_user_stats(benchmark, rows):
+    stats = stats_rows(rows)
+    result = benchmark(format_user_stats, stats, TODAY)
+    assert len(result["weekly_stats"]) == 4
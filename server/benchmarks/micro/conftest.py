@@ -0,0 +1,39 @@
+## Micro-benchmarks of the pure Python hot paths (pytest-benchmark)
+##
+## The files are called bench_*.py so the normal test run does not pick them
+## up, pytest.ini in this folder makes them collectable when this folder is
+## given. Every run is compared with the stored baseline (0001 in
+## .benchmarks):
+##
+##     python -m pytest benchmarks/micro
+##
+## Single runs are too noisy to fail on by default. To check for regressions,
+## e.g. before merging a change to a hot path, run more rounds and let the
+## run fail when a benchmark got more than 30% slower than the baseline:
+##
+##     python -m pytest benchmarks/micro --benchmark-min-rounds=50 \
+##         --benchmark-compare-fail=min:30%
+##
+## Timings depend on the machine, after an intended change or on a new
+## machine record a new baseline and commit it:
+##
+##     rm -r benchmarks/micro/.benchmarks
+##     python -m pytest benchmarks/micro -o addopts= --benchmark-save=baseline \
+##         --benchmark-storage=benchmarks/micro/.benchmarks
+
+import random
+from datetime import date, timedelta
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def seeded_random():
+    # Same synthetic data on every run, so runs can be compared
+    random.seed(1234)
+
+
+@pytest.fixture
+def week():
+    today = date(2025, 3, 12)
+    return [today + timedelta(days=x) for x in range(7)]
@@ -0,0 +1,142 @@
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from bookings.partitions import booking_day_range
+
+## Precomputed availability in the box_day_availability table
+##
+## One row per box and day with a 24 bit mask of the booked hours (bit n set
+## means hour n is taken). The booking write paths keep the masks up to date
+## in the same transaction as the booking, so the availability endpoints read
+## one small row per box instead of scanning that day's bookings.
+## rebuild_box_day_availability() recomputes the masks from bookings.
+
+## Bits of the hours a booking covers, cut off at midnight like the
+## availability endpoints always did
+BOOKING_MASK_SQL = (
+    "bit_or(((1 << LEAST(booking_duration_hours, 24 - booking_start_hour)) - 1)"
+    " << booking_start_hour)"
+)
+
+
+def hours_mask(start_hour: int, duration_hours: int) -> int:
+    end_hour = min(start_hour + duration_hours, 24)
+    if end_hour <= start_hour:
+        return 0
+    return ((1 << (end_hour - start_hour)) - 1) << start_hour
+
+
+def free_slots(mask: int, first_hour: int, duration_hours: int) -> List[dict]:
+    """Every start hour from first_hour on where the whole duration is free"""
+    return [
+        {"start_hour": start_hour, "end_hour": start_hour + duration_hours}
+        for start_hour in range(first_hour, 24 - duration_hours + 1)
+        if not mask & hours_mask(start_hour, duration_hours)
+    ]
+
+
+def box_free_slots(
+    masks: Dict[int, int], first_hour: int, duration_hours: int
+) -> Dict[str, List[dict]]:
+    """Free slots per box id (as string), boxes without any are left out"""
+    available = {}
+    for box_id, mask in masks.items():
+        slots = free_slots(mask, first_hour, duration_hours)
+        if slots:
+            available[str(box_id)] = slots
+    return available
+
+
+def as_day(value) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return datetime.fromisoformat(value).date()
+    return value
+
+
+def get_day_masks(db: Session, box_ids: Iterable[int], day) -> Dict[int, int]:
+    """Booked hours of every box on a day, boxes without bookings are 0"""
+    box_ids = list(box_ids)
+    masks = dict.fromkeys(box_ids, 0)
+    if not box_ids:
+        return masks
+    rows = db.execute(
+        text(
+            "SELECT box_id_fk, booked_mask FROM box_day_availability "
+            "WHERE day = :day AND box_id_fk = ANY(:box_ids)"
+        ),
+        {"day": as_day(day), "box_ids": box_ids},
+    )
+    masks.update(dict(rows.all()))
+    return masks
+
+
+def mark_booked(
+    db: Session, box_id: int, booking_date, start_hour: int, duration_hours: int
+):
+    """Set the hours of a new booking, before commit"""
+    db.execute(
+        text(
+            """
+            INSERT INTO box_day_availability (box_id_fk, day, booked_mask)
+            VALUES (:box_id, :day, :mask)
+            ON CONFLICT (box_id_fk, day) DO UPDATE
+            SET booked_mask = box_day_availability.booked_mask | excluded.booked_mask
+            """
+        ),
+        {
+            "box_id": box_id,
+            "day": as_day(booking_date),
+            "mask": hours_mask(start_hour, duration_hours),
+        },
+    )
+
+
+def refresh_box_days(db: Session, box_days: Iterable[Tuple[int, object]]):
+    """
+    Recompute the masks of the given (box_id, day) pairs from bookings. Used
+    when bookings are removed, other bookings may still cover the same hours.
+    Pending deletes are flushed first so they are part of the recount
+    """
+    db.flush()
+    for box_id, day in set((box_id, as_day(day)) for box_id, day in box_days):
+        day_start, day_end = booking_day_range(day)
+        db.execute(
+            text(
+                f"""
+                INSERT INTO box_day_availability (box_id_fk, day, booked_mask)
+                SELECT :box_id, :day, coalesce({BOOKING_MASK_SQL}, 0)
+                FROM bookings
+                WHERE booking_box_id_fk = :box_id
+                  AND booking_date >= :day_start AND booking_date < :day_end
+                ON CONFLICT (box_id_fk, day) DO UPDATE
+                SET booked_mask = excluded.booked_mask
+                """
+            ),
+            {"box_id": box_id, "day": day, "day_start": day_start, "day_end": day_end},
+        )
+
+
+def rebuild_box_day_availability(conn, since: date = None) -> int:
+    """Recompute every mask from since (default today) on"""
+    day_start, _ = booking_day_range(since or date.today())
+    conn.execute(
+        text("DELETE FROM box_day_availability WHERE day >= :day"),
+        {"day": day_start.date()},
+    )
+    return conn.execute(
+        text(
+            f"""
+            INSERT INTO box_day_availability (box_id_fk, day, booked_mask)
+            SELECT booking_box_id_fk, booking_date::date, {BOOKING_MASK_SQL}
+            FROM bookings
+            WHERE booking_date >= :day_start
+            GROUP BY 1, 2
+            """
+        ),
+        {"day_start": day_start},
+    ).rowcount
@@ -0,0 +1,134 @@
+import hashlib
+import hmac
+import os
+from datetime import date
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from authentication.jwt import SECRET_KEY
+from bookings.availability import as_day
+from bookings.partitions import booking_day_range
+
+## Booking codes: 4 characters out of 0-9 and A-Z, unique per center and day
+##
+## The n-th booking of a center on a day gets code number permute(n), where
+## permute is a keyed Feistel permutation of the 36^4 possible codes. Being
+## a permutation, two bookings of the same center and day never share a
+## code. Without the key the codes can't be guessed from each other.
+##
+## n comes from the booking_code_counters row of the center and day, which
+## is incremented by an upsert in the booking's transaction. Concurrent
+## bookings of the same center and day queue on that row lock for the rest of
+## their transaction and then get the next number, so nothing is handed out
+## twice. A rolled back booking gives its number back.
+##
+## Bookings made before this scheme (or by seed_data.py) have random codes,
+## which the counter knows nothing about. A new code is therefore checked
+## against the codes of the center's bookings that day, and on a hit the
+## next number is taken.
+##
+## The key is BOOKING_CODE_SECRET, the JWT secret when that is not set.
+
+ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+CODE_LENGTH = 4
+CODE_SPACE = len(ALPHABET) ** CODE_LENGTH  # 1679616
+
+## The Feistel network works on 2 * HALF_BITS bits (4194304 values), numbers
+## outside the code space are permuted again until they fall inside it
+## (cycle walking, 2.5 rounds on average)
+HALF_BITS = 11
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 4
+
+_KEY = hmac.new(
+    (os.getenv("BOOKING_CODE_SECRET") or SECRET_KEY).encode(),
+    b"booking-codes",
+    hashlib.sha256,
+).digest()
+
+NEXT_CODE_NUMBER_SQL = text(
+    """
+    INSERT INTO booking_code_counters (fitness_center_fk, day, issued)
+    SELECT fitness_center_fk, :day, 1 FROM boxes WHERE box_id = :box_id
+    ON CONFLICT (fitness_center_fk, day) DO UPDATE
+    SET issued = booking_code_counters.issued + 1
+    RETURNING fitness_center_fk, issued - 1
+    """
+)
+
+CODE_TAKEN_SQL = text(
+    """
+    SELECT 1 FROM bookings
+    JOIN boxes ON boxes.box_id = bookings.booking_box_id_fk
+    WHERE bookings.booking_code = :code
+      AND bookings.booking_date >= :day_start
+      AND bookings.booking_date < :day_end
+      AND boxes.fitness_center_fk = :fitness_center_id
+    LIMIT 1
+    """
+)
+
+
+def round_value(tweak: bytes, round_number: int, half: int) -> int:
+    digest = hmac.new(
+        _KEY, tweak + bytes((round_number,)) + half.to_bytes(2, "big"), hashlib.sha256
+    ).digest()
+    return int.from_bytes(digest[:2], "big") & HALF_MASK
+
+
+def feistel(number: int, tweak: bytes) -> int:
+    left, right = number >> HALF_BITS, number & HALF_MASK
+    for round_number in range(ROUNDS):
+        left, right = right, left ^ round_value(tweak, round_number, right)
+    return (left << HALF_BITS) | right
+
+
+def permute(number: int, tweak: bytes) -> int:
+    """Bijection of range(CODE_SPACE) onto itself"""
+    number = feistel(number, tweak)
+    while number >= CODE_SPACE:
+        number = feistel(number, tweak)
+    return number
+
+
+def encode(number: int) -> str:
+    chars = []
+    for _ in range(CODE_LENGTH):
+        number, digit = divmod(number, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+def booking_code(fitness_center_id: int, day: date, number: int) -> str:
+    """Code of the number-th booking of a center on a day"""
+    tweak = f"{fitness_center_id}:{day.isoformat()}".encode()
+    return encode(permute(number, tweak))
+
+
+def allocate_booking_code(db: Session, box_id: int, booking_date) -> str:
+    """The next code of the box's center on the booking's day, before commit"""
+    day = as_day(booking_date)
+    day_start, day_end = booking_day_range(day)
+    while True:
+        row = db.execute(NEXT_CODE_NUMBER_SQL, {"box_id": box_id, "day": day}).first()
+        if row is None:
+            raise HTTPException(status_code=404, detail="Box not found")
+        fitness_center_id, number = row
+        if number >= CODE_SPACE:
+            raise HTTPException(
+                status_code=409, detail="No booking codes left for the day"
+            )
+        code = booking_code(fitness_center_id, day, number)
+        taken = db.execute(
+            CODE_TAKEN_SQL,
+            {
+                "code": code,
+                "day_start": day_start,
+                "day_end": day_end,
+                "fitness_center_id": fitness_center_id,
+            },
+        ).first()
+        if taken is None:
+            return code
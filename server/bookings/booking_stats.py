@@ -0,0 +1,114 @@
+from datetime import date
+from typing import Optional
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+## Per user booking counters in the user_booking_stats table
+##
+## Every booking write adds or subtracts one from the user's lifetime total,
+## the month and the ISO week of the booking, in the same transaction as the
+## booking itself. reconcile_user_booking_stats() recounts everything from
+## the bookings table and repairs any drift. It runs once a day from the
+## scheduler (see scheduler.py), and once as a migration to fill the table on
+## databases that had bookings before it existed.
+
+TOTAL_BUCKET_START = date(1970, 1, 1)
+## pg_try_advisory_xact_lock key of the daily reconcile, one worker runs it
+BOOKING_STATS_LOCK = 8102
+
+RECORD_BOOKING_SQL = text(
+    """
+    INSERT INTO user_booking_stats (user_id, bucket_type, bucket_start, booking_count)
+    VALUES
+        (:user_id, 'total', :total_start, :delta),
+        (:user_id, 'month', date_trunc('month', CAST(:booking_date AS timestamp))::date, :delta),
+        (:user_id, 'week', date_trunc('week', CAST(:booking_date AS timestamp))::date, :delta)
+    ON CONFLICT (user_id, bucket_type, bucket_start) DO UPDATE
+    SET booking_count = user_booking_stats.booking_count + excluded.booking_count
+    """
+)
+
+
+def record_booking(db: Session, user_id: int, booking_date, delta: int = 1):
+    """Count a created (delta=1) or deleted (delta=-1) booking, before commit"""
+    db.execute(
+        RECORD_BOOKING_SQL,
+        {
+            "user_id": user_id,
+            "booking_date": booking_date,
+            "delta": delta,
+            "total_start": TOTAL_BUCKET_START,
+        },
+    )
+
+
+RECONCILE_SQL = """
+    WITH expected AS (
+        SELECT user_id, 'total' AS bucket_type, CAST(:total_start AS date) AS bucket_start,
+               count(*) AS booking_count
+        FROM bookings {where} GROUP BY user_id
+        UNION ALL
+        SELECT user_id, 'month', date_trunc('month', booking_date)::date, count(*)
+        FROM bookings {where} GROUP BY 1, 3
+        UNION ALL
+        SELECT user_id, 'week', date_trunc('week', booking_date)::date, count(*)
+        FROM bookings {where} GROUP BY 1, 3
+    ),
+    repaired AS (
+        INSERT INTO user_booking_stats AS s (user_id, bucket_type, bucket_start, booking_count)
+        SELECT * FROM expected
+        ON CONFLICT (user_id, bucket_type, bucket_start) DO UPDATE
+        SET booking_count = excluded.booking_count
+        WHERE s.booking_count <> excluded.booking_count
+        RETURNING 1
+    ),
+    removed AS (
+        DELETE FROM user_booking_stats s
+        WHERE {stats_where} NOT EXISTS (
+            SELECT 1 FROM expected e
+            WHERE e.user_id = s.user_id
+              AND e.bucket_type = s.bucket_type
+              AND e.bucket_start = s.bucket_start
+        )
+        RETURNING 1
+    )
+    SELECT (SELECT count(*) FROM repaired), (SELECT count(*) FROM removed)
+"""
+
+
+def reconcile_user_booking_stats(db: Session, user_id: int = None) -> dict:
+    """Recount the stats of one user (or everyone) and fix rows that drifted"""
+    if user_id is None:
+        statement = RECONCILE_SQL.format(where="", stats_where="")
+    else:
+        statement = RECONCILE_SQL.format(
+            where="WHERE user_id = :user_id", stats_where="s.user_id = :user_id AND"
+        )
+
+    repaired, removed = db.execute(
+        text(statement), {"user_id": user_id, "total_start": TOTAL_BUCKET_START}
+    ).one()
+    db.commit()
+    return {"repaired": repaired, "removed": removed}
+
+
+def backfill_user_booking_stats(conn):
+    """Fill user_booking_stats from bookings, only while it is empty"""
+    if conn.execute(text("SELECT EXISTS (SELECT 1 FROM user_booking_stats)")).scalar():
+        return
+    conn.execute(
+        text(RECONCILE_SQL.format(where="", stats_where="")),
+        {"user_id": None, "total_start": TOTAL_BUCKET_START},
+    )
+
+
+def scheduled_reconcile(db: Session) -> Optional[dict]:
+    """The daily reconcile, None when another worker is running it"""
+    locked = db.execute(
+        text("SELECT pg_try_advisory_xact_lock(:lock)"), {"lock": BOOKING_STATS_LOCK}
+    ).scalar()
+    if not locked:
+        db.rollback()
+        return None
+    # Commits, which releases the lock
+    return reconcile_user_booking_stats(db)
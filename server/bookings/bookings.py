@@ -2,16 +2,26 @@ from fastapi import APIRouter, Depends, HTTPException, Path
 from authentication.jwt import get_current_user
 from datetime import datetime
 from database import get_db
-from sqlalchemy import func
-from models import Bookings, Boxes
+from models import Bookings
 from csrf import validate_csrf
+from bookings.booking_stats import record_booking
+from bookings.booking_codes import allocate_booking_code
+from reference_cache import center_boxes
+from bookings.partitions import booking_day_range
+from bookings.availability import (
+    as_day,
+    box_free_slots,
+    get_day_masks,
+    mark_booked,
+    refresh_box_days,
+)
 from bookings.types.booking_types import (
     BookingData,
     BookingResponse,
     TimeSlotResponse,
     DeleteBookingResponse,
 )
-import random
+import events
 
 
 booking_router = APIRouter(dependencies=[Depends(get_current_user)])
@@ -43,12 +53,12 @@ def get_booking(
     db=Depends(get_db),
 ):
     # Get current date
-    today = datetime.now().date()
+    today_start, _ = booking_day_range(datetime.now())
 
     # Get all bookings for the authenticated user from today onwards
     user_bookings = (
         db.query(Bookings)
-        .filter(Bookings.user_id == user_id, func.date(Bookings.booking_date) >= today)
+        .filter(Bookings.user_id == user_id, Bookings.booking_date >= today_start)
         .all()
     )
     # Format datetime objects as strings
@@ -74,9 +84,6 @@ def get_booking(
 
 ##################################
 #### GET AVAILABLE TIME SLOTS ####
-def does_time_overlap(start1: int, end1: int, start2: int, end2: int) -> bool:
-    """Check if two time periods overlap"""
-    return not (end1 <= start2 or start1 >= end2)
 
 
 # /get-available-time-slots/2/131224/1302/2
@@ -103,61 +110,17 @@ def get_available_time_slots(
         if next_available_hour is None:
             return {"message": "No more bookings available today"}
 
-        # Get all boxes for the fitness center
-        boxes = (
-            db.query(Boxes).filter(Boxes.fitness_center_fk == fitness_center_id).all()
-        )
-
-        # Get existing bookings for the date
-        bookings = (
-            db.query(Bookings)
-            .filter(
-                Bookings.booking_box_id_fk.in_([box.box_id for box in boxes]),
-                func.date(Bookings.booking_date) == date,
-            )
-            .all()
-        )
+        # Boxes of the center come from the reference cache
+        boxes = center_boxes(db, fitness_center_id)
 
-        availability = {}
-        for box in boxes:
-            availability[box.box_id] = []
-
-            # Check each possible starting hour
-            for start_hour in range(next_available_hour, 24 - duration + 1):
-                end_hour = start_hour + duration
-                is_available = True
-
-                # Check against all existing bookings
-                for booking in bookings:
-                    if booking.booking_box_id_fk == box.box_id:
-                        if does_time_overlap(
-                            start_hour,
-                            end_hour,
-                            booking.booking_start_hour,
-                            booking.booking_start_hour + booking.booking_duration_hours,
-                        ):
-                            is_available = False
-                            break
-
-                if is_available:
-                    availability[box.box_id].append(
-                        {
-                            "start_hour": start_hour,
-                            "end_hour": end_hour,
-                        }
-                    )
-
-                # Remove boxes with no available slots
-                available_boxes = {
-                    str(box_id): slots
-                    for box_id, slots in availability.items()
-                    if slots
-                }
+        # Booked hours of every box that day, one row per box
+        masks = get_day_masks(db, boxes.box_ids, date)
 
         return {
             "next_available_hour": next_available_hour,
             "duration_hours": duration,
-            "box_availability": available_boxes,
+            # Boxes with no available slots are left out
+            "box_availability": box_free_slots(masks, next_available_hour, duration),
         }
 
     except Exception as e:
@@ -180,8 +143,9 @@ def create_booking(
     user_id = booking_data.user_id
     box_id = booking_data.booking_box_id_fk
     booking_duration = booking_data.booking_duration_hours
-    booking_code = "".join([str(random.randint(0, 9)) for _ in range(4)])
     booking_date = booking_data.booking_date
+    # Unique for the center and day, see bookings/booking_codes.py
+    booking_code = allocate_booking_code(db, box_id, booking_date)
     start_time = booking_data.booking_start_hour
     end_time = booking_data.booking_end_hour
 
@@ -199,6 +163,13 @@ def create_booking(
 
     # Add the new booking to the database
     db.add(new_booking)
+    record_booking(db, user_id, booking_date, 1)
+    mark_booked(db, box_id, booking_date, start_time, booking_duration)
+    events.emit(
+        db,
+        events.BOOKINGS_CHANGED,
+        {"box_id": box_id, "day": as_day(booking_date).isoformat()},
+    )
     db.commit()
     db.refresh(new_booking)
 
@@ -224,5 +195,17 @@ def delete_booking(
 
     # Delete the booking
     db.delete(booking_to_delete)
+    record_booking(db, booking_to_delete.user_id, booking_to_delete.booking_date, -1)
+    refresh_box_days(
+        db, [(booking_to_delete.booking_box_id_fk, booking_to_delete.booking_date)]
+    )
+    events.emit(
+        db,
+        events.BOOKINGS_CHANGED,
+        {
+            "box_id": booking_to_delete.booking_box_id_fk,
+            "day": as_day(booking_to_delete.booking_date).isoformat(),
+        },
+    )
     db.commit()
     return {"status": "success", "message": "Booking deleted successfully"}
@@ -0,0 +1,120 @@
+import math
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+## Compact per worker copy of the boxes of a center
+##
+## The availability endpoints only need the box ids of a center, the admin
+## box list a few more columns. Instead of a list of dicts per center the
+## columns are kept in parallel arrays ordered by box_id (4 bytes per id and
+## number, 1 per state, 8 per timestamp). The arrays are built by
+## reference_cache.center_boxes() from the shared cache and are replaced, not
+## modified, when the boxes change.
+
+EPOCH = datetime(1970, 1, 1)
+
+## Values of the box_state enum
+BOX_OPEN = "open"
+BOX_CLOSED = "closed"
+BOX_STATES = (BOX_OPEN, BOX_CLOSED)
+
+
+def to_seconds(value: Optional[datetime]) -> int:
+    """Seconds since EPOCH, 0 for None"""
+    if value is None:
+        return 0
+    return int((value - EPOCH).total_seconds())
+
+
+def from_seconds(seconds: int) -> Optional[datetime]:
+    return EPOCH + timedelta(seconds=seconds) if seconds else None
+
+
+def is_closed(box_state: str, closed_until: Optional[datetime], now: datetime) -> bool:
+    return box_state == BOX_CLOSED and closed_until is not None and closed_until > now
+
+
+def status_label(
+    box_state: str, closed_until: Optional[datetime], now: datetime = None
+) -> str:
+    """The box_availability text the API always returned ("Lukket: 2t")"""
+    now = now or datetime.now()
+    if not is_closed(box_state, closed_until, now):
+        return "Ledigt"
+    # Hours counted from the nearest full hour, like update_boks_status
+    # counts them when an admin closes a box
+    nearest_hour = now.replace(minute=0, second=0, microsecond=0)
+    if now.minute >= 30:
+        nearest_hour += timedelta(hours=1)
+    hours = math.ceil((closed_until - nearest_hour).total_seconds() / 3600)
+    return f"Lukket: {max(hours, 1)}t"
+
+
+def box_dict(
+    box_id: int,
+    box_number: int,
+    box_state: str,
+    closed_until: Optional[datetime],
+    created_at: datetime,
+    fitness_center_id: int,
+    now: datetime = None,
+) -> dict:
+    return {
+        "box_id": box_id,
+        "created_at": created_at.strftime("%Y-%m-%d %H:%M:%S"),
+        "box_number": box_number,
+        "box_availability": status_label(box_state, closed_until, now),
+        "box_state": box_state,
+        "closed_until": closed_until.isoformat() if closed_until else None,
+        "fitness_center_fk": fitness_center_id,
+    }
+
+
+class CenterBoxes:
+    """The boxes of one center as parallel arrays, ordered by box_id"""
+
+    __slots__ = (
+        "fitness_center_id",
+        "box_ids",
+        "box_numbers",
+        "states",
+        "closed_until",
+        "created_at",
+    )
+
+    def __init__(self, fitness_center_id: int, rows: List[list]):
+        # rows are [box_id, box_number, box_state, closed_until seconds,
+        # created_at seconds]
+        rows = sorted(rows)
+        self.fitness_center_id = fitness_center_id
+        self.box_ids = array("i", (row[0] for row in rows))
+        self.box_numbers = array("i", (row[1] for row in rows))
+        self.states = array("b", (BOX_STATES.index(row[2]) for row in rows))
+        self.closed_until = array("q", (row[3] for row in rows))
+        self.created_at = array("q", (row[4] for row in rows))
+
+    def __len__(self) -> int:
+        return len(self.box_ids)
+
+    def box(self, index: int, now: datetime = None) -> dict:
+        return box_dict(
+            self.box_ids[index],
+            self.box_numbers[index],
+            BOX_STATES[self.states[index]],
+            from_seconds(self.closed_until[index]),
+            EPOCH + timedelta(seconds=self.created_at[index]),
+            self.fitness_center_id,
+            now,
+        )
+
+    def get(self, box_id: int, now: datetime = None) -> Optional[dict]:
+        index = bisect_left(self.box_ids, box_id)
+        if index < len(self.box_ids) and self.box_ids[index] == box_id:
+            return self.box(index, now)
+        return None
+
+    def as_dicts(self, now: datetime = None) -> List[dict]:
+        now = now or datetime.now()
+        return [self.box(index, now) for index in range(len(self.box_ids))]
@@ -0,0 +1,158 @@
+import re
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import events
+from bookings.partitions import booking_day_range
+from models import FitnessCenters
+from reference_cache import BOXES, mark_reference_changed
+
+## Box status: Boxes.box_state ("open" / "closed") and Boxes.closed_until
+##
+## A box is closed while a booking covers the current hour, until the end of
+## that booking (bookings end at midnight, like in the availability masks).
+## The "Ledigt" / "Lukket: <n>t" text of the API is derived from both
+## columns when the box is read (box_cache.status_label), so it is correct
+## at any time. update_boks_status() sets the columns when an admin closes or
+## opens a box. At every full hour the scheduler (see scheduler.py)
+## recomputes them for all boxes of a center from today's bookings in one
+## UPDATE, which only touches the boxes whose status changed, so boxes
+## booked by members are closed as well.
+##
+## Every worker runs the scheduler. The per center transaction takes
+## pg_try_advisory_xact_lock(BOX_STATUS_LOCK, center id), so while one worker
+## updates a center the others skip it, and a worker that comes later finds
+## nothing left to change.
+
+BOX_STATUS_LOCK = 8101
+
+CLOSED_LABEL = re.compile(r"^Lukket:\s*(\d+)\s*t$")
+
+
+def parse_status_label(label: str) -> Optional[int]:
+    """Hours of a "Lukket: 2t" status, None for "Ledigt", else ValueError"""
+    if label == "Ledigt":
+        return None
+    match = CLOSED_LABEL.match(label.strip())
+    if not match:
+        raise ValueError(f"Unknown box status: {label}")
+    return int(match.group(1))
+
+
+ROLLOVER_SQL = text(
+    """
+    UPDATE boxes
+    SET box_state = current.box_state, closed_until = current.closed_until
+    FROM (
+        SELECT
+            boxes.box_id,
+            CASE
+                WHEN COUNT(bookings.booking_id) = 0 THEN 'open'
+                ELSE 'closed'
+            END::box_state AS box_state,
+            CASE
+                WHEN COUNT(bookings.booking_id) > 0 THEN
+                    CAST(:day_start AS timestamp) + LEAST(
+                        MAX(bookings.booking_start_hour + bookings.booking_duration_hours),
+                        24
+                    ) * interval '1 hour'
+            END AS closed_until
+        FROM boxes
+        LEFT JOIN bookings
+            ON bookings.booking_box_id_fk = boxes.box_id
+            AND bookings.booking_date >= :day_start
+            AND bookings.booking_date < :day_end
+            AND bookings.booking_start_hour <= :hour
+            AND bookings.booking_start_hour + bookings.booking_duration_hours > :hour
+        WHERE boxes.fitness_center_fk = :fitness_center_id
+        GROUP BY boxes.box_id
+    ) AS current
+    WHERE boxes.box_id = current.box_id
+        AND (boxes.box_state, boxes.closed_until)
+            IS DISTINCT FROM (current.box_state, current.closed_until)
+    RETURNING boxes.box_id
+    """
+)
+
+
+def rollover_center(db: Session, fitness_center_id: int, now: datetime) -> List[int]:
+    """Recompute the status of a center's boxes, returns the changed box ids"""
+    locked = db.execute(
+        text("SELECT pg_try_advisory_xact_lock(:lock, :fitness_center_id)"),
+        {"lock": BOX_STATUS_LOCK, "fitness_center_id": fitness_center_id},
+    ).scalar()
+    if not locked:
+        # Another worker is on it
+        db.rollback()
+        return []
+
+    day_start, day_end = booking_day_range(now)
+    changed = db.execute(
+        ROLLOVER_SQL,
+        {
+            "hour": now.hour,
+            "day_start": day_start,
+            "day_end": day_end,
+            "fitness_center_id": fitness_center_id,
+        },
+    ).scalars().all()
+    if changed:
+        # Not an ORM change, so the box caches are invalidated by hand
+        mark_reference_changed(db, BOXES)
+        for box_id in changed:
+            events.emit(db, events.BOXES_CHANGED, {"box_id": box_id, "day": None})
+    db.commit()
+    return changed
+
+
+def rollover_box_status(db: Session, now: datetime = None) -> int:
+    now = now or datetime.now()
+    changed = 0
+    center_ids = [
+        center_id for (center_id,) in db.query(FitnessCenters.fitness_center_id)
+    ]
+    for fitness_center_id in center_ids:
+        changed += len(rollover_center(db, fitness_center_id, now))
+    return changed
+
+
+def migrate_box_status(conn):
+    """box_state / closed_until replace the box_availability text column"""
+    conn.execute(
+        text(
+            "DO $$ BEGIN CREATE TYPE box_state AS ENUM ('open', 'closed'); "
+            "EXCEPTION WHEN duplicate_object THEN NULL; END $$"
+        )
+    )
+    conn.execute(
+        text(
+            "ALTER TABLE boxes ADD COLUMN IF NOT EXISTS box_state box_state "
+            "NOT NULL DEFAULT 'open'"
+        )
+    )
+    conn.execute(text("ALTER TABLE boxes ADD COLUMN IF NOT EXISTS closed_until TIMESTAMP"))
+    legacy = conn.execute(
+        text(
+            "SELECT 1 FROM information_schema.columns "
+            "WHERE table_name = 'boxes' AND column_name = 'box_availability'"
+        )
+    ).first()
+    if not legacy:
+        return
+    # "Lukket: 2t" counted the hours from the current full hour. The next
+    # rollover recomputes the columns from the bookings anyway.
+    conn.execute(
+        text(
+            """
+            UPDATE boxes
+            SET box_state = 'closed',
+                closed_until = date_trunc('hour', LOCALTIMESTAMP)
+                    + substring(box_availability from '[0-9]+')::int * interval '1 hour'
+            WHERE box_availability ~ '^Lukket: *[0-9]+ *t$'
+            """
+        )
+    )
+    conn.execute(text("ALTER TABLE boxes DROP COLUMN box_availability"))
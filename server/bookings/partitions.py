@@ -0,0 +1,185 @@
+import os
+from datetime import date, datetime, timedelta
+from sqlalchemy import text
+
+## The bookings table is partitioned by month on booking_date
+##
+## Most queries only touch today, the coming week or the last 30 days, so
+## with range predicates on booking_date postgres only has to visit one or
+## two monthly partitions. Partitions are named bookings_YYYY_MM and are
+## created ahead of time by ensure_booking_partitions(). A default partition
+## catches anything outside the created months. Old months can be moved out
+## of the table with archive_booking_partitions().
+
+PARTITIONS_AHEAD = int(os.getenv("BOOKING_PARTITIONS_AHEAD", "3"))
+ARCHIVE_SCHEMA = "bookings_archive"
+
+
+def booking_day_range(day):
+    """Start and end of a day, for partition friendly booking_date filters"""
+    if isinstance(day, str):
+        day = datetime.strptime(day, "%Y-%m-%d")
+    start = datetime(day.year, day.month, day.day)
+    return start, start + timedelta(days=1)
+
+
+def month_start(day: date) -> date:
+    return date(day.year, day.month, 1)
+
+
+def next_month(day: date) -> date:
+    return (month_start(day) + timedelta(days=32)).replace(day=1)
+
+
+def partition_name(month: date) -> str:
+    return f"bookings_{month.year}_{month.month:02d}"
+
+
+def is_partitioned(conn) -> bool:
+    return (
+        conn.execute(
+            text("SELECT relkind FROM pg_class WHERE oid = to_regclass('bookings')")
+        ).scalar()
+        == "p"
+    )
+
+
+def create_month_partition(conn, month: date) -> bool:
+    name = partition_name(month)
+    if conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar():
+        return False
+
+    start, end = month_start(month), next_month(month)
+    # Rows of that month may already sit in the default partition, they are
+    # moved over before the new partition is attached
+    conn.execute(
+        text(
+            f"CREATE TABLE {name} "
+            "(LIKE bookings INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+    )
+    if conn.execute(text("SELECT to_regclass('bookings_default')")).scalar():
+        conn.execute(
+            text(
+                f"""
+                WITH moved AS (
+                    DELETE FROM bookings_default
+                    WHERE booking_date >= :start AND booking_date < :end
+                    RETURNING *
+                )
+                INSERT INTO {name} SELECT * FROM moved
+                """
+            ),
+            {"start": start, "end": end},
+        )
+    conn.execute(
+        text(
+            f"ALTER TABLE bookings ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{start}') TO ('{end}')"
+        )
+    )
+    return True
+
+
+def ensure_booking_partitions(conn, first_month: date = None, months_ahead: int = None):
+    """Create the monthly partitions from first_month until months_ahead"""
+    if not is_partitioned(conn):
+        return []
+
+    conn.execute(
+        text("CREATE TABLE IF NOT EXISTS bookings_default PARTITION OF bookings DEFAULT")
+    )
+    today = date.today()
+    month = month_start(first_month or today)
+    last_month = month_start(today)
+    for _ in range(PARTITIONS_AHEAD if months_ahead is None else months_ahead):
+        last_month = next_month(last_month)
+
+    created = []
+    while month <= last_month:
+        if create_month_partition(conn, month):
+            created.append(partition_name(month))
+        month = next_month(month)
+    return created
+
+
+def migrate_bookings_to_partitioned(conn):
+    """One off migration of an existing, unpartitioned bookings table"""
+    from models import Bookings
+
+    if is_partitioned(conn):
+        return
+
+    conn.execute(text("ALTER TABLE bookings RENAME TO bookings_unpartitioned"))
+    # Index names are global, the old ones are renamed so the new table can
+    # be created with the names from models.py
+    index_names = conn.execute(
+        text("SELECT indexname FROM pg_indexes WHERE tablename = 'bookings_unpartitioned'")
+    ).scalars()
+    for index_name in list(index_names):
+        conn.execute(text(f'ALTER INDEX "{index_name}" RENAME TO "{index_name}_old"'))
+
+    Bookings.__table__.create(bind=conn)
+    first_booking = conn.execute(
+        text("SELECT min(booking_date) FROM bookings_unpartitioned")
+    ).scalar()
+    ensure_booking_partitions(conn, first_month=first_booking or date.today())
+
+    columns = ", ".join(column.name for column in Bookings.__table__.columns)
+    conn.execute(
+        text(
+            f"INSERT INTO bookings ({columns}) "
+            f"SELECT {columns} FROM bookings_unpartitioned"
+        )
+    )
+    conn.execute(
+        text(
+            "SELECT setval(pg_get_serial_sequence('bookings', 'booking_id'), "
+            "coalesce((SELECT max(booking_id) FROM bookings), 0) + 1, false)"
+        )
+    )
+    conn.execute(text("DROP TABLE bookings_unpartitioned"))
+
+
+def archive_booking_partitions(conn, keep_months: int):
+    """
+    Detach the partitions older than keep_months and move them to the
+    bookings_archive schema. The rows are kept, but no longer read by the API
+    (note that reconciling user_booking_stats afterwards drops their counts)
+    """
+    cutoff = month_start(date.today())
+    for _ in range(keep_months):
+        cutoff = month_start(cutoff - timedelta(days=1))
+
+    conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+    partitions = conn.execute(
+        text(
+            """
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = 'bookings' AND child.relname ~ '^bookings_[0-9]{4}_[0-9]{2}$'
+            """
+        )
+    ).scalars()
+
+    archived = []
+    for name in sorted(partitions):
+        year, month = int(name[9:13]), int(name[14:16])
+        if date(year, month, 1) < cutoff:
+            conn.execute(text(f"ALTER TABLE bookings DETACH PARTITION {name}"))
+            conn.execute(text(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+            archived.append(name)
+    return archived
+
+
+def maintain_booking_partitions(engine):
+    with engine.begin() as conn:
+        created = ensure_booking_partitions(conn)
+        archived = []
+        keep_months = os.getenv("BOOKING_ARCHIVE_AFTER_MONTHS")
+        if keep_months:
+            archived = archive_booking_partitions(conn, int(keep_months))
+    if created or archived:
+        print(f"Booking partitions created: {created} archived: {archived}", flush=True)
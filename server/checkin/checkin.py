@@ -0,0 +1,70 @@
+from datetime import datetime
+
+from fastapi import APIRouter, BackgroundTasks, Body, Depends, HTTPException, Path
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, get_db
+from models import CheckIns
+from checkin.checkin_cache import find_booking
+from checkin.types.checkin_types import CheckInRequest, CheckInResponse
+
+## Check-in at the door terminals, which only have the API key
+##
+## The booking is looked up in the per worker cache of the current and next
+## hour's codes (checkin/checkin_cache.py). The check-in is stored in
+## check_ins after the response is sent and counts for checked_in_today in
+## the admin stats.
+
+checkin_router = APIRouter()
+
+
+def record_check_in(fitness_center_id: int, booking: dict, checked_in_at: datetime):
+    db = SessionLocal()
+    try:
+        db.execute(
+            insert(CheckIns)
+            .values(
+                booking_id=booking["booking_id"],
+                booking_date=booking["booking_date"],
+                box_id_fk=booking["box_id"],
+                fitness_center_fk=fitness_center_id,
+                user_id=booking["user_id"],
+                checked_in_at=checked_in_at,
+            )
+            .on_conflict_do_nothing(index_elements=["booking_id", "booking_date"])
+        )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Could not record check-in {booking['booking_id']}: {e}", flush=True)
+    finally:
+        db.close()
+
+
+##################
+#### CHECK IN ####
+
+
+@checkin_router.post("/{fitness_center_id}", response_model=CheckInResponse)
+def check_in(
+    background_tasks: BackgroundTasks,
+    fitness_center_id: int = Path(..., description="ID of the fitness center"),
+    data: CheckInRequest = Body(...),
+    db: Session = Depends(get_db),
+):
+    now = datetime.now()
+    # No query unless the center's codes were changed or not loaded this hour
+    booking = find_booking(db, fitness_center_id, data.booking_code, now)
+    if booking is None:
+        raise HTTPException(status_code=404, detail="Invalid booking code")
+
+    background_tasks.add_task(record_check_in, fitness_center_id, booking, now)
+    return {
+        "status": "checked_in",
+        "booking_id": booking["booking_id"],
+        "box_id": booking["box_id"],
+        "box_number": booking["box_number"],
+        "start_hour": booking["start_hour"],
+        "end_hour": booking["end_hour"],
+    }
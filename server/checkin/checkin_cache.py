@@ -0,0 +1,137 @@
+import os
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from threading import Lock
+from typing import Dict, FrozenSet, List, Optional
+
+from sqlalchemy.orm import Session
+
+import event_listener
+import events
+from bookings.partitions import booking_day_range
+from models import Bookings
+from reference_cache import center_boxes
+
+## Booking codes of the current and the next hour, per fitness center
+##
+## The door terminals check in with a booking code. Every worker keeps, per
+## center, the bookings that cover the current hour or start in the next
+## one, keyed by code, so a check-in is a dict lookup. The entry of a center
+## is loaded with one query (ix_bookings_box_id_booking_date_code) the first
+## time it's needed in an hour. It is dropped when a booking of one of its
+## boxes changes today (BOOKINGS_CHANGED, from this or another worker, see
+## events.py), and everything is dropped on RESYNC.
+##
+## Without a LISTEN connection bookings made by other workers are not seen,
+## so then a code that is not found reloads the center before giving up.
+
+## A booking of the next hour can check in this many minutes early
+CHECKIN_EARLY_MINUTES = int(os.getenv("CHECKIN_EARLY_MINUTES", "10"))
+
+
+@dataclass(frozen=True)
+class HourCodes:
+    day: date
+    hour: int
+    box_ids: FrozenSet[int]
+    codes: Dict[str, List[dict]]
+
+
+_cache: Dict[int, HourCodes] = {}
+_lock = Lock()
+## Bumped by every invalidation, a load that started before one is not
+## stored
+_generation = {"value": 0}
+
+
+def load_hour_codes(db: Session, fitness_center_id: int, now: datetime) -> HourCodes:
+    boxes = center_boxes(db, fitness_center_id)
+    day_start, day_end = booking_day_range(now)
+    rows = db.query(
+        Bookings.booking_id,
+        Bookings.booking_date,
+        Bookings.booking_code,
+        Bookings.booking_box_id_fk,
+        Bookings.user_id,
+        Bookings.booking_start_hour,
+        Bookings.booking_duration_hours,
+    ).filter(
+        Bookings.booking_box_id_fk.in_(list(boxes.box_ids)),
+        Bookings.booking_date >= day_start,
+        Bookings.booking_date < day_end,
+        Bookings.booking_start_hour <= now.hour + 1,
+        Bookings.booking_start_hour + Bookings.booking_duration_hours > now.hour,
+    )
+
+    codes: Dict[str, List[dict]] = {}
+    for row in rows:
+        codes.setdefault(row.booking_code.upper(), []).append(
+            {
+                "booking_id": row.booking_id,
+                "booking_date": row.booking_date,
+                "box_id": row.booking_box_id_fk,
+                "box_number": boxes.get(row.booking_box_id_fk)["box_number"],
+                "user_id": row.user_id,
+                "start_hour": row.booking_start_hour,
+                "end_hour": row.booking_start_hour + row.booking_duration_hours,
+            }
+        )
+    return HourCodes(now.date(), now.hour, frozenset(boxes.box_ids), codes)
+
+
+def hour_codes(
+    db: Session, fitness_center_id: int, now: datetime, reload: bool = False
+) -> HourCodes:
+    with _lock:
+        entry = _cache.get(fitness_center_id)
+        generation = _generation["value"]
+    if not reload and entry and (entry.day, entry.hour) == (now.date(), now.hour):
+        return entry
+
+    entry = load_hour_codes(db, fitness_center_id, now)
+    with _lock:
+        if generation == _generation["value"]:
+            _cache[fitness_center_id] = entry
+    return entry
+
+
+def can_check_in(booking: dict, now: datetime) -> bool:
+    """Covers the current hour, or starts in the next one within a few minutes"""
+    if booking["start_hour"] <= now.hour < booking["end_hour"]:
+        return True
+    early = now + timedelta(minutes=CHECKIN_EARLY_MINUTES)
+    return booking["start_hour"] == now.hour + 1 and early.hour == booking["start_hour"]
+
+
+def find_booking(
+    db: Session, fitness_center_id: int, booking_code: str, now: datetime = None
+) -> Optional[dict]:
+    """The booking the code checks in now, None for an unknown or early code"""
+    now = now or datetime.now()
+    code = booking_code.strip().upper()
+    entry = hour_codes(db, fitness_center_id, now)
+    if code not in entry.codes and not event_listener.state["connected"]:
+        entry = hour_codes(db, fitness_center_id, now, reload=True)
+    for booking in entry.codes.get(code, []):
+        if can_check_in(booking, now):
+            return booking
+    return None
+
+
+def invalidate(payload: dict = None):
+    """Drop the centers of the changed box, all of them without a box_id"""
+    payload = payload or {}
+    day = payload.get("day")
+    if day and day != date.today().isoformat():
+        return
+    box_id = payload.get("box_id")
+    with _lock:
+        _generation["value"] += 1
+        for fitness_center_id, entry in list(_cache.items()):
+            if box_id is None or box_id in entry.box_ids:
+                del _cache[fitness_center_id]
+
+
+events.subscribe(events.BOOKINGS_CHANGED, invalidate)
+events.subscribe(events.BOXES_CHANGED, invalidate)
+events.subscribe(events.RESYNC, invalidate)
@@ -0,0 +1,14 @@
+from pydantic import BaseModel
+
+
+class CheckInRequest(BaseModel):
+    booking_code: str
+
+
+class CheckInResponse(BaseModel):
+    status: str
+    booking_id: int
+    box_id: int
+    box_number: int
+    start_hour: int
+    end_hour: int
@@ -0,0 +1,2 @@
+## Makes the top level modules (database, models, admin, ...) importable
+## from the tests, the same way they are imported when running main.py
@@ -4,7 +4,11 @@ from sqlalchemy.orm import sessionmaker
 from fastapi import HTTPException, Security
 from fastapi.security.api_key import APIKeyHeader
 from starlette.status import HTTP_403_FORBIDDEN
+from collections import deque
+from threading import Lock, Thread
 import os
+import time
+from instrumentation import instrument_engine, register_statement_observer
 
 ## Postgres Database URL
 SQLALCHEMY_DATABASE_URL = os.getenv(
@@ -45,3 +49,86 @@ async def get_api_key(api_key_header: str = Security(api_key_header)):
         raise HTTPException(
             status_code=HTTP_403_FORBIDDEN, detail="Could not validate API key"
         )
+
+
+##### SLOW QUERY LOG #####
+## Statements slower than SLOW_QUERY_THRESHOLD_MS are kept in a ring buffer
+## (served by admin/admin_diagnostics.py). The timing comes from the statement
+## hooks of instrumentation.py. Bound values can be emails, phone numbers or
+## password hashes, so only their names and types are kept. With
+## SLOW_QUERY_EXPLAIN=true the plan of a slow SELECT is captured as well, at
+## most once per SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS, on its own connection in
+## a background thread. That is a plain EXPLAIN: EXPLAIN ANALYZE would run the
+## statement again, and a SELECT can have side effects (pg_notify(), advisory
+## locks, nextval() and setval(), which a rollback does not undo).
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "false") == "true"
+SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS = float(
+    os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS", "60")
+)
+
+slow_queries = deque(maxlen=int(os.getenv("SLOW_QUERY_LOG_SIZE", "100")))
+_last_explain = {"at": 0.0}
+_explain_lock = Lock()
+
+
+def explain_allowed() -> bool:
+    with _explain_lock:
+        now = time.monotonic()
+        if now - _last_explain["at"] < SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS:
+            return False
+        _last_explain["at"] = now
+        return True
+
+
+def redact_parameters(parameters, executemany: bool = False):
+    if executemany:
+        rows = list(parameters)
+        first = redact_parameters(rows[0]) if rows else None
+        return {"rows": len(rows), "first": first}
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+def capture_plan(entry: dict, statement: str, parameters):
+    try:
+        with engine.connect() as conn:
+            # The EXPLAIN itself must not end up in the slow query log
+            conn = conn.execution_options(slow_query_log=False)
+            rows = conn.exec_driver_sql("EXPLAIN " + statement, parameters)
+            entry["plan"] = "\n".join(str(row[0]) for row in rows)
+            conn.rollback()
+    except Exception as e:
+        entry["plan"] = f"EXPLAIN failed: {e}"
+
+
+def record_slow_query(conn, statement, parameters, executemany, seconds):
+    duration_ms = seconds * 1000
+    if duration_ms < SLOW_QUERY_THRESHOLD_MS:
+        return
+    if not conn.get_execution_options().get("slow_query_log", True):
+        return
+
+    entry = {
+        "at": time.time(),
+        "duration_ms": round(duration_ms, 2),
+        "statement": statement,
+        "parameters": repr(redact_parameters(parameters, executemany))[:1000],
+        "plan": None,
+    }
+    slow_queries.append(entry)
+    print(f"Slow query ({duration_ms:.0f}ms): {statement[:200]}", flush=True)
+
+    is_select = statement.lstrip().upper().startswith("SELECT")
+    if SLOW_QUERY_EXPLAIN and is_select and not executemany and explain_allowed():
+        # The plan needs the real values, they are only handed to the thread
+        Thread(
+            target=capture_plan, args=(entry, statement, parameters), daemon=True
+        ).start()
+
+
+instrument_engine(engine)
+register_statement_observer(record_slow_query)
@@ -0,0 +1,214 @@
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Optional, Set
+
+import events
+from instrumentation import register_metrics_collector
+
+## Receives the events of the other workers (see events.py)
+##
+## One task per worker holds a dedicated connection that LISTENs on
+## events.CHANNEL. The socket is watched with loop.add_reader(), so waiting
+## costs no thread. Every notification is published to the local
+## subscribers, except:
+##
+## - the worker's own events, those were published after its commit
+## - numbers of a sender that were seen before
+## - when more than EVENT_BACKLOG_LIMIT notifications arrive at once: a
+##   single RESYNC replaces them, a full reload is cheaper than replaying a
+##   backlog
+##
+## Senders take their sequence numbers before they commit, so concurrent
+## transactions can arrive as n+2 before n+1. A missing number only counts
+## as lost (RESYNC) when it did not arrive within EVENT_GAP_GRACE_SECONDS,
+## e.g. because the transaction that took it failed to commit.
+## - after a lost connection, the notifications sent meanwhile are gone, so
+##   the reconnect publishes RESYNC as well
+
+EVENT_BACKLOG_LIMIT = int(os.getenv("EVENT_BACKLOG_LIMIT", "1000"))
+EVENT_GAP_GRACE_SECONDS = float(os.getenv("EVENT_GAP_GRACE_SECONDS", "2"))
+LISTEN_KEEPALIVE_SECONDS = 30
+RECONNECT_MAX_SECONDS = 30
+
+
+class SenderSequence:
+    """Highest contiguous sequence number of a sender, plus the ones received past it"""
+
+    __slots__ = ("contiguous", "ahead", "gap_since")
+
+    def __init__(self, sequence: int):
+        self.contiguous = sequence
+        self.ahead: Set[int] = set()
+        self.gap_since: Optional[float] = None
+
+    def receive(self, sequence: int, now: float) -> bool:
+        """False for a number that was seen before"""
+        if sequence <= self.contiguous or sequence in self.ahead:
+            return False
+        self.ahead.add(sequence)
+        advanced = False
+        while self.contiguous + 1 in self.ahead:
+            self.contiguous += 1
+            self.ahead.remove(self.contiguous)
+            advanced = True
+        if not self.ahead:
+            self.gap_since = None
+        elif self.gap_since is None or advanced:
+            self.gap_since = now
+        return True
+
+    def gap_expired(self, now: float) -> bool:
+        return (
+            self.gap_since is not None
+            and now - self.gap_since >= EVENT_GAP_GRACE_SECONDS
+        )
+
+    def skip_gap(self):
+        # The missing numbers are given up on, a RESYNC covers them
+        if self.ahead:
+            self.contiguous = max(self.ahead)
+        self.ahead.clear()
+        self.gap_since = None
+
+
+_senders: Dict[str, SenderSequence] = {}
+state = {"connected": False, "received": 0, "resyncs": 0}
+
+
+def dispatch(messages: List[str], now: float = None):
+    """Publish a batch of notification payloads, or RESYNC instead"""
+    now = time.monotonic() if now is None else now
+    state["received"] += len(messages)
+    resync = len(messages) > EVENT_BACKLOG_LIMIT
+    to_publish = []
+    for raw in messages:
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            continue
+        sender, sequence = message["s"], message["n"]
+        if sender == events.SENDER_ID:
+            continue
+        sequences = _senders.get(sender)
+        if sequences is None:
+            _senders[sender] = SenderSequence(sequence)
+        elif not sequences.receive(sequence, now):
+            continue
+        to_publish.append(message)
+
+    if resync:
+        for sequences in _senders.values():
+            sequences.skip_gap()
+        publish_resync("backlog")
+        return
+    for message in to_publish:
+        events.publish(message["t"], message["p"])
+    check_gaps(now)
+
+
+def gaps_pending() -> bool:
+    return any(sequences.gap_since is not None for sequences in _senders.values())
+
+
+def check_gaps(now: float = None):
+    """One RESYNC for the senders whose missing numbers did not arrive in time"""
+    now = time.monotonic() if now is None else now
+    expired = [
+        sequences for sequences in _senders.values() if sequences.gap_expired(now)
+    ]
+    for sequences in expired:
+        sequences.skip_gap()
+    if expired:
+        publish_resync("gap")
+
+
+def publish_resync(reason: str):
+    state["resyncs"] += 1
+    print(f"Event listener resync: {reason}", flush=True)
+    events.publish(events.RESYNC, {"reason": reason})
+
+
+def metrics() -> List[str]:
+    return [
+        "# HELP event_listener_connected Whether the LISTEN connection is up",
+        "# TYPE event_listener_connected gauge",
+        f"event_listener_connected {int(state['connected'])}",
+        "# HELP event_listener_received_total Notifications received",
+        "# TYPE event_listener_received_total counter",
+        f"event_listener_received_total {state['received']}",
+        "# HELP event_listener_resyncs_total RESYNC events published",
+        "# TYPE event_listener_resyncs_total counter",
+        f"event_listener_resyncs_total {state['resyncs']}",
+    ]
+
+
+register_metrics_collector(metrics)
+
+
+def open_listen_connection(engine):
+    # Taken out of the pool, the connection stays LISTENing until it breaks
+    connection = engine.raw_connection()
+    connection.detach()
+    dbapi_connection = connection.dbapi_connection
+    dbapi_connection.autocommit = True
+    with dbapi_connection.cursor() as cursor:
+        cursor.execute(f"LISTEN {events.CHANNEL}")
+    return dbapi_connection
+
+
+async def pg_event_listener(engine):
+    if engine.dialect.name != "postgresql":
+        return
+    loop = asyncio.get_running_loop()
+    backoff = 1
+    connected_before = False
+    while True:
+        connection = None
+        readable = asyncio.Event()
+        try:
+            connection = await asyncio.to_thread(open_listen_connection, engine)
+            loop.add_reader(connection.fileno(), readable.set)
+            state["connected"] = True
+            backoff = 1
+            if connected_before:
+                publish_resync("reconnect")
+            connected_before = True
+
+            while True:
+                # With a sequence gap open, wake up in time to give up on it
+                timeout = LISTEN_KEEPALIVE_SECONDS
+                if gaps_pending():
+                    timeout = EVENT_GAP_GRACE_SECONDS
+                try:
+                    await asyncio.wait_for(readable.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    # A broken connection is only noticed when it's used
+                    with connection.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                readable.clear()
+                connection.poll()
+                if connection.notifies:
+                    messages = [notify.payload for notify in connection.notifies]
+                    connection.notifies.clear()
+                    dispatch(messages)
+                else:
+                    check_gaps()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Event listener failed: {e}", flush=True)
+        finally:
+            state["connected"] = False
+            if connection is not None:
+                try:
+                    loop.remove_reader(connection.fileno())
+                except Exception:
+                    pass
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, RECONNECT_MAX_SECONDS)
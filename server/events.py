@@ -0,0 +1,120 @@
+import itertools
+import json
+import os
+import uuid
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+## Small publish/subscribe, used to tell caches and indexes that data changed.
+##
+## Write paths call emit(db, topic, payload) before their commit. The event
+## is kept on the session and:
+##
+## - sent with pg_notify() in the committing transaction, so Postgres hands
+##   it to every worker LISTENing (see event_listener.py) only if the commit
+##   succeeds, and never for a rollback
+## - published to this worker's subscribers right after the commit
+##
+## The listener skips the events this worker sent itself, so every
+## subscriber sees an event once. publish() is the local half and can be
+## called directly for changes that don't come from a session.
+
+ENABLE_PG_EVENTS = os.getenv("ENABLE_PG_EVENTS", "true") == "true"
+CHANNEL = "fitboks_events"
+## Postgres refuses NOTIFY payloads of 8000 bytes or more
+MAX_NOTIFY_BYTES = 7900
+
+USER_CHANGED = "user.changed"
+USER_DELETED = "user.deleted"
+## {"box_id": ..., "day": "YYYY-MM-DD"}, box_id/day are None when the change
+## touched several boxes or days
+BOOKINGS_CHANGED = "bookings.changed"
+## Boxes were added, removed or changed status
+BOXES_CHANGED = "boxes.changed"
+## Events from other workers may have been missed (listener reconnected,
+## a number of a sender's sequence never arrived, too large backlog): reload
+## everything
+RESYNC = "resync"
+
+## Identifies the events of this worker, with a sequence number per event so
+## receivers notice lost ones. Numbers are taken before the commit, so they
+## can arrive out of order (see event_listener.py)
+SENDER_ID = uuid.uuid4().hex[:8]
+_sequence = itertools.count(1)
+
+_subscribers: Dict[str, List[Callable[[dict], None]]] = defaultdict(list)
+
+
+def subscribe(topic: str, callback: Callable[[dict], None]):
+    _subscribers[topic].append(callback)
+
+
+def publish(topic: str, payload: dict):
+    for callback in list(_subscribers.get(topic, [])):
+        try:
+            callback(payload)
+        except Exception as e:
+            ## A failing subscriber must never fail the request that published
+            print(f"Event handler for {topic} failed: {e}", flush=True)
+
+
+def emit(session: Session, topic: str, payload: dict):
+    """Publish topic/payload once the session commits, to every worker"""
+    pending = session.info.setdefault("pending_events", {})
+    # The same event twice in one transaction is sent once
+    pending.setdefault((topic, json.dumps(payload, sort_keys=True)), payload)
+
+
+def notify_message(topic: str, payload: dict) -> str:
+    message = json.dumps(
+        {"t": topic, "p": payload, "s": SENDER_ID, "n": next(_sequence)},
+        separators=(",", ":"),
+    )
+    if len(message.encode()) > MAX_NOTIFY_BYTES:
+        # Too large to send, the other workers reload instead
+        return notify_message(RESYNC, {"reason": "payload"})
+    return message
+
+
+@event.listens_for(Session, "before_commit")
+def send_pending_events(session):
+    if not ENABLE_PG_EVENTS:
+        return
+    # Flushing first lets the ORM hooks of the last changes emit as well
+    session.flush()
+    pending = session.info.get("pending_events")
+    if not pending or session.get_bind().dialect.name != "postgresql":
+        return
+    for (topic, _), payload in pending.items():
+        session.execute(
+            text("SELECT pg_notify(:channel, :message)"),
+            {"channel": CHANNEL, "message": notify_message(topic, payload)},
+        )
+
+
+@event.listens_for(Session, "after_commit")
+def publish_pending_events(session):
+    pending = session.info.pop("pending_events", None)
+    for (topic, _), payload in (pending or {}).items():
+        publish(topic, payload)
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_pending_events(session):
+    session.info.pop("pending_events", None)
+
+
+def user_payload(user) -> dict:
+    """The fields of a Users row that subscribers care about"""
+    return {
+        "user_id": user.user_id,
+        "fitness_center_id": user.fitness_center_fk,
+        "first_name": user.user_first_name,
+        "last_name": user.user_last_name,
+        "email": user.user_email,
+        "phone": user.user_phone,
+        "is_member": user.is_member,
+    }
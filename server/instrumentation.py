@@ -0,0 +1,313 @@
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+
+## Request timing and SQL instrumentation
+##
+## InstrumentationMiddleware times every request and keeps a RequestStats
+## object in a context variable for its duration. The SQLAlchemy hooks
+## installed by instrument_engine() time every statement and add it to the
+## stats of the request it ran for (the context is copied into the
+## threadpool, so sync endpoints are covered too). Per route template this
+## gives the latency, the number of statements, the SQL time and the slowest
+## statement, sent back as a Server-Timing header and exported in Prometheus
+## text format by metrics_text() on /metrics.
+##
+## The latency runs until the response starts (status and headers sent).
+## Sending the body is counted apart, so an SSE stream that stays open for
+## hours or a BackgroundTask after the response does not skew the histogram.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestStats:
+    __slots__ = ("sql_count", "sql_seconds", "slowest_seconds", "slowest_statement")
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement = None
+
+    def add_statement(self, statement: str, seconds: float):
+        self.sql_count += 1
+        self.sql_seconds += seconds
+        if seconds > self.slowest_seconds:
+            self.slowest_seconds = seconds
+            self.slowest_statement = statement
+
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar(
+    "current_request", default=None
+)
+
+
+class RouteMetrics:
+    __slots__ = (
+        "requests",
+        "latency_sum",
+        "body_seconds",
+        "buckets",
+        "statuses",
+        "sql_count",
+        "sql_seconds",
+        "slowest_seconds",
+        "slowest_statement",
+    )
+
+    def __init__(self):
+        self.requests = 0
+        self.latency_sum = 0.0
+        self.body_seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.statuses: Dict[int, int] = {}
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement = None
+
+
+_routes: Dict[Tuple[str, str], RouteMetrics] = {}
+_routes_lock = Lock()
+
+## Other modules can add their own lines to /metrics
+_collectors: List[Callable[[], List[str]]] = []
+
+## Other modules can look at every timed statement (the slow query log in
+## database.py), called as observer(conn, statement, parameters, executemany, seconds)
+_statement_observers: List[Callable] = []
+
+
+def register_metrics_collector(collector: Callable[[], List[str]]):
+    _collectors.append(collector)
+
+
+def register_statement_observer(observer: Callable):
+    if observer not in _statement_observers:
+        _statement_observers.append(observer)
+
+
+def record_request(
+    method: str,
+    route: str,
+    status: int,
+    seconds: float,
+    stats: RequestStats,
+    body_seconds: float = 0.0,
+):
+    with _routes_lock:
+        metrics = _routes.get((method, route))
+        if metrics is None:
+            metrics = _routes[(method, route)] = RouteMetrics()
+        metrics.requests += 1
+        metrics.latency_sum += seconds
+        metrics.body_seconds += body_seconds
+        metrics.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+        metrics.sql_count += stats.sql_count
+        metrics.sql_seconds += stats.sql_seconds
+        if stats.slowest_seconds > metrics.slowest_seconds:
+            metrics.slowest_seconds = stats.slowest_seconds
+            metrics.slowest_statement = stats.slowest_statement
+
+
+def route_metrics() -> List[dict]:
+    """Snapshot of the per route numbers, slowest statement included"""
+    with _routes_lock:
+        return [
+            {
+                "method": method,
+                "route": route,
+                "requests": metrics.requests,
+                "avg_seconds": metrics.latency_sum / metrics.requests,
+                "avg_body_seconds": metrics.body_seconds / metrics.requests,
+                "avg_sql_statements": metrics.sql_count / metrics.requests,
+                "avg_sql_seconds": metrics.sql_seconds / metrics.requests,
+                "slowest_sql_seconds": metrics.slowest_seconds,
+                "slowest_sql_statement": metrics.slowest_statement,
+            }
+            for (method, route), metrics in _routes.items()
+        ]
+
+
+def reset_metrics():
+    with _routes_lock:
+        _routes.clear()
+
+
+##### SQLALCHEMY HOOKS #####
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["query_start_time"].pop()
+    stats = current_request.get()
+    if stats is not None:
+        stats.add_statement(statement, seconds)
+    for observer in _statement_observers:
+        observer(conn, statement, parameters, executemany, seconds)
+
+
+def handle_error(context):
+    # after_cursor_execute does not run for a failed statement
+    if context.connection is not None and context.execution_context is not None:
+        starts = context.connection.info.get("query_start_time")
+        if starts:
+            starts.pop()
+
+
+def instrument_engine(engine):
+    if not event.contains(engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+        event.listen(engine, "handle_error", handle_error)
+
+
+##### ASGI MIDDLEWARE #####
+
+
+def server_timing(seconds: float, stats: RequestStats) -> bytes:
+    return (
+        f"app;dur={seconds * 1000:.1f}, "
+        f'db;dur={stats.sql_seconds * 1000:.1f};desc="{stats.sql_count} queries", '
+        f"db-slowest;dur={stats.slowest_seconds * 1000:.1f}"
+    ).encode()
+
+
+class InstrumentationMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        started = time.perf_counter()
+        response_started = None
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status, response_started
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_started = time.perf_counter()
+                headers = list(message.get("headers", []))
+                elapsed = response_started - started
+                headers.append((b"server-timing", server_timing(elapsed, stats)))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_request.reset(token)
+            finished = time.perf_counter()
+            if response_started is None:
+                response_started = finished
+            # FastAPI puts the matched route in the scope, its path is the
+            # template ("/api/booking/{user_id}") so ids don't explode the labels
+            route = scope.get("route")
+            record_request(
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                status,
+                response_started - started,
+                stats,
+                body_seconds=finished - response_started,
+            )
+
+
+##### PROMETHEUS #####
+
+
+def label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def route_series(name, help_text, metric_type, routes, value) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for (method, route), metrics in routes:
+        lines.append(
+            f'{name}{{method="{method}",route="{label(route)}"}} {value(metrics)}'
+        )
+    return lines
+
+
+def metrics_text() -> str:
+    lines = [
+        "# HELP http_request_duration_seconds Request latency per route",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    with _routes_lock:
+        routes = sorted(_routes.items())
+        for (method, route), metrics in routes:
+            labels = f'method="{method}",route="{label(route)}"'
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, metrics.buckets):
+                cumulative += count
+                lines.append(
+                    f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} '
+                    f"{cumulative}"
+                )
+            lines += [
+                f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} '
+                f"{metrics.requests}",
+                f"http_request_duration_seconds_sum{{{labels}}} {metrics.latency_sum}",
+                f"http_request_duration_seconds_count{{{labels}}} {metrics.requests}",
+            ]
+
+        lines += [
+            "# HELP http_requests_total Requests per route and status",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route), metrics in routes:
+            for status, count in sorted(metrics.statuses.items()):
+                lines.append(
+                    f'http_requests_total{{method="{method}",route="{label(route)}",'
+                    f'status="{status}"}} {count}'
+                )
+
+        lines += route_series(
+            "http_response_body_seconds_total",
+            "Time spent sending response bodies (streams, background tasks) per route",
+            "counter",
+            routes,
+            lambda metrics: metrics.body_seconds,
+        )
+        lines += route_series(
+            "db_statements_total",
+            "SQL statements run per route",
+            "counter",
+            routes,
+            lambda metrics: metrics.sql_count,
+        )
+        lines += route_series(
+            "db_statement_seconds_total",
+            "Time spent in SQL per route",
+            "counter",
+            routes,
+            lambda metrics: metrics.sql_seconds,
+        )
+        lines += route_series(
+            "db_slowest_statement_seconds",
+            "Slowest SQL statement seen per route",
+            "gauge",
+            routes,
+            lambda metrics: metrics.slowest_seconds,
+        )
+
+    for collector in _collectors:
+        try:
+            lines += collector()
+        except Exception as e:
+            print(f"Metrics collector failed: {e}", flush=True)
+    return "\n".join(lines) + "\n"
@@ -1,10 +1,13 @@
 from fastapi import FastAPI, Depends, Request
+from fastapi.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 
 
 # from sqlalchemy.orm import Session
 from database import SessionLocal, engine, Base, get_api_key
+from migrations import run_migrations
 from authentication.authentications import authentication_router
 from workouts.workout import workout_router
 from admin.admin import admin_router
@@ -12,14 +15,56 @@ from stripe_payments.payments import payments_router
 from profiles.profile import profile_router
 from seed_data import seed_router
 from bookings.bookings import booking_router
+from checkin.checkin import checkin_router
+from admin.member_index import build_member_index
+from scheduler import scheduler
+from stripe_payments.webhook_events import webhook_event_worker
+from event_listener import pg_event_listener
+from events import ENABLE_PG_EVENTS
+from instrumentation import InstrumentationMiddleware, instrument_engine, metrics_text
+from reference_cache import reference_cache, CENTERS, ROLES, BOXES
+
+import asyncio
 
 # import models
 import os
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
+run_migrations(engine)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The shared reference cache outlives the workers (and a recreated
+    # database), so whatever it holds is reloaded once after a start
+    reference_cache.invalidate(CENTERS, ROLES, BOXES)
+
+    # Per worker prefix index for the admin autocomplete
+    if os.getenv("ENABLE_MEMBER_INDEX", "true") == "true":
+        try:
+            await run_in_threadpool(build_member_index)
+        except Exception as e:
+            print(f"Could not build member index: {e}", flush=True)
+
+    # Events of the other workers, for the caches, indexes and box boards
+    tasks = []
+    if ENABLE_PG_EVENTS:
+        tasks.append(asyncio.create_task(pg_event_listener(engine)))
+
+    # Hourly box status rollover and daily booking partition maintenance
+    if os.getenv("ENABLE_SCHEDULER", "true") == "true":
+        tasks.append(asyncio.create_task(scheduler(engine)))
+
+    # Applies the stored Stripe webhook events
+    if os.getenv("ENABLE_STRIPE_EVENT_WORKER", "true") == "true":
+        tasks.append(asyncio.create_task(webhook_event_worker()))
+    yield
+    for task in tasks:
+        task.cancel()
 
-app = FastAPI(debug=True)
+
+app = FastAPI(debug=True, lifespan=lifespan)
 
 origins = [
     "http://localhost:5173",
@@ -37,9 +82,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*", "X-CSRF-Token"], 
-    expose_headers=["Set-Cookie", "X-CSRF-Token"],
+    expose_headers=["Set-Cookie", "X-CSRF-Token", "Server-Timing"],
 )
 
+# Request latency and SQL statements per route, see instrumentation.py
+if os.getenv("ENABLE_METRICS", "true") == "true":
+    instrument_engine(engine)
+    app.add_middleware(InstrumentationMiddleware)
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return PlainTextResponse(metrics_text(), media_type="text/plain; version=0.0.4")
+
 
 # Dependency
 def get_db():
@@ -64,6 +118,15 @@ if os.getenv("ENABLE_BOOKING", "true") == "true":
         dependencies=[Depends(get_api_key)],
     )
 
+# Door terminals, API key only
+if os.getenv("ENABLE_CHECKIN", "true") == "true":
+    app.include_router(
+        checkin_router,
+        prefix="/api/checkin",
+        tags=["Check-in"],
+        dependencies=[Depends(get_api_key)],
+    )
+
 if os.getenv("ENABLE_PAYMENTS", "true") == "true":
     app.include_router(
         payments_router,
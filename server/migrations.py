@@ -0,0 +1,76 @@
+from sqlalchemy import text
+from models import USERS_SEARCH_TEXT_SQL
+from bookings.partitions import (
+    migrate_bookings_to_partitioned,
+    ensure_booking_partitions,
+)
+from bookings.availability import rebuild_box_day_availability
+from bookings.booking_stats import backfill_user_booking_stats
+from bookings.box_status import migrate_box_status
+
+## Base.metadata.create_all only creates tables that are missing, so changes
+## to tables that already exist (new indexes, columns) are listed here.
+## Every statement has to be idempotent since they all run on each startup.
+## Entries are SQL strings or functions taking the connection.
+
+MIGRATIONS = [
+    # Keyset pagination of the admin user lists
+    "CREATE INDEX IF NOT EXISTS ix_users_center_user_id "
+    "ON users (fitness_center_fk, user_id)",
+    # Admin user search (admin/user_search.py)
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS search_text TEXT "
+    f"GENERATED ALWAYS AS ({USERS_SEARCH_TEXT_SQL}) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_users_phone_prefix "
+    "ON users (user_phone text_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_users_email_prefix "
+    "ON users (lower(user_email) text_pattern_ops)",
+    # pg_trgm ships with the postgres image, the index is skipped without it
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_users_search_text_trgm "
+    "ON users USING gin (search_text gin_trgm_ops)",
+    # Per user booking stats on the profile page
+    "CREATE INDEX IF NOT EXISTS ix_bookings_user_id_booking_date "
+    "ON bookings (user_id, booking_date)",
+    # Monthly partitions of bookings (bookings/partitions.py)
+    migrate_bookings_to_partitioned,
+    ensure_booking_partitions,
+    # Availability of a box on a day
+    "CREATE INDEX IF NOT EXISTS ix_bookings_box_id_booking_date "
+    "ON bookings (booking_box_id_fk, booking_date)",
+    # booking_availabilities was never read, box_day_availability replaces it
+    "DROP TABLE IF EXISTS booking_availabilities",
+    rebuild_box_day_availability,
+    # Existing bookings counted into user_booking_stats
+    backfill_user_booking_stats,
+    # Payment history of a user
+    "CREATE INDEX IF NOT EXISTS ix_payments_user_id_created_at "
+    "ON payments (user_id, created_at DESC, payment_id DESC)",
+    # Pending payments for stripe_payments/reconciliation.py
+    "CREATE INDEX IF NOT EXISTS ix_payments_pending "
+    "ON payments (payment_id) WHERE status = 'pending'",
+    # Box status columns instead of the "Lukket: 2t" text
+    migrate_box_status,
+    "CREATE INDEX IF NOT EXISTS ix_boxes_closed "
+    "ON boxes (fitness_center_fk, closed_until) WHERE box_state = 'closed'",
+    # Bookings by code (bookings/booking_codes.py)
+    "CREATE INDEX IF NOT EXISTS ix_bookings_booking_code_booking_date "
+    "ON bookings (booking_code, booking_date)",
+    # Check-in by code (checkin/checkin.py). Not a partial index on today's
+    # bookings, a predicate can't use now() or current_date
+    "CREATE INDEX IF NOT EXISTS ix_bookings_box_id_booking_date_code "
+    "ON bookings (booking_box_id_fk, booking_date, booking_code)",
+]
+
+
+def run_migrations(engine):
+    for statement in MIGRATIONS:
+        try:
+            with engine.begin() as conn:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(text(statement))
+        except Exception as e:
+            ## A failing migration should not keep the API from starting
+            name = getattr(statement, "__name__", statement)
+            print(f"Migration failed: {name}\n{e}", flush=True)
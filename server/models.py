@@ -9,9 +9,15 @@ from sqlalchemy import (
     CheckConstraint,
     BigInteger,
     JSON,
+    Index,
+    Computed,
+    Date,
+    Enum,
+    text,
 )
 from sqlalchemy.orm import relationship
 from database import Base
+from bookings.box_cache import BOX_OPEN, BOX_STATES
 from datetime import datetime, timezone
 
 ## this file contains the database models
@@ -20,55 +26,62 @@ from datetime import datetime, timezone
 ## it is used to create the database tables
 
 
-class BookingAvailabilities(Base):
-    __tablename__ = "booking_availabilities"  # Fixed typo in table name
-
-    booking_availability_id = Column(
-        Integer, primary_key=True, autoincrement=True, index=True, unique=True
-    )
-    box_id_fk = Column(Integer, ForeignKey("boxes.box_id"), nullable=False)
-    booking_date = Column(DateTime, nullable=False)
-    hour_of_day = Column(
-        Integer, CheckConstraint("hour_of_day BETWEEN 0 AND 23"), nullable=False
-    )
-    is_available = Column(Boolean, nullable=False)
-
-    box = relationship(
-        "Boxes", back_populates="booking_availabilities"
-    )  # Changed to singular 'box'
-
-
 class Boxes(Base):
     __tablename__ = "boxes"
+    __table_args__ = (
+        # The currently closed boxes of a center
+        Index(
+            "ix_boxes_closed",
+            "fitness_center_fk",
+            "closed_until",
+            postgresql_where=text("box_state = 'closed'"),
+        ),
+    )
 
     box_id = Column(
         Integer, primary_key=True, autoincrement=True, index=True, unique=True
     )
     box_number = Column(Integer, nullable=False, autoincrement=True, unique=True)
-    box_availability = Column(String(30), nullable=False)
+    # Closed until closed_until, the "Ledigt" / "Lukket: 2t" text of the API
+    # is derived from both (bookings/box_cache.py)
+    box_state = Column(
+        Enum(*BOX_STATES, name="box_state"), nullable=False, server_default=BOX_OPEN
+    )
+    closed_until = Column(DateTime, nullable=True)
     created_at = Column(DateTime, nullable=False)
     fitness_center_fk = Column(
         Integer, ForeignKey("fitness_centers.fitness_center_id"), nullable=False
     )
-    # Add this relationship
-    booking_availabilities = relationship("BookingAvailabilities", back_populates="box")
     bookings = relationship("Bookings", back_populates="boxes")
     fitness_center = relationship("FitnessCenters", back_populates="boxes")
 
 
 class Bookings(Base):
     __tablename__ = "bookings"
-
-    booking_id = Column(
-        BigInteger, primary_key=True, autoincrement=True, index=True, unique=True
+    __table_args__ = (
+        Index("ix_bookings_user_id_booking_date", "user_id", "booking_date"),
+        Index("ix_bookings_box_id_booking_date", "booking_box_id_fk", "booking_date"),
+        Index("ix_bookings_booking_code_booking_date", "booking_code", "booking_date"),
+        # Check-in by code among the boxes of a center (checkin/checkin.py)
+        Index(
+            "ix_bookings_box_id_booking_date_code",
+            "booking_box_id_fk",
+            "booking_date",
+            "booking_code",
+        ),
+        # Partitioned by month, see bookings/partitions.py. The partition key
+        # has to be part of the primary key
+        {"postgresql_partition_by": "RANGE (booking_date)"},
     )
+
+    booking_id = Column(BigInteger, primary_key=True, autoincrement=True, index=True)
     user_id = Column(
         Integer, ForeignKey("users.user_id", ondelete="CASCADE"), nullable=False
     )
     booking_box_id_fk = Column(
         Integer, ForeignKey("boxes.box_id", ondelete="CASCADE"), nullable=False
     )
-    booking_date = Column(DateTime, nullable=False)
+    booking_date = Column(DateTime, primary_key=True, nullable=False)
     booking_code = Column(String(4), nullable=False)
     booking_start_hour = Column(
         Integer,
@@ -91,8 +104,83 @@ class Bookings(Base):
     boxes = relationship("Boxes", back_populates="bookings")
 
 
+class BoxDayAvailability(Base):
+    __tablename__ = "box_day_availability"
+
+    ## Booked hours of a box on a day as a 24 bit mask (bit n is hour n).
+    ## Kept up to date by the booking write paths, see bookings/availability.py
+    box_id_fk = Column(
+        Integer, ForeignKey("boxes.box_id", ondelete="CASCADE"), primary_key=True
+    )
+    day = Column(Date, primary_key=True)
+    booked_mask = Column(Integer, nullable=False, default=0)
+
+
+class UserBookingStats(Base):
+    __tablename__ = "user_booking_stats"
+
+    ## One row per user and bucket: the lifetime total (bucket_type "total"),
+    ## every month ("month", first day) and every ISO week ("week", Monday).
+    ## Kept up to date by the booking write paths, see bookings/booking_stats.py
+    user_id = Column(
+        Integer, ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True
+    )
+    bucket_type = Column(String(5), primary_key=True)
+    bucket_start = Column(Date, primary_key=True)
+    booking_count = Column(Integer, nullable=False, default=0)
+
+
+class BookingCodeCounters(Base):
+    __tablename__ = "booking_code_counters"
+
+    ## Booking codes handed out per fitness center and day, the next code is
+    ## derived from the count, see bookings/booking_codes.py
+    fitness_center_fk = Column(
+        Integer,
+        ForeignKey("fitness_centers.fitness_center_id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    day = Column(Date, primary_key=True)
+    issued = Column(Integer, nullable=False, default=0)
+
+
+class CheckIns(Base):
+    __tablename__ = "check_ins"
+    __table_args__ = (
+        # One check-in per booking, scanning the code twice changes nothing
+        Index("ux_check_ins_booking", "booking_id", "booking_date", unique=True),
+        Index("ix_check_ins_center_checked_in_at", "fitness_center_fk", "checked_in_at"),
+    )
+
+    ## Bookings checked in at the door terminals, see checkin/checkin.py
+    check_in_id = Column(BigInteger, primary_key=True, autoincrement=True)
+    booking_id = Column(BigInteger, nullable=False)
+    booking_date = Column(DateTime, nullable=False)
+    box_id_fk = Column(
+        Integer, ForeignKey("boxes.box_id", ondelete="CASCADE"), nullable=False
+    )
+    fitness_center_fk = Column(
+        Integer,
+        ForeignKey("fitness_centers.fitness_center_id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    user_id = Column(
+        Integer, ForeignKey("users.user_id", ondelete="CASCADE"), nullable=False
+    )
+    checked_in_at = Column(DateTime, nullable=False)
+
+
+USERS_SEARCH_TEXT_SQL = (
+    "lower(user_first_name || ' ' || user_last_name || ' ' || user_email"
+    " || ' ' || regexp_replace(user_phone, '\\D', '', 'g'))"
+)
+
+
 class Users(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_center_user_id", "fitness_center_fk", "user_id"),
+    )
 
     user_id = Column(
         Integer, primary_key=True, autoincrement=True, index=True, unique=True
@@ -103,6 +191,8 @@ class Users(Base):
     is_member = Column(Boolean, nullable=False, default=True)
     password_hash = Column(String, nullable=False)
     user_phone = Column(String(50), nullable=False)
+    # Normalized text the admin user search runs against (see admin/user_search.py)
+    search_text = Column(Text, Computed(USERS_SEARCH_TEXT_SQL, persisted=True))
     is_verified = Column(Boolean, default=False)
     verification_token = Column(String, nullable=True)
     created_at = Column(DateTime, nullable=False)
@@ -199,6 +289,21 @@ class Exercise(Base):
 
 class StripePayment(Base):
     __tablename__ = "payments"
+    __table_args__ = (
+        # Payment history of a user, newest first (keyset paginated)
+        Index(
+            "ix_payments_user_id_created_at",
+            "user_id",
+            text("created_at DESC"),
+            text("payment_id DESC"),
+        ),
+        # Only the payments the reconciliation job has to look at
+        Index(
+            "ix_payments_pending",
+            "payment_id",
+            postgresql_where=text("status = 'pending'"),
+        ),
+    )
 
     payment_id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
@@ -217,3 +322,32 @@ class StripePayment(Base):
     )
 
     user = relationship("Users", back_populates="payments")
+
+
+class StripeWebhookEvents(Base):
+    __tablename__ = "stripe_webhook_events"
+    __table_args__ = (
+        # The worker only ever looks at events that still have to be applied
+        Index(
+            "ix_stripe_webhook_events_pending",
+            "next_attempt_at",
+            postgresql_where=text("status = 'pending'"),
+        ),
+        Index("ix_stripe_webhook_events_object_id", "object_id", "event_created"),
+    )
+
+    ## Raw Stripe webhook events, stored by the webhook endpoint and applied
+    ## by the worker in stripe_payments/webhook_events.py. The Stripe event id
+    ## is the primary key so redelivered events are only stored once
+    event_id = Column(String(255), primary_key=True)
+    event_type = Column(String(100), nullable=False)
+    event_created = Column(BigInteger, nullable=False)
+    # Id of the object the event is about, e.g. the payment intent
+    object_id = Column(String(255))
+    payload = Column(JSON, nullable=False)
+    status = Column(String(20), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    received_at = Column(DateTime(timezone=True), nullable=False)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False)
+    processed_at = Column(DateTime(timezone=True))
@@ -0,0 +1,57 @@
+import base64
+import json
+import time
+from threading import Lock
+from typing import Callable, Dict, Tuple
+
+from fastapi import HTTPException
+
+## Helpers shared by the paginated list endpoints
+## Cursors are opaque to the client: a url-safe base64 encoded JSON object
+## holding the sort key of the last row that was returned
+
+
+def encode_cursor(values: dict) -> str:
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+##### CACHED COUNTS #####
+## COUNT(*) over a large filtered set costs as much as reading it, so totals
+## are cached per key for a short while instead of recomputed on every page
+
+COUNT_CACHE_TTL_SECONDS = 30
+
+_count_cache: Dict[Tuple, Tuple[float, int]] = {}
+_count_cache_lock = Lock()
+
+
+def cached_count(key: Tuple, count_fn: Callable[[], int]) -> int:
+    now = time.monotonic()
+    with _count_cache_lock:
+        cached = _count_cache.get(key)
+    if cached and now - cached[0] < COUNT_CACHE_TTL_SECONDS:
+        return cached[1]
+
+    total = count_fn()
+    with _count_cache_lock:
+        _count_cache[key] = (now, total)
+    return total
+
+
+def invalidate_counts(prefix: str):
+    """Drop every cached count whose key starts with the given name"""
+    with _count_cache_lock:
+        for key in [key for key in _count_cache if key[0] == prefix]:
+            del _count_cache[key]
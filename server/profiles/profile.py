@@ -2,12 +2,12 @@ from fastapi import APIRouter, Depends, HTTPException, Path
 from sqlalchemy.orm import Session
 from fastapi.responses import JSONResponse
 from fastapi_csrf_protect import CsrfProtect
-from sqlalchemy import func
+from sqlalchemy import func, or_
 from passlib.context import CryptContext
 from database import get_db
 from authentication.jwt import get_current_user, create_access_token
 from datetime import datetime, timezone, timedelta
-from models import Users, Bookings
+from models import Users, UserBookingStats
 from profiles.types.profile_types import (
     ChangePassword,
     UpdateProfile,
@@ -22,6 +22,8 @@ from authentication.validate import (
     validate_phone_number,
 )
 import logging, json
+import events
+from reference_cache import fitness_center, role_name
 
 profile_router = APIRouter(
     dependencies=[Depends(get_current_user)]
@@ -119,6 +121,7 @@ async def update_profile(
     get_user_in_db.fitness_center_fk = user.fitness_center_id
     get_user_in_db.updated_at = current_time
 
+    events.emit(db, events.USER_CHANGED, events.user_payload(get_user_in_db))
     db.commit()
     # Refresh the instance to get the updated values
     db.refresh(get_user_in_db)
@@ -129,12 +132,14 @@ async def update_profile(
         "first_name": get_user_in_db.user_first_name,
         "last_name": get_user_in_db.user_last_name,
         "user_phone": get_user_in_db.user_phone,
-        "fitness_center": get_user_in_db.fitness_center.fitness_center_name,
-        "fitness_center_id": get_user_in_db.fitness_center.fitness_center_id,
+        "fitness_center": fitness_center(db, get_user_in_db.fitness_center_fk)[
+            "fitness_center_name"
+        ],
+        "fitness_center_id": get_user_in_db.fitness_center_fk,
         "is_member": get_user_in_db.is_member,
         "is_verified": get_user_in_db.is_verified,
         "user_role": get_user_in_db.user_role_fk,
-        "user_role_name": get_user_in_db.user_role.role_name,
+        "user_role_name": role_name(db, get_user_in_db.user_role_fk),
         "user_id": get_user_in_db.user_id,
     }
 
@@ -164,66 +169,67 @@ def get_user_stats(
     user: str = Path(..., description="The ID of the user"),
     db: Session = Depends(get_db),
 ):
-    today = datetime.now()
+    today = datetime.now().date()
     start_month = (today.replace(day=1) - timedelta(days=330)).replace(day=1)
 
+    # The counters are kept up to date by the booking write paths, so this
+    # is a single primary key range read (see bookings/booking_stats.py)
+    stats = (
+        db.query(UserBookingStats)
+        .filter(
+            UserBookingStats.user_id == user,
+            or_(
+                UserBookingStats.bucket_type == "total",
+                UserBookingStats.bucket_start >= start_month,
+            ),
+        )
+        .all()
+    )
+    return format_user_stats(stats, today)
+
+
+def format_user_stats(stats, today) -> dict:
+    """Monthly (last 12 months) and weekly (last 4 weeks) counts for the chart"""
+    start_month = (today.replace(day=1) - timedelta(days=330)).replace(day=1)
     monthly_bookings = {}
     weekly_bookings = {}
 
     # Generate months
     current = start_month
     while current <= today:
-        month_key = current.strftime("%Y-%m")
-        monthly_bookings[month_key] = 0
+        monthly_bookings[current] = 0
         current = (current.replace(day=1) + timedelta(days=32)).replace(day=1)
 
-    # Generate exactly 4 weeks
+    # Generate exactly 4 ISO weeks, keyed by their Monday
+    this_week = today - timedelta(days=today.weekday())
     for week_num in range(4):
-        week_date = today - timedelta(weeks=week_num)
-        week_key = week_date.strftime("%Y-%U")
-        weekly_bookings[week_key] = 0
+        weekly_bookings[this_week - timedelta(weeks=week_num)] = 0
 
-    # Get bookings
-    get_user_bookings = (
-        db.query(Bookings)
-        .filter(
-            Bookings.user_id == user,
-            func.date(Bookings.booking_date) >= start_month,
-        )
-        .order_by(Bookings.booking_date.desc())
-        .all()
-    )
-
-    # Update counts
-    for booking in get_user_bookings:
-        month_key = booking.booking_date.strftime("%Y-%m")
-        week_key = booking.booking_date.strftime("%Y-%U")
-        if month_key in monthly_bookings:
-            monthly_bookings[month_key] += 1
-        if week_key in weekly_bookings:
-            weekly_bookings[week_key] += 1
+    total_bookings = 0
+    for stat in stats:
+        if stat.bucket_type == "total":
+            total_bookings = stat.booking_count
+        elif stat.bucket_type == "month" and stat.bucket_start in monthly_bookings:
+            monthly_bookings[stat.bucket_start] = stat.booking_count
+        elif stat.bucket_type == "week" and stat.bucket_start in weekly_bookings:
+            weekly_bookings[stat.bucket_start] = stat.booking_count
 
     # Format monthly stats with 3-letter abbreviations
     monthly_stats = [
-        {
-            "pv": value,
-            "name": datetime.strptime(key, "%Y-%m").strftime("%b"),
-        }
-        for key, value in sorted(monthly_bookings.items(), reverse=True)
+        {"pv": value, "name": key.strftime("%b")}
+        for key, value in sorted(monthly_bookings.items())
     ]
 
     # Format weekly stats with simple week numbers 1-4
     weekly_stats = [
-        {"pv": value, "name": f"Uge {4 - idx}"}
-        for idx, (key, value) in enumerate(
-            sorted(weekly_bookings.items(), reverse=True)
-        )
+        {"pv": value, "name": f"Uge {idx + 1}"}
+        for idx, (key, value) in enumerate(sorted(weekly_bookings.items()))
     ]
 
     return {
-        "total_bookings": len(get_user_bookings) if get_user_bookings else 0,
-        "monthly_stats": monthly_stats[::-1],
-        "weekly_stats": weekly_stats[::-1],
+        "total_bookings": total_bookings,
+        "monthly_stats": monthly_stats,
+        "weekly_stats": weekly_stats,
     }
 
 
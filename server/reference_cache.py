@@ -0,0 +1,385 @@
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+import events
+from database import SQLALCHEMY_DATABASE_URL
+from instrumentation import label, register_metrics_collector
+from models import Boxes, FitnessCenters, UserRoles
+from bookings.box_cache import CenterBoxes, to_seconds
+
+## Reference data cache shared by all workers
+##
+## Fitness centers, user roles and the boxes of each center rarely change but
+## are read on almost every request. They are cached in two layers:
+##
+## 1. A shared store every uvicorn worker on the host reads: JSON files on
+##    tmpfs (/dev/shm), or Redis when REFERENCE_CACHE_REDIS_URL is set.
+## 2. A per process memo on top of it, so a hit costs no decoding.
+##
+## Invalidation is versioned. Every namespace ("centers", "roles", "boxes")
+## has a counter in the shared store and each cached value is stored with
+## the version it was loaded under. A commit that changed reference rows
+## calls invalidate() (see WRITE-THROUGH INVALIDATION below), which bumps the
+## counter (under flock, or INCR in Redis), and every worker reloads on its
+## next read. The version is read before loading, so a
+## load that races with a write is stored under the old version and never
+## served after the bump.
+##
+## Cached values are shared between requests and must not be modified.
+
+ENABLE_REFERENCE_CACHE = os.getenv("ENABLE_REFERENCE_CACHE", "true") == "true"
+REFERENCE_CACHE_REDIS_URL = os.getenv("REFERENCE_CACHE_REDIS_URL")
+
+CENTERS = "centers"
+ROLES = "roles"
+BOXES = "boxes"
+
+## Several apps (or test databases) can share a host, so the shared store is
+## keyed by the database the data comes from
+_DATABASE_KEY = hashlib.sha1(SQLALCHEMY_DATABASE_URL.encode()).hexdigest()[:12]
+
+
+def default_cache_dir() -> str:
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, f"fitboks-refcache-{_DATABASE_KEY}")
+
+
+##### SHARED STORES #####
+
+
+class SharedMemoryStore:
+    """JSON files on tmpfs, one per cached value plus one per version counter"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def write(self, name: str, data: str):
+        # Written next to the target and renamed, readers never see half a file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        with os.fdopen(fd, "w") as file:
+            file.write(data)
+        os.replace(tmp_path, self.path(name))
+
+    def version(self, namespace: str) -> int:
+        try:
+            with open(self.path(f"{namespace}.version")) as file:
+                return int(file.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def bump(self, namespace: str) -> int:
+        with open(self.path(".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            version = self.version(namespace) + 1
+            self.write(f"{namespace}.version", str(version))
+        return version
+
+    def get(self, namespace: str, key: str) -> Optional[Tuple[int, Any]]:
+        try:
+            with open(self.path(f"{namespace}-{key}.json")) as file:
+                entry = json.load(file)
+        except FileNotFoundError:
+            return None
+        return entry["version"], entry["value"]
+
+    def set(self, namespace: str, key: str, version: int, value):
+        self.write(
+            f"{namespace}-{key}.json", json.dumps({"version": version, "value": value})
+        )
+
+
+class RedisStore:
+    """Same layout in Redis, for when the workers don't share a host"""
+
+    def __init__(self, url: str):
+        import redis
+
+        self.redis = redis.Redis.from_url(url)
+        self.prefix = f"fitboks:refcache:{_DATABASE_KEY}:"
+
+    def version(self, namespace: str) -> int:
+        return int(self.redis.get(f"{self.prefix}{namespace}:version") or 0)
+
+    def bump(self, namespace: str) -> int:
+        return self.redis.incr(f"{self.prefix}{namespace}:version")
+
+    def get(self, namespace: str, key: str) -> Optional[Tuple[int, Any]]:
+        raw = self.redis.get(f"{self.prefix}{namespace}:{key}")
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        return entry["version"], entry["value"]
+
+    def set(self, namespace: str, key: str, version: int, value):
+        self.redis.set(
+            f"{self.prefix}{namespace}:{key}",
+            json.dumps({"version": version, "value": value}),
+        )
+
+
+##### CACHE #####
+
+
+class ReferenceCache:
+    def __init__(self, store=None):
+        self.store = store
+        self.memo: Dict[Tuple[str, str], Tuple[int, Any]] = {}
+        self.lock = Lock()
+        self.key_locks: Dict[Tuple[str, str], Lock] = {}
+        # Lookups per namespace by where they were answered
+        self.counts: Dict[str, Dict[str, int]] = {}
+
+    def key_lock(self, namespace: str, key: str) -> Lock:
+        with self.lock:
+            return self.key_locks.setdefault((namespace, key), Lock())
+
+    def count(self, namespace: str, result: str):
+        with self.lock:
+            counts = self.counts.setdefault(
+                namespace,
+                {"local": 0, "shared": 0, "miss": 0, "error": 0, "invalidations": 0},
+            )
+            counts[result] += 1
+
+    def get(
+        self,
+        namespace: str,
+        key,
+        load: Callable[[], Any],
+        build: Callable[[Any], Any] = None,
+    ):
+        """
+        Cached value of namespace/key, load() returns it as plain JSON data
+        and build() turns that into what callers use (done once per worker)
+        """
+        build = build or (lambda value: value)
+        key = str(key)
+        if self.store is None:
+            return build(load())
+
+        try:
+            version = self.store.version(namespace)
+            memo = self.memo.get((namespace, key))
+            if memo and memo[0] == version:
+                self.count(namespace, "local")
+                return memo[1]
+
+            # One load per worker when many requests miss at once, the others
+            # wait for it instead of all querying the database
+            with self.key_lock(namespace, key):
+                memo = self.memo.get((namespace, key))
+                if memo and memo[0] == version:
+                    self.count(namespace, "local")
+                    return memo[1]
+
+                entry = self.store.get(namespace, key)
+                if entry and entry[0] == version:
+                    self.count(namespace, "shared")
+                    value = build(entry[1])
+                else:
+                    self.count(namespace, "miss")
+                    loaded = load()
+                    self.store.set(namespace, key, version, loaded)
+                    value = build(loaded)
+                self.memo[(namespace, key)] = (version, value)
+                return value
+        except Exception as e:
+            # The database is the source of truth, a broken store only costs
+            # the query
+            print(f"Reference cache {namespace} failed: {e}", flush=True)
+            self.count(namespace, "error")
+            return build(load())
+
+    def invalidate(self, *namespaces: str):
+        """Call after the commit that changed the data"""
+        for namespace in namespaces:
+            self.count(namespace, "invalidations")
+            if self.store is None:
+                continue
+            try:
+                self.store.bump(namespace)
+            except Exception as e:
+                print(f"Could not invalidate {namespace}: {e}", flush=True)
+
+    def stats(self) -> Dict[str, dict]:
+        with self.lock:
+            stats = {}
+            for namespace, counts in self.counts.items():
+                lookups = counts["local"] + counts["shared"] + counts["miss"]
+                hits = counts["local"] + counts["shared"]
+                stats[namespace] = {
+                    **counts,
+                    "hit_ratio": hits / lookups if lookups else 0.0,
+                }
+            return stats
+
+    def metrics(self) -> List[str]:
+        stats = self.stats()
+        lines = [
+            "# HELP reference_cache_lookups_total Reference data lookups by where they were answered",
+            "# TYPE reference_cache_lookups_total counter",
+        ]
+        for namespace, counts in sorted(stats.items()):
+            for result in ("local", "shared", "miss", "error"):
+                lines.append(
+                    f'reference_cache_lookups_total{{namespace="{label(namespace)}",'
+                    f'result="{result}"}} {counts[result]}'
+                )
+        lines += [
+            "# HELP reference_cache_hit_ratio Share of lookups answered from the cache",
+            "# TYPE reference_cache_hit_ratio gauge",
+        ]
+        for namespace, counts in sorted(stats.items()):
+            lines.append(
+                f'reference_cache_hit_ratio{{namespace="{label(namespace)}"}} '
+                f"{counts['hit_ratio']}"
+            )
+        lines += [
+            "# HELP reference_cache_invalidations_total Version bumps made by this worker",
+            "# TYPE reference_cache_invalidations_total counter",
+        ]
+        for namespace, counts in sorted(stats.items()):
+            lines.append(
+                f'reference_cache_invalidations_total{{namespace="{label(namespace)}"}} '
+                f"{counts['invalidations']}"
+            )
+        return lines
+
+
+def build_store():
+    if not ENABLE_REFERENCE_CACHE:
+        return None
+    if REFERENCE_CACHE_REDIS_URL:
+        try:
+            return RedisStore(REFERENCE_CACHE_REDIS_URL)
+        except ImportError:
+            print("redis is not installed, using the shared memory cache", flush=True)
+    return SharedMemoryStore(os.getenv("REFERENCE_CACHE_DIR") or default_cache_dir())
+
+
+reference_cache = ReferenceCache(build_store())
+register_metrics_collector(reference_cache.metrics)
+
+
+##### REFERENCE DATA #####
+
+
+def fitness_centers(db: Session) -> Dict[int, dict]:
+    def load():
+        return [
+            {
+                "fitness_center_id": center.fitness_center_id,
+                "fitness_center_name": center.fitness_center_name,
+                "fitness_center_address": center.fitness_center_address,
+            }
+            for center in db.query(FitnessCenters).all()
+        ]
+
+    return reference_cache.get(
+        CENTERS,
+        "all",
+        load,
+        lambda rows: {row["fitness_center_id"]: row for row in rows},
+    )
+
+
+def fitness_center(db: Session, fitness_center_id: int) -> Optional[dict]:
+    centers = fitness_centers(db)
+    if fitness_center_id not in centers:
+        # Added since the cache was filled, e.g. straight in the database
+        reference_cache.invalidate(CENTERS)
+        centers = fitness_centers(db)
+    return centers.get(fitness_center_id)
+
+
+def role_names(db: Session) -> Dict[int, str]:
+    def load():
+        return [[role.user_role_id, role.role_name] for role in db.query(UserRoles)]
+
+    return reference_cache.get(ROLES, "all", load, dict)
+
+
+def role_name(db: Session, user_role_id: int) -> Optional[str]:
+    roles = role_names(db)
+    if user_role_id not in roles:
+        reference_cache.invalidate(ROLES)
+        roles = role_names(db)
+    return roles.get(user_role_id)
+
+
+def center_boxes(db: Session, fitness_center_id: int) -> CenterBoxes:
+    """Boxes of a center, held by each worker in compact arrays"""
+
+    def load():
+        boxes = db.query(
+            Boxes.box_id,
+            Boxes.box_number,
+            Boxes.box_state,
+            Boxes.closed_until,
+            Boxes.created_at,
+        ).filter(Boxes.fitness_center_fk == fitness_center_id)
+        return [
+            [box_id, box_number, box_state, to_seconds(closed_until), to_seconds(created_at)]
+            for box_id, box_number, box_state, closed_until, created_at in boxes
+        ]
+
+    return reference_cache.get(
+        BOXES,
+        fitness_center_id,
+        load,
+        lambda rows: CenterBoxes(fitness_center_id, rows),
+    )
+
+
+##### WRITE-THROUGH INVALIDATION #####
+## Any insert, update or delete of a reference row through the ORM marks its
+## namespace on the session, and the namespaces are invalidated once the
+## session commits. Statements that bypass the ORM call
+## mark_reference_changed() themselves, or invalidate explicitly (TRUNCATE in
+## the seed endpoints).
+
+
+def mark_reference_changed(session: Session, namespace: str):
+    session.info.setdefault("reference_changed", set()).add(namespace)
+
+
+def mark_changed(namespace: str):
+    def listener(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            mark_reference_changed(session, namespace)
+            if namespace == BOXES:
+                events.emit(session, events.BOXES_CHANGED, {"box_id": None, "day": None})
+
+    return listener
+
+
+for model, namespace in ((Boxes, BOXES), (FitnessCenters, CENTERS), (UserRoles, ROLES)):
+    for event_name in ("after_insert", "after_update", "after_delete"):
+        event.listen(model, event_name, mark_changed(namespace))
+
+
+# Runs before the events of the commit are published (events.py), so their
+# subscribers already read the new versions
+@event.listens_for(Session, "after_commit", insert=True)
+def invalidate_changed(session):
+    changed = session.info.pop("reference_changed", None)
+    if changed:
+        reference_cache.invalidate(*sorted(changed))
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_changed(session):
+    session.info.pop("reference_changed", None)
@@ -0,0 +1,74 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+from database import SessionLocal
+from bookings.booking_stats import scheduled_reconcile
+from bookings.box_status import rollover_box_status
+from bookings.partitions import maintain_booking_partitions
+
+## Background jobs of a worker, run just after every full hour
+##
+## - box status rollover (bookings/box_status.py), every hour and once at
+##   startup
+## - booking partition maintenance (bookings/partitions.py), once a day
+## - user booking stats reconcile (bookings/booking_stats.py), once a day
+##
+## Every worker runs the scheduler, the jobs are safe to run concurrently.
+
+ENABLE_BOX_STATUS_ROLLOVER = os.getenv("ENABLE_BOX_STATUS_ROLLOVER", "true") == "true"
+ENABLE_BOOKING_PARTITIONS = os.getenv("ENABLE_BOOKING_PARTITIONS", "true") == "true"
+ENABLE_BOOKING_STATS_RECONCILE = (
+    os.getenv("ENABLE_BOOKING_STATS_RECONCILE", "true") == "true"
+)
+## Seconds past the hour, so the jobs see the new hour
+SCHEDULER_DELAY_SECONDS = 1
+
+
+def seconds_to_next_hour(now: datetime = None) -> float:
+    now = now or datetime.now()
+    next_hour = now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    return (next_hour - now).total_seconds()
+
+
+def run_box_status_rollover(now: datetime):
+    db = SessionLocal()
+    try:
+        changed = rollover_box_status(db, now)
+    finally:
+        db.close()
+    if changed:
+        print(f"Box status rollover changed {changed} boxes", flush=True)
+
+
+def run_booking_stats_reconcile():
+    db = SessionLocal()
+    try:
+        result = scheduled_reconcile(db)
+    finally:
+        db.close()
+    if result and (result["repaired"] or result["removed"]):
+        print(f"User booking stats reconciled: {result}", flush=True)
+
+
+async def run_job(name: str, job, *args):
+    try:
+        await asyncio.to_thread(job, *args)
+    except Exception as e:
+        print(f"Scheduled {name} failed: {e}", flush=True)
+
+
+async def scheduler(engine):
+    if ENABLE_BOX_STATUS_ROLLOVER:
+        await run_job("box status rollover", run_box_status_rollover, datetime.now())
+    last_day = datetime.now().date()
+    while True:
+        await asyncio.sleep(seconds_to_next_hour() + SCHEDULER_DELAY_SECONDS)
+        now = datetime.now()
+        if ENABLE_BOX_STATUS_ROLLOVER:
+            await run_job("box status rollover", run_box_status_rollover, now)
+        if ENABLE_BOOKING_PARTITIONS and now.date() != last_day:
+            await run_job("booking partition maintenance", maintain_booking_partitions, engine)
+        if ENABLE_BOOKING_STATS_RECONCILE and now.date() != last_day:
+            await run_job("booking stats reconcile", run_booking_stats_reconcile)
+        last_day = now.date()
@@ -9,7 +9,6 @@ from models import (
     Users,
     Boxes,
     Bookings,
-    BookingAvailabilities,
     Workout,
     Week,
     Exercise,
@@ -21,6 +20,10 @@ import random
 import string
 from typing import List
 from authentication.authentications import get_current_user
+from admin.member_index import member_index
+from reference_cache import reference_cache, CENTERS, ROLES, BOXES
+from bookings.booking_stats import reconcile_user_booking_stats
+from bookings.availability import rebuild_box_day_availability
 from pydantic import BaseModel
 
 fake = Faker()
@@ -47,7 +50,6 @@ def create_boxes(
         box = Boxes(
             box_number=i + 1,
             created_at=datetime.now(),
-            box_availability="Ledigt",
             fitness_center_fk=fitness_centers[
                 i % len(fitness_centers)
             ].fitness_center_id,
@@ -136,20 +138,6 @@ def create_bookings(db: Session, users, boxes, total_bookings: int = 9600):
     db.commit()
 
 
-def create_booking_availabilities(db: Session, boxes):
-    for box in boxes:
-        for hour in range(24):  # 0 to 23 hours
-            avail = BookingAvailabilities(
-                box_id_fk=box.box_id,
-                booking_date=fake.date_time_between(
-                    start_date=start_date, end_date=end_date
-                ),
-                hour_of_day=hour,
-                is_available=True,
-            )
-            db.add(avail)
-
-
 @seed_router.post("/seed-database")
 async def seed_database(db: Session = Depends(get_db)):
     try:
@@ -163,9 +151,13 @@ async def seed_database(db: Session = Depends(get_db)):
         users = create_users(db, fitness_centers, roles)
 
         create_bookings(db, users, boxes)
-        create_booking_availabilities(db, boxes)
+        rebuild_box_day_availability(db, since=start_date)
 
         db.commit()
+        reconcile_user_booking_stats(db)
+        reference_cache.invalidate(CENTERS, ROLES, BOXES)
+        if member_index.ready:
+            member_index.build(db)
         return {"message": "Database seeded successfully"}
     except Exception as e:
         db.rollback()
@@ -189,7 +181,8 @@ async def delete_tables(
             "exercises",
             "weeks",
             "workouts",
-            "booking_availabilities",
+            "box_day_availability",
+            "user_booking_stats",
             "bookings",
             "payments",
             "boxes",
@@ -203,6 +196,9 @@ async def delete_tables(
 
         db.commit()
         Base.metadata.create_all(bind=engine)
+        reference_cache.invalidate(CENTERS, ROLES, BOXES)
+        if member_index.ready:
+            member_index.build(db)
         return {"message": "Tables Been Recreated successfully"}
     except Exception as e:
         db.rollback()
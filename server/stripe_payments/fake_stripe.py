@@ -0,0 +1,116 @@
+import asyncio
+import secrets
+import time
+from typing import Dict
+
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse
+
+## A small stand-in for the parts of the Stripe API this backend uses
+##
+## Used by the tests (in-process through httpx.ASGITransport) and by the
+## benchmarks (as a real server):
+##
+##     uvicorn stripe_payments.fake_stripe:app --port 12111
+##     STRIPE_API_BASE=http://127.0.0.1:12111 uvicorn main:app
+##
+## POST /_fake/config sets an artificial latency and makes the next N
+## requests fail with a 500, to exercise timeouts and retries.
+
+app = FastAPI()
+
+payment_intents: Dict[str, dict] = {}
+idempotent_responses: Dict[str, dict] = {}
+config = {"latency_ms": 0, "fail_next": 0}
+stats = {"requests": 0, "failures": 0}
+
+
+def reset():
+    payment_intents.clear()
+    idempotent_responses.clear()
+    config.update(latency_ms=0, fail_next=0)
+    stats.update(requests=0, failures=0)
+
+
+async def simulate_network():
+    stats["requests"] += 1
+    if config["latency_ms"]:
+        await asyncio.sleep(config["latency_ms"] / 1000)
+    if config["fail_next"] > 0:
+        config["fail_next"] -= 1
+        stats["failures"] += 1
+        return JSONResponse(
+            {"error": {"type": "api_error", "message": "Fake Stripe failure"}},
+            status_code=500,
+        )
+    return None
+
+
+def stripe_error(status_code: int, message: str):
+    return JSONResponse(
+        {"error": {"type": "invalid_request_error", "message": message}},
+        status_code=status_code,
+    )
+
+
+@app.post("/_fake/config")
+async def update_config(request: Request):
+    config.update(await request.json())
+    return {"config": config, "stats": stats}
+
+
+@app.post("/_fake/payment_intents/{intent_id}/status")
+async def set_intent_status(intent_id: str, request: Request):
+    """Lets tests move an intent along, like a customer paying would"""
+    if intent_id not in payment_intents:
+        raise HTTPException(status_code=404, detail="No such payment_intent")
+    payment_intents[intent_id]["status"] = (await request.json())["status"]
+    return payment_intents[intent_id]
+
+
+@app.post("/v1/payment_intents")
+async def create_payment_intent(
+    request: Request, idempotency_key: str = Header(None)
+):
+    failure = await simulate_network()
+    if failure:
+        return failure
+
+    if idempotency_key and idempotency_key in idempotent_responses:
+        return idempotent_responses[idempotency_key]
+
+    form = await request.form()
+    if "amount" not in form or "currency" not in form:
+        return stripe_error(400, "Missing required param: amount or currency")
+
+    intent_id = f"pi_{secrets.token_hex(12)}"
+    intent = {
+        "id": intent_id,
+        "object": "payment_intent",
+        "amount": int(form["amount"]),
+        "currency": form["currency"],
+        "status": "requires_payment_method",
+        "client_secret": f"{intent_id}_secret_{secrets.token_hex(8)}",
+        "created": int(time.time()),
+        "metadata": {
+            key[len("metadata[") : -1]: value
+            for key, value in form.items()
+            if key.startswith("metadata[")
+        },
+        "payment_method_types": form.getlist("payment_method_types[0]") or ["card"],
+    }
+    payment_intents[intent_id] = intent
+    if idempotency_key:
+        idempotent_responses[idempotency_key] = intent
+    return intent
+
+
+@app.get("/v1/payment_intents/{intent_id}")
+async def retrieve_payment_intent(intent_id: str):
+    failure = await simulate_network()
+    if failure:
+        return failure
+
+    if intent_id not in payment_intents:
+        return stripe_error(404, f"No such payment_intent: '{intent_id}'")
+    return payment_intents[intent_id]
@@ -1,12 +1,19 @@
-from fastapi import APIRouter, HTTPException, Depends, Request, Header, Path
+from fastapi import APIRouter, HTTPException, Depends, Request, Header, Path, Query
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
+from sqlalchemy import text, tuple_
 from sqlalchemy.orm import Session
 from database import get_db, get_api_key
 from authentication.jwt import get_current_user
 from models import StripePayment
+from pagination import encode_cursor, decode_cursor
+from stripe_payments.stripe_client import get_stripe_client
+from stripe_payments.webhook_events import store_event, events_waiting
 from datetime import datetime
 import stripe
+import json
 import os
+import uuid
 from typing import Optional
 
 
@@ -22,41 +29,67 @@ class PaymentIntentRequest(BaseModel):
     payment_method: str = "card"
 
 
+def save_payment(db: Session, request: PaymentIntentRequest, intent_id: str):
+    # A retried request with the same idempotency key gets the same intent
+    # back from Stripe, the row stored the first time is reused then
+    db_payment = (
+        db.query(StripePayment)
+        .filter(StripePayment.payment_intent_id == intent_id)
+        .first()
+    )
+    if db_payment:
+        return db_payment
+
+    db_payment = StripePayment(
+        user_id=request.user_id,
+        payment_intent_id=intent_id,
+        amount=request.amount,
+        currency=request.currency,
+        status="pending",
+        payment_method=request.payment_method,
+        created_at=datetime.utcnow(),
+    )
+
+    db.add(db_payment)
+    db.commit()
+    db.refresh(db_payment)
+    return db_payment
+
+
 @payments_router.post("/create-payment", dependencies=[Depends(get_api_key), Depends(get_current_user)])
 async def create_payment_intent(
-    request: PaymentIntentRequest, db: Session = Depends(get_db)
+    request: PaymentIntentRequest,
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None),
 ):
     try:
-        # Create Stripe PaymentIntent
-        intent = stripe.PaymentIntent.create(
-            amount=request.amount,
-            currency=request.currency.lower(),
-            payment_method_types=["card"],
-            metadata={
-                "user_id": str(request.user_id),
+        # Create Stripe PaymentIntent, without blocking the event loop
+        intent = await get_stripe_client().v1.payment_intents.create_async(
+            params={
+                "amount": request.amount,
+                "currency": request.currency.lower(),
+                "payment_method_types": ["card"],
+                "metadata": {
+                    "user_id": str(request.user_id),
+                },
             },
+            options={"idempotency_key": idempotency_key or str(uuid.uuid4())},
         )
 
         # Store payment intent in database
-        db_payment = StripePayment(
-            user_id=request.user_id,
-            payment_intent_id=intent.id,
-            amount=request.amount,
-            currency=request.currency,
-            status="pending",
-            payment_method=request.payment_method,
-            created_at=datetime.utcnow(),
-        )
-
-        db.add(db_payment)
-        db.commit()
-        db.refresh(db_payment)
+        db_payment = await run_in_threadpool(save_payment, db, request, intent.id)
 
         return {
             "client_secret": intent.client_secret,
             "payment_id": db_payment.payment_id,
         }
 
+    except stripe.APIConnectionError as e:
+        # Timed out or unreachable, also after the retries
+        raise HTTPException(status_code=503, detail=str(e))
+    except stripe.APIError as e:
+        # Stripe kept failing on its side
+        raise HTTPException(status_code=502, detail=str(e))
     except stripe.error.StripeError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -70,87 +103,122 @@ async def stripe_webhook(
     if not stripe_signature:
         raise HTTPException(status_code=400, detail="Stripe signature is required")
 
-    try:
-        # Get the raw body
-        payload = await request.body()
-
-        # Verify webhook signature
-        try:
-            event = stripe.Webhook.construct_event(
-                payload, stripe_signature, os.getenv("STRIPE_SIGNING_SECRET")
-            )
-        except stripe.error.SignatureVerificationError as e:
-            raise HTTPException(status_code=400, detail=str(e))
-
-        # Handle the event
-        if event.type == "payment_intent.succeeded":
-            payment_intent = event.data.object
-
-            # Update payment status in database
-            payment = (
-                db.query(StripePayment)
-                .filter(StripePayment.payment_intent_id == payment_intent.id)
-                .first()
-            )
-
-            if payment:
-                payment.status = "succeeded"
-                payment.updated_at = datetime.utcnow()
-                db.commit()
-
-                return {
-                    "status": "success",
-                    "message": "Payment processed successfully",
-                }
-            else:
-                raise HTTPException(
-                    status_code=404,
-                    detail=f"Payment with intent ID {payment_intent.id} not found",
-                )
+    # Get the raw body
+    payload = await request.body()
 
-        # Handle other event types if needed
-        return {"status": "success", "message": f"Unhandled event type {event.type}"}
-
-    except Exception as e:
+    # Verify webhook signature
+    try:
+        stripe.Webhook.construct_event(
+            payload, stripe_signature, os.getenv("STRIPE_SIGNING_SECRET")
+        )
+    except (ValueError, stripe.error.SignatureVerificationError) as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+    # The event is only stored here and applied by the worker in
+    # webhook_events.py, Stripe gets its 200 without waiting on that
+    event = json.loads(payload)
+    is_new = await run_in_threadpool(store_event, db, event)
+    if is_new:
+        events_waiting.set()
+
+    return {
+        "status": "success",
+        "message": "Event received" if is_new else "Event already received",
+    }
+
+
+def payment_summary(db: Session, user_id: int):
+    by_status = db.execute(
+        text(
+            """
+            SELECT status, currency, count(*) AS count, sum(amount) AS amount
+            FROM payments WHERE user_id = :user_id
+            GROUP BY status, currency ORDER BY status, currency
+            """
+        ),
+        {"user_id": user_id},
+    ).mappings()
+    by_month = db.execute(
+        text(
+            """
+            SELECT to_char(date_trunc('month', created_at), 'YYYY-MM') AS month,
+                   status, currency, count(*) AS count, sum(amount) AS amount
+            FROM payments WHERE user_id = :user_id
+            GROUP BY 1, status, currency ORDER BY 1 DESC, status, currency
+            """
+        ),
+        {"user_id": user_id},
+    ).mappings()
+    return {
+        "by_status": [dict(row) for row in by_status],
+        "by_month": [dict(row) for row in by_month],
+    }
+
 
 @payments_router.get("/{user_id}", dependencies=[Depends(get_api_key), Depends(get_current_user)])
-async def get_user_payments(
-    user_id: str = Path(..., description="The ID of the user"), db: Session = Depends(get_db)
+def get_user_payments(
+    user_id: int = Path(..., description="The ID of the user"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    page_size: int = Query(50, gt=0, le=200, description="Number of payments per page"),
+    summary: bool = Query(False, description="Totals by status and month instead of the payments"),
+    db: Session = Depends(get_db),
 ):
-    try:
-        # Get user_id from current user
-        user_id 
+    if summary:
+        return {"status": "success", "summary": payment_summary(db, user_id)}
+
+    # Newest first, read from ix_payments_user_id_created_at. The next page
+    # starts after the (created_at, payment_id) of the last returned row
+    query = db.query(StripePayment).filter(StripePayment.user_id == user_id)
+    if cursor:
+        values = decode_cursor(cursor)
+        try:
+            last_created_at = datetime.fromisoformat(values["created_at"])
+            last_payment_id = int(values["payment_id"])
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.filter(
+            tuple_(StripePayment.created_at, StripePayment.payment_id)
+            < tuple_(last_created_at, last_payment_id)
+        )
 
-        # Query payments for user
+    try:
         payments = (
-            db.query(StripePayment)
-            .filter(StripePayment.user_id == user_id)
-            .order_by(StripePayment.created_at.desc())
+            query.order_by(
+                StripePayment.created_at.desc(), StripePayment.payment_id.desc()
+            )
+            .limit(page_size + 1)
             .all()
         )
-
-        # Format payment data
-        payment_list = []
-        for payment in payments:
-            payment_list.append(
-                {
-                    "payment_id": payment.payment_id,
-                    "amount": payment.amount,
-                    "currency": payment.currency,
-                    "status": payment.status,
-                    "payment_intent_id": payment.payment_intent_id,
-                    "created_at": payment.created_at.isoformat(),
-                    "updated_at": (
-                        payment.updated_at.isoformat() if payment.updated_at else None
-                    ),
-                }
-            )
-
-        return {"status": "success", "payments": payment_list}
-
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error fetching payments: {str(e)}"
         )
+
+    next_cursor = None
+    if len(payments) > page_size:
+        payments = payments[:page_size]
+        next_cursor = encode_cursor(
+            {
+                "created_at": payments[-1].created_at.isoformat(),
+                "payment_id": payments[-1].payment_id,
+            }
+        )
+
+    # Format payment data
+    payment_list = []
+    for payment in payments:
+        payment_list.append(
+            {
+                "payment_id": payment.payment_id,
+                "amount": payment.amount,
+                "currency": payment.currency,
+                "status": payment.status,
+                "payment_intent_id": payment.payment_intent_id,
+                "created_at": payment.created_at.isoformat(),
+                "updated_at": (
+                    payment.updated_at.isoformat() if payment.updated_at else None
+                ),
+            }
+        )
+
+    return {"status": "success", "payments": payment_list, "next_cursor": next_cursor}
@@ -0,0 +1,166 @@
+import argparse
+import asyncio
+import os
+import time
+from typing import Dict, List
+
+import stripe
+from sqlalchemy import text
+
+from database import SessionLocal
+from stripe_payments.stripe_client import get_stripe_client
+
+## Reconciliation of payments stuck in "pending"
+##
+## A payment stays pending when its webhook never arrives. This job pages
+## through the pending payments (ix_payments_pending, a partial index that
+## only holds pending rows), asks Stripe for the status of each intent with
+## a bounded number of concurrent requests, and writes the changed rows back
+## with one UPDATE per page.
+##
+## Runs from the admin endpoint POST /api/admin/stats/reconcile-payments or
+## from cron:
+##
+##     python -m stripe_payments.reconciliation
+
+RECONCILE_BATCH_SIZE = int(os.getenv("PAYMENT_RECONCILE_BATCH_SIZE", "100"))
+RECONCILE_CONCURRENCY = int(os.getenv("PAYMENT_RECONCILE_CONCURRENCY", "10"))
+## Younger payments are most likely still being paid, they are left alone
+RECONCILE_MIN_AGE_SECONDS = int(
+    os.getenv("PAYMENT_RECONCILE_MIN_AGE_SECONDS", "900")
+)
+
+## Local status for the final Stripe intent statuses, anything else is
+## still in progress on Stripe's side and stays pending
+LOCAL_STATUS = {"succeeded": "succeeded", "canceled": "canceled"}
+
+## Metrics of the last finished run, per worker
+last_run: Dict[str, float] = {}
+
+
+async def fetch_intent_statuses(
+    client: stripe.StripeClient, intent_ids: List[str], concurrency: int
+) -> Dict[str, str]:
+    """Stripe status per intent id, intents that failed to load are left out"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(intent_id):
+        async with semaphore:
+            try:
+                intent = await client.v1.payment_intents.retrieve_async(intent_id)
+                return intent_id, intent.status
+            except stripe.StripeError as e:
+                print(f"Could not reconcile {intent_id}: {e}", flush=True)
+                return intent_id, None
+
+    results = await asyncio.gather(*(fetch(intent_id) for intent_id in intent_ids))
+    return {intent_id: status for intent_id, status in results if status}
+
+
+def pending_page(db, after_payment_id: int, limit: int):
+    rows = db.execute(
+        text(
+            """
+            SELECT payment_id, payment_intent_id, created_at
+            FROM payments
+            WHERE status = 'pending' AND payment_id > :after
+              AND created_at < now() - make_interval(secs => :min_age)
+            ORDER BY payment_id
+            LIMIT :limit
+            """
+        ),
+        {
+            "after": after_payment_id,
+            "limit": limit,
+            "min_age": RECONCILE_MIN_AGE_SECONDS,
+        },
+    ).all()
+    # No transaction is kept open while Stripe is being asked
+    db.commit()
+    return rows
+
+
+def update_statuses(db, updates: Dict[int, str]) -> int:
+    if not updates:
+        return 0
+    # The status check keeps a webhook that got there first from being undone
+    updated = db.execute(
+        text(
+            """
+            UPDATE payments p
+            SET status = u.status, updated_at = now()
+            FROM unnest(CAST(:ids AS integer[]), CAST(:statuses AS text[]))
+                 AS u(payment_id, status)
+            WHERE p.payment_id = u.payment_id AND p.status = 'pending'
+            """
+        ),
+        {"ids": list(updates), "statuses": list(updates.values())},
+    ).rowcount
+    db.commit()
+    return updated
+
+
+async def reconcile_pending_payments(
+    client: stripe.StripeClient = None,
+    batch_size: int = RECONCILE_BATCH_SIZE,
+    concurrency: int = RECONCILE_CONCURRENCY,
+) -> dict:
+    client = client or get_stripe_client()
+    started = time.monotonic()
+    metrics = {"checked": 0, "updated": 0, "errors": 0, "oldest_pending_seconds": 0.0}
+
+    db = SessionLocal()
+    try:
+        after_payment_id = 0
+        while True:
+            rows = await asyncio.to_thread(
+                pending_page, db, after_payment_id, batch_size
+            )
+            if not rows:
+                break
+            after_payment_id = rows[-1].payment_id
+
+            # How far behind the webhooks are: the oldest payment still pending
+            oldest = min(row.created_at for row in rows if row.created_at)
+            metrics["oldest_pending_seconds"] = max(
+                metrics["oldest_pending_seconds"],
+                time.time() - oldest.timestamp(),
+            )
+
+            intents = [row.payment_intent_id for row in rows if row.payment_intent_id]
+            statuses = await fetch_intent_statuses(client, intents, concurrency)
+            updates = {
+                row.payment_id: LOCAL_STATUS[statuses[row.payment_intent_id]]
+                for row in rows
+                if statuses.get(row.payment_intent_id) in LOCAL_STATUS
+            }
+            metrics["checked"] += len(rows)
+            metrics["errors"] += len(intents) - len(statuses)
+            metrics["updated"] += await asyncio.to_thread(update_statuses, db, updates)
+    finally:
+        db.close()
+
+    metrics["elapsed_seconds"] = time.monotonic() - started
+    metrics["payments_per_second"] = metrics["checked"] / max(
+        metrics["elapsed_seconds"], 1e-9
+    )
+    last_run.clear()
+    last_run.update(metrics, finished_at=time.time())
+    return metrics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Reconcile pending payments with Stripe"
+    )
+    parser.add_argument("--batch-size", type=int, default=RECONCILE_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=RECONCILE_CONCURRENCY)
+    args = parser.parse_args()
+    print(
+        asyncio.run(
+            reconcile_pending_payments(
+                batch_size=args.batch_size, concurrency=args.concurrency
+            )
+        ),
+        flush=True,
+    )
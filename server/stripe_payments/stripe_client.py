@@ -0,0 +1,90 @@
+import asyncio
+import os
+import ssl
+from typing import Optional
+
+import httpx
+import stripe
+
+## Shared Stripe client for the payment endpoints
+##
+## All calls go through one StripeClient backed by httpx, so the API is
+## called with the *_async methods without blocking the event loop and the
+## connections to Stripe are pooled per worker. Every request has a timeout,
+## network errors, 409s and 5xx responses are retried by the stripe library
+## with exponential backoff and jitter, and POSTs carry an idempotency key so
+## a retry never creates a second object.
+##
+## STRIPE_API_BASE points the client somewhere else than api.stripe.com,
+## e.g. the fake server in stripe_payments/fake_stripe.py.
+
+STRIPE_TIMEOUT_SECONDS = float(os.getenv("STRIPE_TIMEOUT_SECONDS", "10"))
+STRIPE_CONNECT_TIMEOUT_SECONDS = float(
+    os.getenv("STRIPE_CONNECT_TIMEOUT_SECONDS", "3")
+)
+STRIPE_MAX_RETRIES = int(os.getenv("STRIPE_MAX_RETRIES", "2"))
+STRIPE_MAX_CONNECTIONS = int(os.getenv("STRIPE_MAX_CONNECTIONS", "20"))
+
+_client: Optional[stripe.StripeClient] = None
+
+
+class PooledHTTPXClient(stripe.HTTPXClient):
+    """stripe.HTTPXClient with the connection limits (and transport) set"""
+
+    def __init__(self, timeout, **httpx_kwargs):
+        super().__init__(timeout=timeout)
+        # stripe does not pass options through to httpx, so the async client
+        # it created is replaced with one that is configured and then closed
+        httpx_kwargs.setdefault(
+            "verify", ssl.create_default_context(cafile=stripe.ca_bundle_path)
+        )
+        unused, self._client_async = self._client_async, httpx.AsyncClient(**httpx_kwargs)
+        self._closing = close_unused_client(unused)
+
+
+def close_unused_client(client: httpx.AsyncClient) -> Optional[asyncio.Task]:
+    """Closes on the running loop when there is one, the task is returned to keep it alive"""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        asyncio.run(client.aclose())
+        return None
+    return loop.create_task(client.aclose())
+
+
+def build_stripe_client(
+    api_key: str = None, api_base: str = None, **httpx_kwargs
+) -> stripe.StripeClient:
+    """
+    httpx_kwargs go to the underlying httpx client, tests pass an ASGI
+    transport there to talk to the fake server in-process
+    """
+    api_base = api_base or os.getenv("STRIPE_API_BASE")
+    httpx_kwargs.setdefault(
+        "limits", httpx.Limits(max_connections=STRIPE_MAX_CONNECTIONS)
+    )
+    http_client = PooledHTTPXClient(
+        timeout=httpx.Timeout(
+            STRIPE_TIMEOUT_SECONDS, connect=STRIPE_CONNECT_TIMEOUT_SECONDS
+        ),
+        **httpx_kwargs,
+    )
+    return stripe.StripeClient(
+        api_key or os.getenv("STRIPE_SECRET_KEY") or "",
+        base_addresses={"api": api_base} if api_base else None,
+        max_network_retries=STRIPE_MAX_RETRIES,
+        http_client=http_client,
+    )
+
+
+def get_stripe_client() -> stripe.StripeClient:
+    global _client
+    if _client is None:
+        _client = build_stripe_client()
+    return _client
+
+
+def set_stripe_client(client: Optional[stripe.StripeClient]):
+    """Swap the shared client, used by tests and benchmarks"""
+    global _client
+    _client = client
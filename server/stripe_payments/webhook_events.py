@@ -0,0 +1,167 @@
+import asyncio
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import exists
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import StripePayment, StripeWebhookEvents
+
+## Stripe webhooks are handled in two steps
+##
+## The webhook endpoint only verifies the signature and stores the event in
+## stripe_webhook_events (ON CONFLICT DO NOTHING on the event id, so Stripe's
+## redeliveries are stored once) and answers 200 straight away. The worker
+## below picks up pending events with FOR UPDATE SKIP LOCKED, so any number
+## of API workers can run it side by side, and applies them oldest first.
+## An event older than one already applied to the same object is skipped.
+## An event that cannot be applied yet, e.g. payment_intent.succeeded
+## arriving before create-payment stored its row, is retried with backoff.
+
+EVENTS_BATCH_SIZE = int(os.getenv("STRIPE_EVENTS_BATCH_SIZE", "50"))
+EVENTS_POLL_SECONDS = float(os.getenv("STRIPE_EVENTS_POLL_SECONDS", "5"))
+EVENTS_MAX_ATTEMPTS = int(os.getenv("STRIPE_EVENTS_MAX_ATTEMPTS", "12"))
+EVENTS_MAX_BACKOFF_SECONDS = 15 * 60
+
+## Payment status each handled event type moves the payment to
+PAYMENT_STATUS_BY_EVENT = {
+    "payment_intent.succeeded": "succeeded",
+    "payment_intent.payment_failed": "failed",
+    "payment_intent.canceled": "canceled",
+}
+
+
+class EventNotReady(Exception):
+    """The event refers to something that does not exist (yet)"""
+
+
+def store_event(db: Session, event: dict) -> bool:
+    """Store a verified webhook event, False if it was delivered before"""
+    now = datetime.now(timezone.utc)
+    stored = db.execute(
+        insert(StripeWebhookEvents)
+        .values(
+            event_id=event["id"],
+            event_type=event["type"],
+            event_created=event["created"],
+            object_id=event["data"]["object"].get("id"),
+            payload=event,
+            status="pending",
+            attempts=0,
+            received_at=now,
+            next_attempt_at=now,
+        )
+        .on_conflict_do_nothing(index_elements=["event_id"])
+        .returning(StripeWebhookEvents.event_id)
+    ).scalar()
+    db.commit()
+    return stored is not None
+
+
+def apply_event(db: Session, event: StripeWebhookEvents):
+    new_status = PAYMENT_STATUS_BY_EVENT.get(event.event_type)
+    if not new_status:
+        return
+
+    # Stripe does not guarantee delivery order and events can be retried, an
+    # older event must not undo what a newer one already applied
+    newer_applied = db.query(
+        exists().where(
+            StripeWebhookEvents.object_id == event.object_id,
+            StripeWebhookEvents.status == "done",
+            StripeWebhookEvents.event_created > event.event_created,
+        )
+    ).scalar()
+    if newer_applied:
+        return
+
+    intent_id = event.object_id
+    payment = (
+        db.query(StripePayment)
+        .filter(StripePayment.payment_intent_id == intent_id)
+        .with_for_update()
+        .first()
+    )
+    if not payment:
+        raise EventNotReady(f"Payment with intent ID {intent_id} not found")
+
+    payment.status = new_status
+    payment.updated_at = datetime.now(timezone.utc)
+
+
+def retry_delay(attempts: int) -> timedelta:
+    seconds = min(2**attempts, EVENTS_MAX_BACKOFF_SECONDS)
+    return timedelta(seconds=seconds * random.uniform(0.5, 1))
+
+
+def process_pending_events(db: Session, limit: int = EVENTS_BATCH_SIZE) -> dict:
+    """Apply one batch of due events, returns how many were applied/retried"""
+    now = datetime.now(timezone.utc)
+    events = (
+        db.query(StripeWebhookEvents)
+        .filter(
+            StripeWebhookEvents.status == "pending",
+            StripeWebhookEvents.next_attempt_at <= now,
+        )
+        .order_by(StripeWebhookEvents.event_created, StripeWebhookEvents.received_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+
+    result = {"applied": 0, "retried": 0, "failed": 0}
+    for event in events:
+        try:
+            # Savepoint per event, a failing one must not undo the others
+            with db.begin_nested():
+                apply_event(db, event)
+            event.status = "done"
+            event.processed_at = now
+            result["applied"] += 1
+        except Exception as e:
+            event.attempts += 1
+            event.last_error = str(e)
+            if event.attempts >= EVENTS_MAX_ATTEMPTS:
+                event.status = "failed"
+                result["failed"] += 1
+                print(f"Stripe event {event.event_id} failed: {e}", flush=True)
+            else:
+                event.next_attempt_at = now + retry_delay(event.attempts)
+                result["retried"] += 1
+    db.commit()
+    return result
+
+
+def process_all_pending_events() -> dict:
+    totals = {"applied": 0, "retried": 0, "failed": 0}
+    db = SessionLocal()
+    try:
+        while True:
+            result = process_pending_events(db)
+            for key, value in result.items():
+                totals[key] += value
+            if sum(result.values()) < EVENTS_BATCH_SIZE:
+                return totals
+    finally:
+        db.close()
+
+
+## Set by the webhook endpoint so a new event is applied right away instead
+## of at the next poll
+events_waiting = asyncio.Event()
+
+
+async def webhook_event_worker(poll_seconds: float = EVENTS_POLL_SECONDS):
+    while True:
+        try:
+            await asyncio.wait_for(events_waiting.wait(), timeout=poll_seconds)
+        except asyncio.TimeoutError:
+            pass
+        events_waiting.clear()
+        try:
+            await asyncio.to_thread(process_all_pending_events)
+        except Exception as e:
+            print(f"Stripe event worker failed: {e}", flush=True)
@@ -0,0 +1,18 @@
+import pytest
+from fastapi import HTTPException
+
+from admin.admin import bulk_results, check_own_center
+
+
+def test_other_centers_are_forbidden():
+    admin = {"user_info": {"sub": {"user_id": 1, "fitness_center_id": 1}}}
+    check_own_center(1, admin)
+    with pytest.raises(HTTPException) as e:
+        check_own_center(2, admin)
+    assert e.value.status_code == 403
+
+
+def test_filtered_out_users_are_skipped_not_missing():
+    results = bulk_results([1, 2, 3], [1], existing_ids={1, 2})
+    assert [r["status"] for r in results["results"]] == ["updated", "skipped", "not_found"]
+    assert results["updated"] == 1
@@ -0,0 +1,59 @@
+from datetime import date, datetime
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from bookings.booking_codes import (
+    ALPHABET,
+    CODE_SPACE,
+    allocate_booking_code,
+    booking_code,
+    encode,
+    permute,
+)
+
+
+def test_codes_of_a_center_and_day_are_unique():
+    day = date(2025, 1, 6)
+    codes = [booking_code(1, day, number) for number in range(20000)]
+    assert len(set(codes)) == len(codes)
+    assert all(len(code) == 4 and set(code) <= set(ALPHABET) for code in codes)
+
+
+def test_permutation_stays_in_the_code_space_and_depends_on_the_tweak():
+    numbers = [permute(number, b"1:2025-01-06") for number in range(1000)]
+    assert all(0 <= number < CODE_SPACE for number in numbers)
+    assert numbers != [permute(number, b"2:2025-01-06") for number in range(1000)]
+    assert encode(0) == "0000" and encode(CODE_SPACE - 1) == "ZZZZ"
+
+
+def test_allocated_code_skips_codes_already_booked_that_day():
+    engine = create_engine("sqlite://")
+    with Session(engine) as db:
+        for statement in (
+            "CREATE TABLE boxes (box_id INTEGER PRIMARY KEY, fitness_center_fk INTEGER)",
+            "CREATE TABLE bookings (booking_id INTEGER PRIMARY KEY, "
+            "booking_box_id_fk INTEGER, booking_date TIMESTAMP, booking_code TEXT)",
+            "CREATE TABLE booking_code_counters (fitness_center_fk INTEGER, "
+            "day DATE, issued INTEGER, PRIMARY KEY (fitness_center_fk, day))",
+            "INSERT INTO boxes VALUES (1, 7), (2, 8)",
+        ):
+            db.execute(text(statement))
+
+        day = date(2025, 1, 6)
+        # A seeded booking happens to have the code of number 0, the same code
+        # in another center does not matter
+        db.execute(
+            text(
+                "INSERT INTO bookings (booking_box_id_fk, booking_date, booking_code) "
+                "VALUES (1, :booked_at, :code), (2, :booked_at, :other)"
+            ),
+            {
+                "booked_at": datetime(2025, 1, 6, 9),
+                "code": booking_code(7, day, 0),
+                "other": booking_code(7, day, 1),
+            },
+        )
+
+        assert allocate_booking_code(db, 1, datetime(2025, 1, 6, 14)) == booking_code(7, day, 1)
+        assert allocate_booking_code(db, 1, datetime(2025, 1, 6, 15)) == booking_code(7, day, 2)
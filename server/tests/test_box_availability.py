@@ -0,0 +1,18 @@
+from bookings.availability import hours_mask, free_slots
+
+
+def test_hours_mask_is_cut_off_at_midnight():
+    assert hours_mask(10, 2) == 0b11 << 10
+    assert hours_mask(22, 4) == 0b11 << 22
+
+
+def test_free_slots_skip_booked_hours():
+    # Booked 10-12 and 14-15
+    mask = hours_mask(10, 2) | hours_mask(14, 1)
+    starts = [slot["start_hour"] for slot in free_slots(mask, 8, 2)]
+    assert starts == [8, 12, 15, 16, 17, 18, 19, 20, 21, 22]
+    assert free_slots(mask, 9, 1)[0] == {"start_hour": 9, "end_hour": 10}
+
+
+def test_fully_booked_day_has_no_slots():
+    assert free_slots(hours_mask(0, 24), 0, 1) == []
@@ -0,0 +1,64 @@
+import asyncio
+import threading
+
+from admin import box_board
+from admin.box_board import board_diff
+
+
+def box(box_id, is_booked=False, status="Ledigt"):
+    return {"box_id": box_id, "box_availability": status, "is_booked": is_booked}
+
+
+def test_diff_holds_only_changed_and_removed_boxes():
+    old = {1: box(1), 2: box(2), 3: box(3)}
+    new = {1: box(1), 2: box(2, is_booked=True), 4: box(4)}
+    assert board_diff(old, new) == {
+        "changed": [box(2, is_booked=True), box(4)],
+        "removed": [3],
+    }
+    assert board_diff(new, dict(new)) is None
+
+
+def test_subscriber_gets_snapshot_then_diff(monkeypatch):
+    boards = {1: {7: box(7)}}
+    monkeypatch.setattr(box_board, "load_board", lambda center_id: dict(boards[center_id]))
+
+    async def run():
+        queue = await box_board.subscribe(1)
+        assert await queue.get() == ("snapshot", {"boks": [box(7)]})
+
+        # Write paths publish from threadpool threads
+        boards[1] = {7: box(7, is_booked=True)}
+        publisher = threading.Thread(
+            target=box_board.notify_boards, args=({"box_id": 7, "day": None},)
+        )
+        publisher.start()
+        publisher.join()
+
+        message = await asyncio.wait_for(queue.get(), timeout=2)
+        box_board.unsubscribe(1, queue)
+        return message
+
+    assert asyncio.run(run()) == (
+        "diff",
+        {"changed": [box(7, is_booked=True)], "removed": []},
+    )
+
+
+def test_stream_ends_with_error_when_board_does_not_load(monkeypatch):
+    def failing_load(center_id):
+        raise RuntimeError("database down")
+
+    monkeypatch.setattr(box_board, "load_board", failing_load)
+    monkeypatch.setattr(box_board, "LOAD_TIMEOUT_SECONDS", 0.1)
+
+    class Request:
+        async def is_disconnected(self):
+            return False
+
+    async def run():
+        return [message async for message in box_board.board_stream(Request(), 2)]
+
+    messages = asyncio.run(run())
+    assert messages == [box_board.sse("error", {"detail": "Box board could not be loaded"})]
+    assert 2 not in box_board._boards
@@ -0,0 +1,26 @@
+from datetime import datetime
+
+import pytest
+
+from bookings.box_cache import status_label
+from bookings.box_status import parse_status_label
+
+
+def test_parse_status_label():
+    assert parse_status_label("Ledigt") is None
+    assert parse_status_label("Lukket: 2t") == 2
+    assert parse_status_label("Lukket:4t") == 4
+    assert parse_status_label("Lukket: 9t") == 9
+    for label in ("Lukket", "Lukket: t", "Optaget"):
+        with pytest.raises(ValueError):
+            parse_status_label(label)
+
+
+def test_label_counts_down_and_reopens_at_closed_until():
+    closed_until = datetime(2025, 1, 6, 13)
+    # Closed at 10:40 for 2 hours, the booking runs 11-13
+    assert status_label("closed", closed_until, datetime(2025, 1, 6, 10, 40)) == "Lukket: 2t"
+    assert status_label("closed", closed_until, datetime(2025, 1, 6, 12, 0)) == "Lukket: 1t"
+    assert status_label("closed", closed_until, datetime(2025, 1, 6, 12, 45)) == "Lukket: 1t"
+    assert status_label("closed", closed_until, datetime(2025, 1, 6, 13, 0)) == "Ledigt"
+    assert status_label("open", None, datetime(2025, 1, 6, 12)) == "Ledigt"
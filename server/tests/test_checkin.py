@@ -0,0 +1,48 @@
+from datetime import date, datetime
+
+from checkin import checkin_cache
+from checkin.checkin_cache import HourCodes, can_check_in, find_booking
+
+NOW = datetime(2025, 1, 6, 10, 15)
+
+
+def booking(booking_id, start_hour, end_hour, box_id=7):
+    return {
+        "booking_id": booking_id,
+        "box_id": box_id,
+        "start_hour": start_hour,
+        "end_hour": end_hour,
+    }
+
+
+def test_can_check_in_during_the_booking_or_just_before():
+    assert can_check_in(booking(1, 9, 11), NOW)
+    assert not can_check_in(booking(1, 8, 10), NOW)
+    assert not can_check_in(booking(1, 11, 12), NOW)
+    assert can_check_in(booking(1, 11, 12), NOW.replace(minute=52))
+
+
+def test_codes_are_loaded_once_and_dropped_when_a_box_changes(monkeypatch):
+    loads = []
+
+    def load(db, fitness_center_id, now):
+        loads.append(fitness_center_id)
+        return HourCodes(now.date(), now.hour, frozenset({7}), {"AB12": [booking(1, 10, 11)]})
+
+    monkeypatch.setattr(checkin_cache, "load_hour_codes", load)
+    monkeypatch.setattr(checkin_cache, "_cache", {})
+    monkeypatch.setitem(checkin_cache.event_listener.state, "connected", True)
+
+    assert find_booking(None, 1, " ab12", NOW)["booking_id"] == 1
+    assert find_booking(None, 1, "ZZZZ", NOW) is None
+    assert loads == [1]
+
+    # Other days and other boxes keep the codes
+    checkin_cache.invalidate({"box_id": 7, "day": "2000-01-01"})
+    checkin_cache.invalidate({"box_id": 8, "day": None})
+    find_booking(None, 1, "AB12", NOW)
+    assert loads == [1]
+
+    checkin_cache.invalidate({"box_id": 7, "day": date.today().isoformat()})
+    find_booking(None, 1, "AB12", NOW)
+    assert loads == [1, 1]
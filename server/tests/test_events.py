@@ -0,0 +1,93 @@
+import json
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+import event_listener
+import events
+
+
+def recorder(topic, monkeypatch):
+    received = []
+    monkeypatch.setitem(events._subscribers, topic, [received.append])
+    return received
+
+
+def test_emitted_events_are_published_once_after_commit(monkeypatch):
+    received = recorder(events.BOOKINGS_CHANGED, monkeypatch)
+    session = Session(create_engine("sqlite://"))
+
+    events.emit(session, events.BOOKINGS_CHANGED, {"box_id": 1, "day": "2025-01-06"})
+    events.emit(session, events.BOOKINGS_CHANGED, {"box_id": 1, "day": "2025-01-06"})
+    assert received == []
+    session.commit()
+    assert received == [{"box_id": 1, "day": "2025-01-06"}]
+
+    # Events of a rolled back transaction are dropped
+    session.execute(text("SELECT 1"))
+    events.emit(session, events.BOOKINGS_CHANGED, {"box_id": 2, "day": None})
+    session.rollback()
+    session.commit()
+    assert len(received) == 1
+
+
+def message(sender, sequence, box_id=1):
+    return json.dumps(
+        {
+            "t": events.BOOKINGS_CHANGED,
+            "p": {"box_id": box_id, "day": None},
+            "s": sender,
+            "n": sequence,
+        }
+    )
+
+
+def test_listener_skips_own_events_and_resyncs_on_gaps(monkeypatch):
+    received = recorder(events.BOOKINGS_CHANGED, monkeypatch)
+    resyncs = recorder(events.RESYNC, monkeypatch)
+    monkeypatch.setattr(event_listener, "_senders", {})
+
+    event_listener.dispatch(
+        [message("other", 1), message("other", 2, 2), message(events.SENDER_ID, 1)],
+        now=0,
+    )
+    assert [payload["box_id"] for payload in received] == [1, 2]
+
+    # Sequence 3 of the other worker never arrives
+    event_listener.dispatch([message("other", 4)], now=1)
+    assert resyncs == []
+    event_listener.check_gaps(now=1 + event_listener.EVENT_GAP_GRACE_SECONDS)
+    assert resyncs == [{"reason": "gap"}]
+    assert len(received) == 3
+
+    # A late arrival of the given up number is not published again
+    event_listener.dispatch([message("other", 3)], now=10)
+    assert len(received) == 3
+
+
+def test_listener_accepts_events_out_of_order(monkeypatch):
+    received = recorder(events.BOOKINGS_CHANGED, monkeypatch)
+    resyncs = recorder(events.RESYNC, monkeypatch)
+    monkeypatch.setattr(event_listener, "_senders", {})
+
+    # Two transactions took 2 and 3 but committed in the other order
+    event_listener.dispatch([message("other", 1)], now=0)
+    event_listener.dispatch([message("other", 3, 3)], now=0.1)
+    event_listener.dispatch([message("other", 2, 2)], now=0.2)
+    # Duplicates and older numbers are skipped
+    event_listener.dispatch([message("other", 2, 2), message("other", 1)], now=0.3)
+    event_listener.check_gaps(now=60)
+
+    assert [payload["box_id"] for payload in received] == [1, 3, 2]
+    assert resyncs == []
+
+
+def test_listener_resyncs_instead_of_replaying_a_backlog(monkeypatch):
+    received = recorder(events.BOOKINGS_CHANGED, monkeypatch)
+    resyncs = recorder(events.RESYNC, monkeypatch)
+    monkeypatch.setattr(event_listener, "_senders", {})
+    monkeypatch.setattr(event_listener, "EVENT_BACKLOG_LIMIT", 3)
+
+    event_listener.dispatch([message("other", n) for n in range(1, 6)])
+    assert received == []
+    assert resyncs == [{"reason": "backlog"}]
@@ -0,0 +1,133 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event, text
+
+from instrumentation import (
+    InstrumentationMiddleware,
+    _statement_observers,
+    instrument_engine,
+    metrics_text,
+    register_statement_observer,
+    reset_metrics,
+    route_metrics,
+)
+
+
+def build_app():
+    engine = create_engine("sqlite://")
+    instrument_engine(engine)
+    app = FastAPI()
+    app.add_middleware(InstrumentationMiddleware)
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: int):
+        # Sync endpoints run in the threadpool, the statements still count
+        with engine.connect() as conn:
+            for _ in range(3):
+                conn.execute(text("SELECT 1"))
+        return {"item_id": item_id}
+
+    @app.get("/stream")
+    def stream():
+        async def body():
+            yield "event: snapshot\n\n"
+            await asyncio.sleep(0.2)
+            yield "event: diff\n\n"
+
+        return StreamingResponse(body(), media_type="text/event-stream")
+
+    return app
+
+
+def test_streamed_body_is_not_counted_as_latency():
+    reset_metrics()
+    TestClient(build_app()).get("/stream")
+
+    (metrics,) = route_metrics()
+    assert metrics["avg_seconds"] < 0.1
+    assert metrics["avg_body_seconds"] >= 0.2
+
+
+def test_server_timing_counts_statements():
+    reset_metrics()
+    response = TestClient(build_app()).get("/items/1")
+    assert response.status_code == 200
+    assert 'desc="3 queries"' in response.headers["server-timing"]
+
+
+def test_metrics_are_labelled_with_the_route_template():
+    reset_metrics()
+    client = TestClient(build_app())
+    client.get("/items/1")
+    client.get("/items/2")
+
+    metrics = metrics_text()
+    labels = 'method="GET",route="/items/{item_id}"'
+    assert f"http_request_duration_seconds_count{{{labels}}} 2" in metrics
+    assert f"db_statements_total{{{labels}}} 6" in metrics
+    assert f'http_requests_total{{{labels},status="200"}} 2' in metrics
+
+
+def test_failed_statement_does_not_leak_timers():
+    engine = create_engine("sqlite://")
+    instrument_engine(engine)
+    with engine.connect() as conn:
+        try:
+            conn.execute(text("SELECT * FROM missing_table"))
+        except Exception:
+            pass
+        conn.execute(text("SELECT 1"))
+        assert conn.connection.info["query_start_time"] == []
+
+
+def test_statement_observers_see_every_statement():
+    seen = []
+
+    def observer(conn, statement, parameters, executemany, seconds):
+        seen.append((statement, parameters, seconds))
+
+    engine = create_engine("sqlite://")
+    instrument_engine(engine)
+    register_statement_observer(observer)
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT :value"), {"value": "secret@example.com"})
+    finally:
+        _statement_observers.remove(observer)
+
+    assert [statement for statement, _, _ in seen] == ["SELECT ?"]
+    assert seen[0][2] >= 0
+
+
+def test_slow_query_log_redacts_parameters():
+    from database import redact_parameters
+
+    assert redact_parameters({"email": "a@b.c", "id": 1}) == {"email": "str", "id": "int"}
+    assert redact_parameters(("0612345678",)) == ["str"]
+    assert redact_parameters([{"hash": "x"}, {"hash": "y"}], executemany=True) == {
+        "rows": 2,
+        "first": {"hash": "str"},
+    }
+
+
+def test_slow_query_plan_does_not_run_the_statement_again(monkeypatch):
+    import database
+
+    calls = []
+    engine = create_engine("sqlite://")
+
+    @event.listens_for(engine, "connect")
+    def add_functions(dbapi_connection, _):
+        # Stand-ins for Postgres functions with side effects
+        dbapi_connection.create_function("pg_notify", 2, lambda *args: calls.append(args))
+        dbapi_connection.create_function("setval", 2, lambda *args: calls.append(args))
+
+    monkeypatch.setattr(database, "engine", engine)
+    for statement in ("SELECT pg_notify(?, ?)", "SELECT setval(?, ?)"):
+        entry = {"plan": None}
+        database.capture_plan(entry, statement, ("fitboks_events", 1))
+        assert not entry["plan"].startswith("EXPLAIN failed")
+    assert calls == []
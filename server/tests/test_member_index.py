@@ -0,0 +1,56 @@
+import events
+from admin.member_index import MemberIndex, on_resync, on_user_changed, on_user_deleted
+
+
+def member(user_id, center, first, last, email, phone, is_member=True):
+    return {
+        "user_id": user_id,
+        "fitness_center_id": center,
+        "first_name": first,
+        "last_name": last,
+        "email": email,
+        "phone": phone,
+        "is_member": is_member,
+    }
+
+
+def build_index(*records):
+    index = MemberIndex()
+    for record in records:
+        index.upsert(record)
+    return index
+
+
+def test_prefix_search_on_names_email_and_phone():
+    index = build_index(
+        member(1, 1, "Mette", "Jensen", "mette@fitboks.dk", "22334455"),
+        member(2, 1, "Mikkel", "Hansen", "mh@gmail.com", "22119900"),
+        member(3, 2, "Mette", "Larsen", "ml@gmail.com", "40404040"),
+    )
+
+    assert [u["user_id"] for u in index.search(1, "met")] == [1]
+    assert [u["user_id"] for u in index.search(1, "Mette J")] == [1]
+    assert [u["user_id"] for u in index.search(1, "han")] == [2]
+    assert [u["user_id"] for u in index.search(1, "22 33")] == [1]
+    assert sorted(u["user_id"] for u in index.search(1, "22")) == [1, 2]
+    assert index.search(2, "mikkel") == []
+
+
+def test_upsert_replaces_old_keys_and_remove_drops_user():
+    index = build_index(member(1, 1, "Mette", "Jensen", "mette@fitboks.dk", "22334455"))
+
+    index.upsert(member(1, 1, "Mette", "Nielsen", "mette@fitboks.dk", "22334455", False))
+    assert index.search(1, "jensen") == []
+    assert index.search(1, "nielsen")[0]["is_member"] is False
+
+    index.remove(1)
+    assert index.search(1, "mette") == []
+
+
+def test_user_events_are_subscribed_once():
+    for topic, handler in (
+        (events.USER_CHANGED, on_user_changed),
+        (events.USER_DELETED, on_user_deleted),
+        (events.RESYNC, on_resync),
+    ):
+        assert events._subscribers[topic].count(handler) == 1
@@ -0,0 +1,31 @@
+import pytest
+from fastapi import HTTPException
+from pagination import encode_cursor, decode_cursor, cached_count, invalidate_counts
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor({"user_id": 1234})
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == {"user_id": 1234}
+
+
+def test_invalid_cursor_is_rejected():
+    with pytest.raises(HTTPException) as e:
+        decode_cursor("not a cursor!")
+    assert e.value.status_code == 400
+
+
+def test_cached_count_reuses_value_until_invalidated():
+    calls = []
+
+    def count():
+        calls.append(1)
+        return 42
+
+    assert cached_count(("users", 1, ""), count) == 42
+    assert cached_count(("users", 1, ""), count) == 42
+    assert len(calls) == 1
+
+    invalidate_counts("users")
+    cached_count(("users", 1, ""), count)
+    assert len(calls) == 2
@@ -0,0 +1,38 @@
+import asyncio
+
+import httpx
+import pytest
+
+from stripe_payments import fake_stripe
+from stripe_payments.reconciliation import fetch_intent_statuses
+from stripe_payments.stripe_client import build_stripe_client
+
+
+@pytest.fixture
+def client():
+    fake_stripe.reset()
+    return build_stripe_client(
+        api_key="sk_test_fake",
+        api_base="http://fake-stripe",
+        transport=httpx.ASGITransport(app=fake_stripe.app),
+    )
+
+
+def test_fetch_intent_statuses(client):
+    async def run():
+        ids = []
+        for _ in range(5):
+            intent = await client.v1.payment_intents.create_async(
+                params={"amount": 1000, "currency": "dkk"}
+            )
+            ids.append(intent.id)
+        fake_stripe.payment_intents[ids[0]]["status"] = "succeeded"
+        fake_stripe.payment_intents[ids[1]]["status"] = "canceled"
+        return ids, await fetch_intent_statuses(client, ids + ["pi_missing"], 2)
+
+    ids, statuses = asyncio.run(run())
+    assert statuses[ids[0]] == "succeeded"
+    assert statuses[ids[1]] == "canceled"
+    assert statuses[ids[2]] == "requires_payment_method"
+    # Unknown intents are left out instead of failing the whole batch
+    assert "pi_missing" not in statuses
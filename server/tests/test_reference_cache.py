@@ -0,0 +1,92 @@
+import time
+from datetime import datetime
+from threading import Thread
+
+from bookings.box_cache import CenterBoxes, to_seconds
+from reference_cache import ReferenceCache, SharedMemoryStore
+
+
+def counting_loader(value):
+    calls = []
+
+    def load():
+        calls.append(1)
+        return value
+
+    return load, calls
+
+
+def test_second_lookup_is_served_from_the_worker_memo(tmp_path):
+    cache = ReferenceCache(SharedMemoryStore(str(tmp_path)))
+    load, calls = counting_loader([[1, "admin"]])
+    assert cache.get("roles", "all", load, dict) == {1: "admin"}
+    assert cache.get("roles", "all", load, dict) == {1: "admin"}
+    assert len(calls) == 1
+    assert cache.stats()["roles"]["local"] == 1
+
+
+def test_workers_share_loaded_values_and_invalidations(tmp_path):
+    # Two caches on the same directory behave like two uvicorn workers
+    worker_a = ReferenceCache(SharedMemoryStore(str(tmp_path)))
+    worker_b = ReferenceCache(SharedMemoryStore(str(tmp_path)))
+    load, calls = counting_loader([{"box_id": 1}])
+
+    worker_a.get("boxes", 1, load)
+    assert worker_b.get("boxes", 1, load) == [{"box_id": 1}]
+    assert len(calls) == 1
+    assert worker_b.stats()["boxes"]["shared"] == 1
+
+    # A write on worker A reloads the value on worker B as well
+    worker_a.invalidate("boxes")
+    load_new, new_calls = counting_loader([{"box_id": 1}, {"box_id": 2}])
+    assert worker_b.get("boxes", 1, load_new) == [{"box_id": 1}, {"box_id": 2}]
+    assert len(new_calls) == 1
+
+
+def test_broken_store_falls_back_to_the_loader(tmp_path):
+    class BrokenStore(SharedMemoryStore):
+        def version(self, namespace):
+            raise OSError("no space left on device")
+
+    cache = ReferenceCache(BrokenStore(str(tmp_path)))
+    load, calls = counting_loader(["value"])
+    assert cache.get("centers", "all", load) == ["value"]
+    assert cache.stats()["centers"]["error"] == 1
+
+
+def test_concurrent_misses_load_once(tmp_path):
+    cache = ReferenceCache(SharedMemoryStore(str(tmp_path)))
+    calls = []
+
+    def slow_load():
+        calls.append(1)
+        time.sleep(0.05)
+        return [[1, 10, "Ledigt", 0]]
+
+    threads = [
+        Thread(target=cache.get, args=("boxes", 1, slow_load)) for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+
+
+def test_center_boxes_arrays():
+    closed_until = datetime(2025, 1, 6, 12)
+    boxes = CenterBoxes(
+        3,
+        [[7, 2, "closed", to_seconds(closed_until), 60], [5, 1, "open", 0, 0]],
+    )
+    assert list(boxes.box_ids) == [5, 7]
+    assert boxes.get(7, now=datetime(2025, 1, 6, 10, 5)) == {
+        "box_id": 7,
+        "created_at": "1970-01-01 00:01:00",
+        "box_number": 2,
+        "box_availability": "Lukket: 2t",
+        "box_state": "closed",
+        "closed_until": "2025-01-06T12:00:00",
+        "fitness_center_fk": 3,
+    }
+    assert boxes.get(6) is None
@@ -0,0 +1,61 @@
+import asyncio
+
+import httpx
+import pytest
+
+from stripe_payments import fake_stripe
+from stripe_payments.stripe_client import PooledHTTPXClient, build_stripe_client
+
+
+@pytest.fixture
+def client():
+    fake_stripe.reset()
+    return build_stripe_client(
+        api_key="sk_test_fake",
+        api_base="http://fake-stripe",
+        transport=httpx.ASGITransport(app=fake_stripe.app),
+    )
+
+
+def create_intent(client, idempotency_key: str):
+    return asyncio.run(
+        client.v1.payment_intents.create_async(
+            params={"amount": 1000, "currency": "dkk", "metadata": {"user_id": "1"}},
+            options={"idempotency_key": idempotency_key},
+        )
+    )
+
+
+def test_create_payment_intent(client):
+    intent = create_intent(client, "key-1")
+    assert intent.id.startswith("pi_")
+    assert intent.client_secret
+    assert intent.metadata["user_id"] == "1"
+
+
+def test_same_idempotency_key_returns_same_intent(client):
+    assert create_intent(client, "key-1").id == create_intent(client, "key-1").id
+    assert create_intent(client, "key-2").id != create_intent(client, "key-1").id
+
+
+def test_server_errors_are_retried(client):
+    fake_stripe.config["fail_next"] = 1
+    intent = create_intent(client, "key-1")
+    assert intent.id in fake_stripe.payment_intents
+    assert fake_stripe.stats == {"requests": 2, "failures": 1}
+
+
+def test_replaced_httpx_client_is_closed(monkeypatch):
+    created = []
+
+    class RecordingAsyncClient(httpx.AsyncClient):
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            created.append(self)
+
+    monkeypatch.setattr(httpx, "AsyncClient", RecordingAsyncClient)
+    PooledHTTPXClient(timeout=1, transport=httpx.ASGITransport(app=fake_stripe.app))
+
+    stripe_default, configured = created
+    assert stripe_default.is_closed
+    assert not configured.is_closed